@@ -0,0 +1,179 @@
+"""Минимальный mqtt 3.1.1 брокер для локальных тестов производительности."""
+import asyncio
+import struct
+from typing import List, Optional, Set, Tuple
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """Проверка соответствия топика фильтру с подстановочными символами"""
+
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level not in ("+", topic_levels[index]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def encode_length(length: int) -> bytes:
+    """Кодирование оставшейся длины пакета"""
+
+    encoded = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        encoded.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(value: bytes) -> bytes:
+    """Строка mqtt: два байта длины и данные"""
+    return struct.pack("!H", len(value)) + value
+
+
+def packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    """Сборка пакета mqtt"""
+    return bytes([(packet_type << 4) | flags]) + encode_length(len(body)) + body
+
+
+class Session:
+    """Подключение одного клиента к брокеру"""
+
+    def __init__(self, broker: "FakeBroker", writer: asyncio.StreamWriter):
+        self.broker = broker
+        self.writer = writer
+        self.filters: Set[str] = set()
+        self.next_mid = 0
+
+    def deliver(self, topic: str, payload: bytes, qos: int):
+        """Отправка сообщения клиенту"""
+
+        body = encode_string(topic.encode())
+        if qos:
+            self.next_mid = self.next_mid % 65535 + 1
+            body += struct.pack("!H", self.next_mid)
+        self.writer.write(packet(PUBLISH, qos << 1, body + payload))
+
+
+class FakeBroker:
+    """
+    Брокер, достаточный для paho клиента: подключение, публикация QoS 0/1/2,
+    подписка с подстановочными символами и ее отмена.
+
+    Если задан reply_delay, на каждую публикацию в топик .../in/params
+    брокер через reply_delay секунд сам публикует ответ в .../out/info.
+    Если acknowledge равен False, публикации QoS 1 и 2 не подтверждаются (зависший брокер).
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 reply_delay: Optional[float] = None, reply_payload: bytes = b"pong"):
+        self.host = host
+        self.port = port
+        self.reply_delay = reply_delay
+        self.reply_payload = reply_payload
+        self.sessions: List[Session] = []
+        self.published = 0
+        self.acknowledge = True
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        """Запуск брокера. Фактический порт сохраняется в self.port."""
+
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Остановка брокера и закрытие подключений"""
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for session in list(self.sessions):
+            session.writer.close()
+
+    def route(self, topic: str, payload: bytes):
+        """Доставка сообщения всем подписанным клиентам"""
+
+        self.published += 1
+        for session in list(self.sessions):
+            if any(topic_matches(topic_filter, topic) for topic_filter in session.filters):
+                session.deliver(topic, payload, 0)
+
+        if self.reply_delay is not None and topic.endswith("/in/params"):
+            reply_topic = topic[:-len("/in/params")] + "/out/info"
+            asyncio.get_running_loop().call_later(self.reply_delay, self.route,
+                                                  reply_topic, self.reply_payload)
+
+    async def _read_packet(self, reader: asyncio.StreamReader) -> Tuple[int, int, bytes]:
+        header = (await reader.readexactly(1))[0]
+        multiplier, length = 1, 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            if not byte & 0x80:
+                break
+            multiplier *= 128
+        return header >> 4, header & 0x0F, await reader.readexactly(length)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = Session(self, writer)
+        self.sessions.append(session)
+        try:
+            while True:
+                packet_type, flags, body = await self._read_packet(reader)
+                if not self._dispatch(session, packet_type, flags, body):
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.sessions.remove(session)
+            writer.close()
+
+    def _dispatch(self, session: Session, packet_type: int, flags: int, body: bytes) -> bool:
+        writer = session.writer
+
+        if packet_type == CONNECT:
+            writer.write(packet(CONNACK, 0, b"\x00\x00"))
+        elif packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            topic_length = struct.unpack("!H", body[:2])[0]
+            topic = body[2:2 + topic_length].decode()
+            offset = 2 + topic_length
+            if qos:
+                mid = body[offset:offset + 2]
+                offset += 2
+                if not self.acknowledge:
+                    return True
+                writer.write(packet(PUBACK if qos == 1 else PUBREC, 0, mid))
+            self.route(topic, body[offset:])
+        elif packet_type == PUBREL:
+            writer.write(packet(PUBCOMP, 0, body[:2]))
+        elif packet_type == SUBSCRIBE:
+            mid, offset, granted = body[:2], 2, bytearray()
+            while offset < len(body):
+                length = struct.unpack("!H", body[offset:offset + 2])[0]
+                session.filters.add(body[offset + 2:offset + 2 + length].decode())
+                offset += 2 + length + 1
+                granted.append(0)
+            writer.write(packet(SUBACK, 0, mid + bytes(granted)))
+        elif packet_type == UNSUBSCRIBE:
+            offset = 2
+            while offset < len(body):
+                length = struct.unpack("!H", body[offset:offset + 2])[0]
+                session.filters.discard(body[offset + 2:offset + 2 + length].decode())
+                offset += 2 + length
+            writer.write(packet(UNSUBACK, 0, body[:2]))
+        elif packet_type == PINGREQ:
+            writer.write(packet(PINGRESP, 0, b""))
+        elif packet_type == DISCONNECT:
+            return False
+
+        return True
@@ -0,0 +1,74 @@
+"""
+Время запуска: импорт модулей сервиса в новом интерпретаторе и запуск рабочего процесса (spawn).
+
+Для каждого модуля несколько раз запускается `python -c "import ..."` и берется медиана.
+Отдельно измеряется время от запуска процесса spawn, который импортирует message_listener,
+до его завершения (столько же тратит на импорт каждый рабочий процесс supervisor).
+
+Запуск из корня репозитория:
+    python -m benchmarks.import_bench --repeat 7
+"""
+import argparse
+import importlib
+import multiprocessing
+import subprocess
+import sys
+from statistics import median
+from time import perf_counter
+from typing import List
+
+MODULES = ("src.mqtt_pub.config",
+           "src.mqtt_pub.user_auth",
+           "src.mqtt_pub.client",
+           "src.mqtt_pub.mqtt_writer",
+           "src.mqtt_pub.message_listener")
+
+
+def import_time(module: str, repeat: int) -> float:
+    """Медиана времени запуска интерпретатора с импортом module (мс)"""
+
+    times: List[float] = []
+    for _ in range(repeat):
+        started = perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+        times.append((perf_counter() - started) * 1000)
+    return median(times)
+
+
+def spawn_target():
+    """Рабочий процесс: только импорт обработчика сообщений"""
+    # Модуль не используется: измеряется только время импорта
+    importlib.import_module("src.mqtt_pub.message_listener")
+
+
+def spawn_time(repeat: int) -> float:
+    """Медиана времени запуска процесса spawn с импортом message_listener (мс)"""
+
+    context = multiprocessing.get_context("spawn")
+    times: List[float] = []
+    for _ in range(repeat):
+        started = perf_counter()
+        process = context.Process(target=spawn_target)
+        process.start()
+        process.join()
+        times.append((perf_counter() - started) * 1000)
+    return median(times)
+
+
+def main():
+    """Запуск измерений"""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=7, help="повторов каждого измерения")
+    args = parser.parse_args()
+
+    baseline = import_time("sys", args.repeat)
+    print(f"{'python без импорта':>32}: {baseline:7.1f} мс")
+    for module in MODULES:
+        print(f"{module:>32}: {import_time(module, args.repeat):7.1f} мс")
+    print(f"{'spawn + message_listener':>32}: {spawn_time(args.repeat):7.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
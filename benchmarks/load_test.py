@@ -0,0 +1,302 @@
+"""
+Нагрузочное тестирование message_listener.
+
+Сервис запускается в текущем процессе и подключается к локальному брокеру FakeBroker,
+который отвечает в .../out/info на каждую публикацию в .../in/params.
+Клиенты отправляют запросы конкурентно, для каждого сценария измеряется
+пропускная способность и задержки p50/p95/p99.
+
+Результаты сохраняются в benchmarks/results и сравниваются с предыдущим запуском.
+
+Запуск из корня репозитория:
+    python -m benchmarks.load_test --requests 2000 --concurrency 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+from datetime import datetime
+from statistics import quantiles
+from time import perf_counter
+from typing import Awaitable, Callable, Dict, List, Optional
+from src.mqtt_pub import config  # type: ignore
+from src.mqtt_pub.framing import FRAMING_LEGACY, encode_frame, read_frame  # type: ignore
+from src.mqtt_pub.message_listener import open_socket  # type: ignore
+from .fake_broker import FakeBroker
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+BENCH_USER = "benchmark"
+BENCH_PASSWORD_HASH = "0" * 64 + "1" * 64
+SCENARIOS = ("publish", "auth", "request_reply")
+
+
+def free_port() -> int:
+    """Свободный tcp порт"""
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def build_request(scenario: str, index: int) -> dict:
+    """Запрос клиента для сценария"""
+
+    if scenario == "auth":
+        return {"message": "/check_auth", "user": BENCH_USER, "password": BENCH_PASSWORD_HASH}
+
+    suffix = "in/params" if scenario == "request_reply" else "in/setup"
+    return {"topic": f"/{BENCH_USER}/device{index % 50}/{suffix}",
+            "message": "ping",
+            "user": BENCH_USER,
+            "password": BENCH_PASSWORD_HASH}
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    """p50, p95, p99 в миллисекундах"""
+
+    if len(latencies) < 2:
+        value = latencies[0] * 1000 if latencies else 0.0
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value}
+
+    cuts = quantiles(latencies, n=100, method="inclusive")
+    return {"p50_ms": round(cuts[49] * 1000, 3),
+            "p95_ms": round(cuts[94] * 1000, 3),
+            "p99_ms": round(cuts[98] * 1000, 3)}
+
+
+class LoadTest:
+    """Запуск сервиса, брокера и клиентов"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.broker = FakeBroker(reply_delay=args.reply_delay)
+        self.socket_port = free_port()
+        self.broker_loop = asyncio.new_event_loop()
+
+    def start(self):
+        """Запуск брокера и сервиса в фоновых потоках"""
+
+        threading.Thread(target=self.broker_loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.broker.start(), self.broker_loop).result()
+
+        config.context.registered_users[BENCH_USER] = BENCH_PASSWORD_HASH
+
+        settings_to_socket = config.get_settings_to_socket()
+        settings_to_socket.update(socket_host="127.0.0.1", socket_port=self.socket_port,
+                                  use_ssl=False, socket_framing=self.args.framing)
+
+        settings_to_publish = config.get_settings_to_publish()
+        settings_to_publish["broker_settings"].update(host="127.0.0.1", port=self.broker.port)
+        settings_to_publish["broker_use_tls"] = False
+        settings_to_publish["spool"]["path"] = os.path.join(tempfile.mkdtemp(), "outbound.db")
+
+        threading.Thread(target=open_socket, args=(settings_to_socket, settings_to_publish),
+                         daemon=True).start()
+
+    async def wait_ready(self):
+        """Ожидание, пока сервис начнет принимать подключения"""
+
+        for _ in range(100):
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", self.socket_port)
+                writer.close()
+                return
+            except OSError:
+                await asyncio.sleep(0.05)
+        raise RuntimeError("Сервис не запустился")
+
+    async def legacy_request(self, request: dict) -> bytes:
+        """Одно подключение на запрос"""
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.socket_port)
+        writer.write(json.dumps(request).encode())
+        await writer.drain()
+        answer = await reader.read(65536)
+        writer.close()
+        return answer
+
+    async def run_scenario(self, scenario: str) -> Dict[str, float]:
+        """Выполнение args.requests запросов с args.concurrency одновременными клиентами"""
+
+        latencies: List[float] = []
+        errors = 0
+        counter = iter(range(self.args.requests))
+
+        async def client(send: Callable[[dict], Awaitable[bytes]]):
+            nonlocal errors
+            for index in counter:
+                started = perf_counter()
+                try:
+                    await send(build_request(scenario, index))
+                except (OSError, asyncio.IncompleteReadError):
+                    errors += 1
+                    continue
+                latencies.append(perf_counter() - started)
+
+        started = perf_counter()
+        if self.args.framing == FRAMING_LEGACY:
+            await asyncio.gather(*(client(self.legacy_request)
+                                   for _ in range(self.args.concurrency)))
+        else:
+            senders = [await FramedConnection.open(self.socket_port, self.args.framing)
+                       for _ in range(self.args.connections)]
+            await asyncio.gather(*(client(senders[number % len(senders)].request)
+                                   for number in range(self.args.concurrency)))
+            for sender in senders:
+                await sender.close()
+        elapsed = perf_counter() - started
+
+        return {"requests": len(latencies),
+                "errors": errors,
+                "throughput_rps": round(len(latencies) / elapsed, 1),
+                **percentiles(latencies)}
+
+    async def run(self) -> Dict[str, Dict[str, float]]:
+        """Все выбранные сценарии"""
+
+        await self.wait_ready()
+        results = {}
+        for scenario in self.args.scenarios:
+            results[scenario] = await self.run_scenario(scenario)
+            print(f"{scenario:>14}: {results[scenario]}")
+        return results
+
+
+class FramedConnection:
+    """Постоянное подключение с несколькими одновременными запросами"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, framing: str):
+        self.reader = reader
+        self.writer = writer
+        self.framing = framing
+        self.waiters: Dict[int, asyncio.Future] = {}
+        self.next_id = 0
+        self.receiver = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def open(cls, port: int, framing: str) -> "FramedConnection":
+        """Подключение к сервису"""
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=1 << 20)
+        return cls(reader, writer, framing)
+
+    async def request(self, request: dict) -> bytes:
+        """Отправка запроса и ожидание ответа с тем же id"""
+
+        self.next_id += 1
+        request_id = self.next_id
+        waiter = self.waiters[request_id] = asyncio.get_running_loop().create_future()
+        self.writer.write(encode_frame(json.dumps({**request, "id": request_id}).encode(),
+                                       self.framing))
+        await self.writer.drain()
+        return await waiter
+
+    async def close(self):
+        """Закрытие подключения"""
+
+        self.writer.close()
+        self.receiver.cancel()
+
+    async def _receive(self):
+        while True:
+            frame = await read_frame(self.reader, self.framing, 1 << 20)
+            if frame is None:
+                for waiter in self.waiters.values():
+                    waiter.set_exception(ConnectionResetError())
+                return
+            answer = json.loads(frame)
+            waiter = self.waiters.pop(answer["id"], None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(frame)
+
+
+def git_version() -> str:
+    """Текущая версия кода (для сравнения результатов)"""
+
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def previous_results() -> Optional[dict]:
+    """Последний сохраненный результат"""
+
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    files = sorted(name for name in os.listdir(RESULTS_DIR) if name.endswith(".json"))
+    if not files:
+        return None
+    with open(os.path.join(RESULTS_DIR, files[-1]), encoding="utf-8") as file:
+        return json.load(file)
+
+
+def compare(current: dict, previous: dict):
+    """Изменение показателей относительно предыдущего запуска"""
+
+    print(f"Сравнение с {previous['version']} ({previous['time']}):")
+    for scenario, values in current["scenarios"].items():
+        before = previous["scenarios"].get(scenario)
+        if not before:
+            continue
+        changes = []
+        for key in ("throughput_rps", "p50_ms", "p99_ms"):
+            if before.get(key):
+                changes.append(f"{key} {100 * (values[key] - before[key]) / before[key]:+.1f}%")
+        print(f"{scenario:>14}: {', '.join(changes)}")
+
+
+def save(results: dict) -> str:
+    """Сохранение результата в RESULTS_DIR"""
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{results['time']}_{results['version']}.json")
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+    return path
+
+
+def parse_args() -> argparse.Namespace:
+    """Параметры запуска"""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=50, help="одновременных клиентов")
+    parser.add_argument("--connections", type=int, default=4,
+                        help="постоянных подключений (для ndjson и length)")
+    parser.add_argument("--reply-delay", type=float, default=0.01,
+                        help="задержка ответа устройства (сек)")
+    parser.add_argument("--framing", default=FRAMING_LEGACY,
+                        choices=(FRAMING_LEGACY, "ndjson", "length"))
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--no-save", action="store_true", help="не сохранять результат")
+    return parser.parse_args()
+
+
+def main():
+    """Запуск нагрузочного теста"""
+
+    args = parse_args()
+    load_test = LoadTest(args)
+    load_test.start()
+
+    results = {"version": git_version(),
+               "time": datetime.now().strftime("%Y%m%dT%H%M%S"),
+               "params": vars(args),
+               "scenarios": asyncio.run(load_test.run())}
+
+    previous = previous_results()
+    if previous:
+        compare(results, previous)
+    if not args.no_save:
+        print("Результат сохранен:", save(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Микробенчмарк разбора и проверки входящих сообщений.
+
+Сравнивается прежняя проверка (json.loads и проверка полей словаря с sorted(keys))
+с текущей (protocol.loads и parse_request) на типичных сообщениях:
+время на сообщение и объем памяти, выделяемой при разборе.
+
+Запуск из корня репозитория:
+    python -m benchmarks.parse_bench --number 200000
+"""
+import argparse
+import json
+import tracemalloc
+from timeit import timeit
+from typing import Callable, Dict
+from src.mqtt_pub import protocol  # type: ignore
+
+PASSWORD_HASH = "0" * 64 + "1" * 64
+MESSAGES: Dict[str, bytes] = {
+    "publish": json.dumps({"topic": "/user/device/in/setup", "message": "on",
+                           "user": "user", "password": PASSWORD_HASH}).encode(),
+    "token": json.dumps({"topic": "/user/device/in/params", "message": "get",
+                         "token": "dXNlcjoxNzAwMDAwMDAwOmFiY2Q.c2lnbmF0dXJl"}).encode(),
+    "check_auth": json.dumps({"message": "/check_auth", "user": "user",
+                              "password": PASSWORD_HASH}).encode(),
+    "batch": json.dumps({"batch": [{"topic": f"/user/device{index}/in/setup", "message": "on"}
+                                   for index in range(20)],
+                         "user": "user", "password": PASSWORD_HASH}).encode(),
+}
+
+
+def legacy_parse(request: bytes) -> bool:
+    """Разбор и проверка сообщения до перехода на protocol.py"""
+
+    received_message = json.loads(request.decode("utf-8"))
+    if not isinstance(received_message, dict):
+        return False
+
+    if received_message.get("message") == "/get_salt" and received_message.get("user"):
+        return True
+
+    if received_message.get("message") in ("/check_auth", "/login") \
+            and received_message.get("user") and received_message.get("password"):
+        return True
+
+    if received_message.get("message") == "/logout" and received_message.get("token"):
+        return True
+
+    keys = sorted(list(received_message.keys()))
+    if keys in (["batch", "password", "user"], ["batch", "token"]):
+        batch = received_message["batch"]
+        return isinstance(batch, list) and 0 < len(batch) <= 1000 and all(
+            isinstance(item, dict) and sorted(list(item.keys())) == ["message", "topic"]
+            and isinstance(item["topic"], str) for item in batch)
+
+    return keys in (["message", "password", "topic", "user"], ["message", "token", "topic"])
+
+
+def current_parse(request: bytes) -> bool:
+    """Текущий разбор и проверка сообщения"""
+    return protocol.parse_request(protocol.loads(request)) is not None
+
+
+def allocated(function: Callable[[bytes], bool], request: bytes) -> int:
+    """Максимальный объем памяти (байт), выделяемой во время одного вызова"""
+
+    function(request)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    function(request)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - before
+
+
+def main():
+    """Запуск микробенчмарка"""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=100000, help="вызовов на сообщение")
+    args = parser.parse_args()
+
+    print(f"JSON: {protocol.JSON_BACKEND}")
+    print(f"{'сообщение':>12} {'до, мкс':>9} {'после, мкс':>11} {'до, байт':>9} {'после, байт':>12}")
+    for name, request in MESSAGES.items():
+        assert legacy_parse(request) and current_parse(request)
+        number = max(1, args.number // (20 if name == "batch" else 1))
+        before = timeit(lambda: legacy_parse(request), number=number) / number * 1e6
+        after = timeit(lambda: current_parse(request), number=number) / number * 1e6
+        print(f"{name:>12} {before:>9.2f} {after:>11.2f} "
+              f"{allocated(legacy_parse, request):>9.0f} {allocated(current_parse, request):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
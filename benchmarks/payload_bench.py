@@ -0,0 +1,103 @@
+"""
+Размер сообщений и процессорное время кодирования и сжатия (payload.py).
+
+Для нескольких видов данных (JSON параметров устройства, текстовый журнал, двоичные данные
+прошивки - случайные байты) сравниваются варианты передачи: text/binary без сжатия, base64,
+zlib с разными уровнями и zstd (если установлена библиотека zstandard). Для каждого варианта
+выводятся размер данных на сокете/в брокере и время кодирования и декодирования одного сообщения.
+
+Запуск из корня репозитория:
+    python -m benchmarks.payload_bench --size 65536 --repeat 200
+"""
+import argparse
+import base64
+import json
+import os
+import random
+from time import process_time
+from typing import Callable, Dict, List, Optional, Tuple
+from src.mqtt_pub import payload  # type: ignore
+
+Codec = Tuple[str, Optional[str], Optional[int]]
+
+
+def sample_data(size: int) -> Dict[str, bytes]:
+    """Данные для измерений размером около size байт"""
+
+    rnd = random.Random(1)
+    params = []
+    while len(json.dumps(params)) < size:
+        params.append({"name": f"sensor_{len(params)}", "value": round(rnd.uniform(0, 100), 2),
+                       "state": rnd.choice(["on", "off", "error"])})
+    lines = []
+    while sum(map(len, lines)) < size:
+        lines.append(f"2024-01-01 00:00:{len(lines) % 60:02d} INFO device {rnd.randint(1, 9)} "
+                     f"temperature {rnd.randint(10, 40)}\n")
+    return {"json": json.dumps(params).encode()[:size],
+            "log": "".join(lines).encode()[:size],
+            "firmware": os.urandom(size)}
+
+
+def codecs() -> List[Codec]:
+    """Варианты передачи: (кодировка, сжатие, уровень)"""
+
+    result: List[Codec] = [(payload.ENCODING_BINARY, None, None),
+                           (payload.ENCODING_BASE64, None, None)]
+    result += [(payload.ENCODING_BINARY, payload.COMPRESSION_ZLIB, level) for level in (1, 6, 9)]
+    if payload.COMPRESSION_ZSTD in payload.COMPRESSIONS:
+        result += [(payload.ENCODING_BINARY, payload.COMPRESSION_ZSTD, level) for level in (1, 3, 9)]
+    return result
+
+
+def timed(function: Callable[[], object], repeat: int) -> float:
+    """Процессорное время одного вызова, мс"""
+
+    started = process_time()
+    for _ in range(repeat):
+        function()
+    return (process_time() - started) / repeat * 1000
+
+
+def measure(data: bytes, codec: Codec, repeat: int) -> Dict[str, float]:
+    """Размер закодированных данных и время кодирования и декодирования"""
+
+    encoding, compression, level = codec
+
+    def encode():
+        packed = data if compression is None else payload.compress(data, compression, level)
+        if encoding == payload.ENCODING_BASE64:
+            return base64.b64encode(packed).decode("ascii")
+        return packed
+
+    encoded = encode()
+    if encoding == payload.ENCODING_BINARY:
+        encoded = memoryview(encoded)
+
+    def decode():
+        return payload.decode_message(encoded, encoding, compression, max_size=len(data))
+
+    assert decode() == data
+    return {"bytes": len(encoded),
+            "ratio": round(len(encoded) / len(data), 3),
+            "encode_ms": round(timed(encode, repeat), 4),
+            "decode_ms": round(timed(decode, repeat), 4)}
+
+
+def main():
+    """Запуск измерений"""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=65536, help="размер сообщения, байт")
+    parser.add_argument("--repeat", type=int, default=200, help="повторов каждого измерения")
+    args = parser.parse_args()
+
+    for kind, data in sample_data(args.size).items():
+        for codec in codecs():
+            encoding, compression, level = codec
+            name = f"{encoding}+{compression}:{level}" if compression else encoding
+            print(f"{kind:>8} {name:>14}: {measure(data, codec, args.repeat)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Стоимость рукопожатия TLS с возобновлением сессии и без него.
+
+Запускается локальный TLS сервер с контекстом tls.server_context (самоподписанный
+сертификат создается утилитой openssl во временном каталоге). Клиенты многократно
+подключаются к нему, получают ответ сервера и отключаются, как клиенты пула при частых
+переподключениях. Сравниваются обычный контекст (полное рукопожатие при каждом подключении)
+и ResumingSSLContext (tls.client_context): время подключения, процессорное время
+(клиент и сервер в одном процессе) и доля возобновленных сессий.
+
+Запуск из корня репозитория:
+    python -m benchmarks.tls_bench --connections 500 --concurrency 8
+"""
+import argparse
+import os
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from time import perf_counter, process_time
+from typing import Dict, List, Tuple
+from src.mqtt_pub import tls  # type: ignore
+
+HOST = "localhost"
+KEY_TYPES = {"rsa": ["-newkey", "rsa:2048"],
+             "ec": ["-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1"]}
+
+
+def create_certificate(directory: str, key_type: str) -> Tuple[str, str]:
+    """Самоподписанный сертификат для localhost"""
+
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", *KEY_TYPES[key_type], "-nodes", "-days", "1",
+                    "-subj", f"/CN={HOST}", "-addext", f"subjectAltName=DNS:{HOST}",
+                    "-keyout", keyfile, "-out", certfile],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def serve(listener: socket.socket, context: ssl.SSLContext, stop: threading.Event):
+    """Сервер: рукопожатие, ответ и закрытие подключения"""
+
+    def handle(connection: socket.socket):
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            with context.wrap_socket(connection, server_side=True) as secure:
+                secure.sendall(b"ok")
+                secure.recv(1)
+        except (OSError, ssl.SSLError):
+            pass
+
+    with ThreadPoolExecutor(16) as executor:
+        while not stop.is_set():
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                break
+            executor.submit(handle, connection)
+
+
+def connect(context: ssl.SSLContext, port: int) -> Tuple[float, bool]:
+    """Одно подключение: время до получения ответа сервера и признак возобновления сессии"""
+
+    started = perf_counter()
+    with socket.create_connection((HOST, port)) as raw:
+        # Без задержки отправки мелких пакетов (алгоритм Нейгла), иначе время подключения
+        # определяется задержкой подтверждений TCP, а не рукопожатием
+        raw.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        secure = context.wrap_socket(raw, server_hostname=HOST)
+        # Ответ сервера читается, чтобы клиент получил session ticket (TLS 1.3)
+        secure.recv(2)
+        elapsed = perf_counter() - started
+        resumed = secure.session_reused
+        secure.close()
+    return elapsed, resumed
+
+
+def run(context: ssl.SSLContext, port: int, connections: int, concurrency: int) -> Dict[str, float]:
+    """Серия подключений: медиана и p95 времени подключения, процессорное время на подключение"""
+
+    connect(context, port)  # Первое подключение всегда с полным рукопожатием
+    cpu_started, started = process_time(), perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(lambda _: connect(context, port), range(connections)))
+    wall = perf_counter() - started
+    cpu = process_time() - cpu_started
+
+    times: List[float] = sorted(elapsed for elapsed, _ in results)
+    return {"connect_p50_ms": round(median(times) * 1000, 3),
+            "connect_p95_ms": round(times[int(len(times) * 0.95) - 1] * 1000, 3),
+            "cpu_per_connection_ms": round(cpu / connections * 1000, 3),
+            "connections_per_sec": round(connections / wall, 1),
+            "resumed": round(sum(resumed for _, resumed in results) / connections, 3)}
+
+
+def main():
+    """Запуск измерений"""
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=500, help="подключений в серии")
+    parser.add_argument("--concurrency", type=int, default=8, help="одновременных подключений")
+    parser.add_argument("--key", choices=sorted(KEY_TYPES), default="rsa", help="тип ключа сервера")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = create_certificate(directory, args.key)
+        server = tls.server_context({"ssl_certfile_path": certfile, "ssl_keyfile_path": keyfile})
+
+        listener = socket.create_server((HOST, 0), backlog=1024)
+        port = listener.getsockname()[1]
+        stop = threading.Event()
+        thread = threading.Thread(target=serve, args=(listener, server, stop), daemon=True)
+        thread.start()
+
+        try:
+            for version in (ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_3):
+                for name, resumption in (("полное", False), ("возобновление", True)):
+                    context = tls.client_context({"ca_certs": certfile,
+                                                  "session_resumption": resumption})
+                    context.maximum_version = version
+                    result = run(context, port, args.connections, args.concurrency)
+                    print(f"{version.name:>8} {name:>14}: {result}")
+        finally:
+            stop.set()
+            listener.close()
+
+
+if __name__ == "__main__":
+    main()
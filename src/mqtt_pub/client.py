@@ -1,28 +1,65 @@
 """
 This program for test sending a message to message_listener
 """
+import json
 import socket
 import sys
-from .config import settings  # pylint: disable = import-error
+from typing import Dict, List
+from . import config  # pylint: disable = import-error
+from .framing import FRAMING_LEGACY, recv_frame, send_frame  # pylint: disable = import-error
 
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+MESSAGE = '{"topic": "/balalaykajazz/out/setup", "message": "turn on"}'
 
-try:
-    server_socket.connect((settings.socket_host, settings.socket_port))
-except ConnectionRefusedError:
-    print("Server is not running")
-    sys.exit(1)
 
-# data = input('write to server: ')
-MESSAGE = '{"topic": "/balalaykajazz/out/setup", "message": "turn on"}'
+def connect() -> socket.socket:
+    """Подключение к message_listener"""
+
+    settings = config.context.settings
+    return socket.create_connection((settings.socket_host, settings.socket_port))
+
+
+def send_message(message: str) -> str:
+    """Одно сообщение на подключение (режим legacy)"""
+
+    with connect() as server_socket:
+        server_socket.sendall(message.encode())
+        return server_socket.recv(65536).decode()
+
+
+def send_pipelined(messages: List[dict], framing: str) -> List[str]:
+    """
+    Отправка нескольких сообщений в одном подключении без ожидания ответов (режимы ndjson, length).
+    Каждому сообщению присваивается id, ответы возвращаются в порядке сообщений.
+    """
+
+    results: Dict[int, str] = {}
+    buffer = bytearray()
+
+    with connect() as server_socket:
+        for request_id, message in enumerate(messages):
+            send_frame(server_socket, json.dumps({**message, "id": request_id}).encode(), framing)
+
+        while len(results) < len(messages):
+            answer = json.loads(recv_frame(server_socket, framing, buffer))
+            results[answer["id"]] = answer["result"]
+
+    return [results[request_id] for request_id in range(len(messages))]
+
+
+def main():
+    """Отправка тестового сообщения. Режим обмена можно передать первым аргументом."""
+
+    framing = sys.argv[1] if len(sys.argv) > 1 else FRAMING_LEGACY
 
-if MESSAGE:
-    # Send message
-    server_socket.send(MESSAGE.encode())
+    try:
+        if framing == FRAMING_LEGACY:
+            print(send_message(MESSAGE))
+        else:
+            print(send_pipelined([json.loads(MESSAGE)], framing)[0])
+    except ConnectionRefusedError:
+        print("Server is not running")
+        sys.exit(1)
 
-    # Get answer
-    answer = server_socket.recv(1024)
-    print(answer.decode())
 
-# End program
-server_socket.close()
+if __name__ == "__main__":
+    main()
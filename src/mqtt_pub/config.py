@@ -1,7 +1,17 @@
-"""Модуль используется для загрузки настроек, необходимых для корректной работы сервиса."""
+"""
+Модуль используется для загрузки настроек, необходимых для корректной работы сервиса.
+
+Импорт модуля не читает файлы: настройки и список пользователей загружаются
+при первом обращении к context.settings и context.registered_users.
+"""
 import os
 import json
-from pydantic import BaseSettings
+import secrets
+import threading
+from typing import TYPE_CHECKING, Any, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .settings_schema import Settings  # pylint: disable = cyclic-import
 
 REGISTERED_USERS_PATH = "settings/users.json"
 TLS_CA_CERTS_PATH = "settings/tls_ca_certs.crt"
@@ -9,6 +19,8 @@ TLS_CERTFILE_PATH = "settings/tls_certfile.crt"
 TLS_KEYFILE_PATH = "settings/tls_keyfile.key"
 SSL_KEYFILE_PATH = "settings/server_key.pem"
 SSL_CERTFILE_PATH = "settings/server_cert.pem"
+SPOOL_PATH = "spool/outbound.db"
+ENV_FILE_PATH = "settings/.env"
 
 
 def get_full_path(file_name: str) -> str:
@@ -27,66 +39,242 @@ def get_registered_users(registered_users_path: str) -> dict:
     return requested_settings
 
 
+def split_list(value: str) -> List[str]:
+    """Список значений через запятую"""
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
 def get_settings_to_socket() -> dict:
     """Получение настроек для работы сокета"""
 
+    settings = context.settings
     return {"socket_host": settings.socket_host,
             "socket_port": settings.socket_port,
+            "socket_backlog": settings.socket_backlog,
+            "socket_max_connections": settings.socket_max_connections,
+            "socket_workers": settings.socket_workers,
+            "socket_timeout": settings.socket_timeout,
+            "socket_idle_timeout": settings.socket_idle_timeout,
+            "socket_framing": settings.socket_framing,
+            "socket_max_frame_size": settings.socket_max_frame_size,
+            "socket_pipeline_depth": settings.socket_pipeline_depth,
+            "socket_stream_buffer": settings.socket_stream_buffer,
+            "socket_stream_overflow_policy": settings.socket_stream_overflow_policy,
+            "socket_stream_max_subscriptions": settings.socket_stream_max_subscriptions,
+            "socket_drain_timeout": settings.socket_drain_timeout,
             "use_ssl": settings.use_ssl,
+            "workers": settings.workers,
+            "socket_reuse_port": settings.socket_reuse_port,
+            "stats_interval": settings.stats_interval,
+            "metrics_host": settings.metrics_host,
+            "metrics_port": settings.metrics_port,
+            "config_reload_interval": settings.config_reload_interval,
             "ssl_keyfile_path": settings.ssl_keyfile_path,
-            "ssl_certfile_path": settings.ssl_certfile_path}
+            "ssl_certfile_path": settings.ssl_certfile_path,
+            "ssl_ciphers": settings.ssl_ciphers,
+            "ssl_alpn": split_list(settings.ssl_alpn),
+            "ssl_session_tickets": settings.ssl_session_tickets}
 
 
 def get_settings_to_publish() -> dict:
     """Получение настроек для работы брокера"""
 
+    settings = context.settings
     broker_settings = {"host": settings.broker_host,
                        "port": settings.broker_port,
                        "keepalive": settings.broker_keep_alive}
 
     tls = {"ca_certs": settings.tls_ca_certs_path,
            "certfile": settings.tls_certfile_path,
-           "keyfile": settings.tls_keyfile_path}
+           "keyfile": settings.tls_keyfile_path,
+           "ciphers": settings.broker_tls_ciphers,
+           "alpn": split_list(settings.broker_tls_alpn),
+           "session_resumption": settings.broker_tls_session_resumption}
+
+    pool = {"size": settings.broker_pool_size,
+            "reconnect_min_delay": settings.broker_reconnect_min_delay,
+            "reconnect_max_delay": settings.broker_reconnect_max_delay,
+            "connect_timeout": settings.broker_connect_timeout,
+            "max_inflight": settings.broker_max_inflight,
+            "max_queued": settings.broker_max_queued}
+
+    publish = {"mode": settings.broker_publish_mode,
+               "qos": settings.broker_qos,
+               "retain": settings.broker_retain,
+               "topic_qos": parse_topic_qos(settings.broker_topic_qos)}
+
+    compression = {"method": settings.broker_compression,
+                   "level": settings.broker_compression_level or None,
+                   "min_size": settings.broker_compression_min_size,
+                   "topics": split_list(settings.broker_compression_topics),
+                   "max_size": settings.broker_max_payload_size}
+
+    routing = {"routes": parse_broker_routes(settings.broker_routes, settings.broker_port),
+               "standby": parse_brokers(settings.broker_standby_hosts, settings.broker_port),
+               "health_interval": settings.broker_health_interval,
+               "health_timeout": settings.broker_health_timeout,
+               "health_failures": settings.broker_health_failures}
 
     return {"broker_settings": broker_settings,
             "broker_use_tls": settings.broker_use_tls,
-            "tls": tls}
+            "tls": tls,
+            "pool": pool,
+            "reply_topic_filters": split_list(settings.broker_reply_topic_filters),
+            "batch_window": settings.broker_batch_window,
+            "publish": publish,
+            "compression": compression,
+            "routing": routing,
+            "reply_cache": {"ttl": settings.broker_reply_cache_ttl,
+                            "size": settings.broker_reply_cache_size},
+            "limits": {"user_rate": settings.limit_user_rate,
+                       "user_burst": settings.limit_user_burst,
+                       "topic_rate": settings.limit_topic_rate,
+                       "topic_burst": settings.limit_topic_burst,
+                       "topic_levels": settings.limit_topic_levels,
+                       "max_pending_replies": settings.limit_max_pending_replies},
+            "session": {"secret": settings.session_secret or context.session_secret,
+                        "ttl": settings.session_ttl,
+                        "cache_size": settings.session_cache_size},
+            "spool": {"path": settings.spool_path,
+                      "max_messages": settings.spool_max_messages,
+                      "max_bytes": settings.spool_max_bytes,
+                      "overflow_policy": settings.spool_overflow_policy,
+                      "batch_size": settings.spool_batch_size,
+                      "retry_delay": settings.spool_retry_delay}}
+
+
+def parse_topic_qos(value: str) -> List[Tuple[str, int]]:
+    """
+    Разбор правил QoS по топикам: "фильтр:qos" через запятую, например "+/+/in/setup:2,#:0".
+    Правила с неверным уровнем QoS пропускаются.
+    """
+
+    rules = []
+    for rule in value.split(","):
+        topic_filter, _, qos = rule.strip().rpartition(":")
+        if topic_filter and qos in ("0", "1", "2"):
+            rules.append((topic_filter, int(qos)))
+    return rules
+
+
+def parse_brokers(value: str, default_port: int) -> List[Tuple[str, int]]:
+    """
+    Разбор списка брокеров: "хост:порт" через запятую или "|", порт можно не указывать.
+    Брокеры с неверным портом пропускаются.
+    """
+
+    brokers = []
+    for broker in value.replace("|", ",").split(","):
+        host, separator, port = broker.strip().rpartition(":")
+        if not separator:
+            host, port = port, str(default_port)
+        if host and port.isdigit():
+            brokers.append((host, int(port)))
+    return brokers
 
 
-class Settings(BaseSettings):  # pylint: disable = too-few-public-methods
+def parse_broker_routes(value: str, default_port: int) -> List[Tuple[str, List[Tuple[str, int]]]]:
     """
-    Параметры подключения к внешним ресурсам.
-
-    mqtt_settings - подключение к брокеру mqtt для получения сообщений от устройств.
-    broker_host - адрес mqtt брокера.
-    broker_port - порт mqtt брокера.
-    broker_use_tls - Признак использования tls для соединения с брокером.
-    broker_keep_alive - Период активности соединения.
-
-    socket_settings - сокет, который слушает mqtt_publisher.
-    socket_host - ip адрес сокета, к которому подключается клиент.
-    socket_port - порт сокета, к которому подключается клиент.
-    use_ssl - Признак использования ssl для соединения с сокетом.
+    Разбор правил распределения топиков: "фильтр=брокер|резервный брокер" через запятую,
+    например "site1/#=mqtt-a:1883|mqtt-a2:1883,site2/#=mqtt-b:1883".
+    Правила без брокеров пропускаются.
     """
 
-    # mqtt_settings
-    broker_host: str = ""
-    broker_port: int = 8883
-    broker_use_tls: bool = False
-    broker_keep_alive: int = 60
-    tls_ca_certs_path: str = get_full_path(TLS_CA_CERTS_PATH)
-    tls_certfile_path: str = get_full_path(TLS_CERTFILE_PATH)
-    tls_keyfile_path: str = get_full_path(TLS_KEYFILE_PATH)
+    routes = []
+    for rule in value.split(","):
+        topic_filter, _, brokers = rule.strip().partition("=")
+        members = parse_brokers(brokers, default_port)
+        if topic_filter.strip() and members:
+            routes.append((topic_filter.strip(), members))
+    return routes
 
-    # socket_settings
-    socket_host: str = "127.0.0.1"
-    socket_port: int = 5000
-    use_ssl: bool = False
-    ssl_keyfile_path: str = get_full_path(SSL_KEYFILE_PATH)
-    ssl_certfile_path: str = get_full_path(SSL_CERTFILE_PATH)
 
+def load_settings() -> "Settings":
+    """Чтение настроек из settings/.env и переменных окружения"""
 
-settings = Settings(_env_file=get_full_path("settings/.env"),
+    # Импорт здесь: pydantic нужен только при загрузке настроек
+    from .settings_schema import Settings  # pylint: disable = import-outside-toplevel
+
+    return Settings(_env_file=get_full_path(ENV_FILE_PATH),
                     _env_file_encoding="utf-8")
 
-registered_users = get_registered_users(REGISTERED_USERS_PATH)
+
+class AppContext:
+    """
+    Настройки и список пользователей процесса.
+
+    Загружаются при первом обращении. При изменении файлов заменяются целиком
+    (см. config_watcher.py), поэтому ссылку на них не следует сохранять надолго.
+    """
+
+    def __init__(self):
+        self._settings: Optional["Settings"] = None
+        self._registered_users: Optional[dict] = None
+        self._session_secret: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def settings(self) -> "Settings":
+        """Настройки из settings/.env и переменных окружения"""
+
+        settings = self._settings
+        if settings is None:
+            with self._lock:
+                if self._settings is None:
+                    self._settings = load_settings()
+                settings = self._settings
+        return settings
+
+    @settings.setter
+    def settings(self, value: "Settings"):
+        self._settings = value
+
+    @property
+    def registered_users(self) -> dict:
+        """Зарегистрированные пользователи из settings/users.json"""
+
+        users = self._registered_users
+        if users is None:
+            with self._lock:
+                if self._registered_users is None:
+                    self._registered_users = get_registered_users(REGISTERED_USERS_PATH)
+                users = self._registered_users
+        return users
+
+    @registered_users.setter
+    def registered_users(self, value: dict):
+        self._registered_users = value
+
+    @property
+    def session_secret(self) -> str:
+        """
+        Секрет процесса для подписи токенов, если session_secret не задан.
+        Токены, выданные до перезапуска, становятся недействительными.
+        """
+
+        if self._session_secret is None:
+            with self._lock:
+                if self._session_secret is None:
+                    self._session_secret = secrets.token_hex(32)
+        return self._session_secret
+
+    def reset(self):
+        """Сброс загруженных данных: при следующем обращении они будут прочитаны заново"""
+
+        with self._lock:
+            self._settings = None
+            self._registered_users = None
+
+
+context = AppContext()
+
+
+def __getattr__(name: str) -> Any:
+    """config.settings и config.registered_users загружаются при первом обращении"""
+
+    if name in ("settings", "registered_users"):
+        return getattr(context, name)
+    if name == "Settings":
+        from .settings_schema import Settings  # pylint: disable = import-outside-toplevel
+        return Settings
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,170 @@
+"""
+Перечитывание настроек без перезапуска сервиса.
+
+Фоновый поток периодически проверяет время изменения settings/users.json и settings/.env.
+Новые данные сначала полностью загружаются и только потом заменяют старые одним
+присваиванием (config.context.registered_users, config.context.settings),
+поэтому чтение не требует блокировок.
+
+Подключения к брокеру пересоздаются, только если изменились параметры брокера.
+Настройки сокета, логов и очереди исходящих сообщений применяются после перезапуска.
+"""
+import os
+import threading
+from typing import Dict, Optional
+from . import config  # pylint: disable = import-error
+from .event_logger import get_info_logger, get_error_logger  # pylint: disable = import-error
+from .metrics import counter  # pylint: disable = import-error
+from .mqtt_pool import close_pools  # pylint: disable = import-error
+from .mqtt_writer import TIMEOUT_WAIT_MQTT  # pylint: disable = import-error
+from .reply_dispatcher import close_dispatchers  # pylint: disable = import-error
+from .routing import close_routers  # pylint: disable = import-error
+from .session import get_session_manager  # pylint: disable = import-error
+from .stream import close_hubs  # pylint: disable = import-error
+
+event_log = get_info_logger("INFO__config_watcher__")
+error_log = get_error_logger("ERR__config_watcher__")
+
+CONFIG_RELOADS = counter("mqtt_pub_config_reloads_total", "Configuration reloads", ["kind", "result"])
+
+# Разделы settings_to_publish, изменение которых требует переподключения к брокеру
+BROKER_SECTIONS = ("broker_settings", "broker_use_tls", "tls", "pool", "reply_topic_filters",
+                   "routing")
+# Разделы, которые применяются только после перезапуска
+RESTART_SECTIONS = ("spool", "session")
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class ConfigWatcher:
+    """
+    Наблюдение за файлами настроек.
+
+    settings_to_publish - словарь, с которым работает message_listener.
+    Его разделы заменяются новыми при изменении настроек.
+    """
+
+    def __init__(self, settings_to_publish: dict, interval: float):
+        self.settings_to_publish = settings_to_publish
+        self.interval = interval
+        self.users_path = config.get_full_path(config.REGISTERED_USERS_PATH)
+        self.env_path = config.get_full_path(config.ENV_FILE_PATH)
+        self._mtimes: Dict[str, Optional[float]] = {self.users_path: _mtime(self.users_path),
+                                                    self.env_path: _mtime(self.env_path)}
+        # Последние загруженные настройки (в settings_to_publish могут быть изменения процесса,
+        # например, путь к очереди рабочего процесса supervisor)
+        self._loaded = config.get_settings_to_publish()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Запуск фонового потока"""
+
+        self._thread = threading.Thread(target=self._watch, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановка фонового потока"""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def check(self):
+        """Проверка изменения файлов и перезагрузка измененных"""
+
+        if self._changed(self.users_path):
+            self.reload_users()
+        if self._changed(self.env_path):
+            self.reload_settings()
+
+    def reload_users(self) -> bool:
+        """Загрузка нового списка пользователей"""
+
+        try:
+            users = config.get_registered_users(config.REGISTERED_USERS_PATH)
+            if not isinstance(users, dict):
+                raise ValueError("ожидается словарь пользователей")
+        except (OSError, ValueError) as err:
+            # json.JSONDecodeError наследует ValueError
+            CONFIG_RELOADS.inc(kind="users", result="error")
+            error_log.error("Не удалось загрузить список пользователей: %s", str(err))
+            return False
+
+        config.context.registered_users = users
+        # Кэш проверенных токенов сбрасывается: токены удаленных пользователей
+        # и пользователей со смененным паролем больше не действуют
+        get_session_manager(self.settings_to_publish["session"]).revoke_all()
+
+        CONFIG_RELOADS.inc(kind="users", result="ok")
+        event_log.info("Список пользователей обновлен: %s пользователей", len(users))
+        return True
+
+    def reload_settings(self) -> bool:
+        """Загрузка новых настроек и переподключение к брокеру при необходимости"""
+
+        try:
+            config.context.settings = config.load_settings()
+        except (OSError, ValueError) as err:
+            # pydantic.ValidationError наследует ValueError
+            CONFIG_RELOADS.inc(kind="settings", result="error")
+            error_log.error("Не удалось загрузить настройки: %s", str(err))
+            return False
+
+        new_settings = config.get_settings_to_publish()
+        changed = [section for section, value in new_settings.items()
+                   if self._loaded.get(section) != value]
+        self._loaded = new_settings
+
+        skipped = [section for section in changed if section in RESTART_SECTIONS]
+        changed = [section for section in changed if section not in RESTART_SECTIONS]
+        for section in changed:
+            self.settings_to_publish[section] = new_settings[section]
+
+        if any(section in BROKER_SECTIONS for section in changed):
+            # Новые запросы сразу используют новые подключения,
+            # старые закрываются после завершения уже начатых запросов
+            close_routers()
+            close_pools(delay=TIMEOUT_WAIT_MQTT)
+            close_dispatchers(delay=TIMEOUT_WAIT_MQTT)
+            # Подписки клиентов сокета связаны со старым подписчиком:
+            # клиенты отключаются и подписываются заново
+            close_hubs()
+            event_log.info("Параметры брокера изменены, выполняется переподключение")
+
+        if skipped:
+            event_log.info("Изменения в %s будут применены после перезапуска", ", ".join(skipped))
+
+        CONFIG_RELOADS.inc(kind="settings", result="ok")
+        event_log.info("Настройки обновлены: %s", ", ".join(changed) or "без изменений")
+        return True
+
+    def _changed(self, path: str) -> bool:
+        mtime = _mtime(path)
+        if mtime == self._mtimes.get(path):
+            return False
+        self._mtimes[path] = mtime
+        return mtime is not None
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as err:  # pylint: disable = broad-except
+                error_log.error("Ошибка при проверке настроек: %s", str(err))
+
+
+def start_config_watcher(settings_to_publish: dict, interval: float) -> Optional[ConfigWatcher]:
+    """Запуск наблюдения за настройками. Если interval равен 0, наблюдение не запускается."""
+
+    if not interval:
+        return None
+
+    watcher = ConfigWatcher(settings_to_publish, interval)
+    watcher.start()
+    return watcher
@@ -2,67 +2,354 @@
 Создание логера для обработки событий.
 Важные сообщения и ошибки записываются в соответствующие файлы.
 Остальные сообщения выводятся в консоль.
+
+В асинхронном режиме (log_async) логер только помещает запись в очередь,
+а запись в файлы и консоль выполняет фоновый поток пакетами. Очередь ограничена
+(log_queue_size): если поток не успевает записывать, новые записи отбрасываются
+и учитываются в метрике mqtt_pub_log_records_dropped_total.
+
+Создание логера не читает настройки и не открывает файлы:
+обработчики создаются при первой записи (см. LazyHandler).
 """
+import atexit
+import functools
+import json
 import logging
+import logging.handlers
+import queue
 import sys
 import os
+import threading
+from typing import Dict, List, Optional
+from . import config  # pylint: disable = import-error
 from .config import get_full_path  # pylint: disable = import-error
+from .metrics import counter  # pylint: disable = import-error
 
 FORMATTER = logging.Formatter("%(asctime)s — %(name)s — %(levelname)s — %(message)s")
 SHORT_FORMATTER = logging.Formatter("%(levelname)s — %(message)s")
 EVENT_LOG_FILE = get_full_path("logs/events.log")
 ERROR_LOG_FILE = get_full_path("logs/error.log")
+LOG_FORMAT_JSON = "json"
+
+LOG_DROPPED = counter("mqtt_pub_log_records_dropped_total",
+                      "Log records dropped because the log queue was full", ["kind"])
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога в виде одной JSON строки"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": self.formatTime(record),
+                 "logger": record.name,
+                 "level": record.levelname,
+                 "message": record.getMessage()}
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только часть информационных сообщений (1 из every).
+    Предупреждения и ошибки пропускаются всегда.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if not self.every:
+            return False
+        with self._lock:
+            self._count += 1
+            return self._count % self.every == 0
+
+
+class BatchFlushMixin:
+    """Файл сбрасывается на диск один раз на пакет записей, а не после каждой записи"""
+
+    def flush(self):
+        """Сброс выполняется в flush_batch"""
+
+    def flush_batch(self):
+        """Сброс буфера файла на диск"""
+        super().flush()  # type: ignore
+
+
+class BatchRotatingFileHandler(BatchFlushMixin, logging.handlers.RotatingFileHandler):
+    """Файл лога с ротацией по размеру"""
+
+
+class BatchTimedRotatingFileHandler(BatchFlushMixin, logging.handlers.TimedRotatingFileHandler):
+    """Файл лога с ротацией по времени"""
+
+
+class ConsoleHandler(logging.StreamHandler):
+    """
+    Вывод в текущий sys.stdout или sys.stderr (как logging.lastResort):
+    поток может быть заменен или закрыт после создания обработчика.
+    """
+
+    def __init__(self, stream_name: str):
+        logging.Handler.__init__(self)  # pylint: disable = non-parent-init-called
+        self.stream_name = stream_name
+
+    @property
+    def stream(self):  # type: ignore
+        """Текущий поток вывода"""
+        return getattr(sys, self.stream_name)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Запись в ограниченную очередь. Если очередь заполнена, запись отбрасывается."""
+
+    def __init__(self, records: queue.Queue, kind: str):
+        super().__init__(records)
+        self.kind = kind
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc(kind=self.kind)
+
+
+def _call_handler(handler: logging.Handler, method, record: logging.LogRecord):
+    """
+    Вызов метода обработчика. Ошибка записи (например, закрытый файл) передается handleError
+    и не останавливает фоновый поток.
+    """
+
+    try:
+        method()
+    except Exception:  # pylint: disable = broad-except
+        try:
+            handler.handleError(record)
+        except Exception:  # pylint: disable = broad-except
+            # Поток ошибок тоже может быть закрыт (завершение процесса)
+            pass
+
+
+class BatchingQueueListener:
+    """
+    Фоновый поток, который забирает записи из очереди и передает их обработчикам.
+    За один проход обрабатывается до batch_size записей, после чего файлы сбрасываются на диск.
+    """
+
+    _sentinel = None
+
+    def __init__(self, records: queue.Queue, handlers: List[logging.Handler], batch_size: int):
+        self.queue = records
+        self.handlers = handlers
+        self.batch_size = max(1, batch_size)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Запуск фонового потока"""
+
+        self._thread = threading.Thread(target=self._monitor, name="event-logger", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Обработка оставшихся записей и остановка потока"""
+
+        if self._thread is not None:
+            self.queue.put(self._sentinel)
+            self._thread.join()
+            self._thread = None
+        for handler in self.handlers:
+            handler.close()
+
+    def _monitor(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for record in batch:
+                if record is self._sentinel:
+                    self._flush(batch[0])
+                    return
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        _call_handler(handler, functools.partial(handler.handle, record), record)
 
-logs_full_path = get_full_path("logs")
-if not os.path.exists(logs_full_path):
-    os.mkdir(logs_full_path)
+            self._flush(batch[-1])
+
+    def _flush(self, record: logging.LogRecord):
+        for handler in self.handlers:
+            _call_handler(handler, getattr(handler, "flush_batch", handler.flush), record)
+
+
+def _get_formatter(short: bool = False) -> logging.Formatter:
+    if config.context.settings.log_format == LOG_FORMAT_JSON:
+        return JsonFormatter()
+    return SHORT_FORMATTER if short else FORMATTER
+
+
+def _get_file_handler(filename: str) -> logging.Handler:
+    """Файл лога с ротацией по времени (log_rotate_when) или по размеру (log_max_bytes)"""
+
+    settings = config.context.settings
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+    if settings.log_rotate_when:
+        return BatchTimedRotatingFileHandler(filename=filename,
+                                             when=settings.log_rotate_when,
+                                             backupCount=settings.log_backup_count,
+                                             encoding="utf-8")
+
+    return BatchRotatingFileHandler(filename=filename,
+                                    maxBytes=settings.log_max_bytes,
+                                    backupCount=settings.log_backup_count,
+                                    encoding="utf-8")
 
 
 def _get_info_handler():
     """Вывод информационного сообщения в консоль"""
-    console_handler = logging.StreamHandler(stream=sys.stdout)
-    console_handler.setFormatter(SHORT_FORMATTER)
+    console_handler = ConsoleHandler("stdout")
+    console_handler.setFormatter(_get_formatter(short=True))
     console_handler.setLevel(logging.DEBUG)
     return console_handler
 
 
 def _get_info_handler_log():
     """Запись информационного сообщения в файл"""
-    file_handler = logging.FileHandler(filename=EVENT_LOG_FILE)
-    file_handler.setFormatter(FORMATTER)
+    file_handler = _get_file_handler(EVENT_LOG_FILE)
+    file_handler.setFormatter(_get_formatter())
     file_handler.setLevel(logging.DEBUG)
     return file_handler
 
 
 def _get_error_handler():
     """Вывод сообщения об ошибке в консоль"""
-    console_handler = logging.StreamHandler(stream=sys.stderr)
-    console_handler.setFormatter(SHORT_FORMATTER)
+    console_handler = ConsoleHandler("stderr")
+    console_handler.setFormatter(_get_formatter(short=True))
     console_handler.setLevel(logging.WARNING)
     return console_handler
 
 
 def _get_error_handler_log():
     """Запись сообщения об ошибке в файл"""
-    file_handler = logging.FileHandler(filename=ERROR_LOG_FILE)
-    file_handler.setFormatter(FORMATTER)
+    file_handler = _get_file_handler(ERROR_LOG_FILE)
+    file_handler.setFormatter(_get_formatter())
     file_handler.setLevel(logging.WARNING)
     return file_handler
 
 
+_listeners: Dict[str, BatchingQueueListener] = {}
+_handlers: Dict[str, List[logging.Handler]] = {}
+_lock = threading.Lock()
+
+
+def _get_handlers(kind: str) -> List[logging.Handler]:
+    """
+    Обработчики логеров одного вида (info или error) общие для всех логеров.
+    В асинхронном режиме это один QueueHandler, записи из которого обрабатывает фоновый поток.
+    """
+
+    with _lock:
+        if kind in _handlers:
+            return _handlers[kind]
+
+        if kind == "info":
+            handlers = [_get_info_handler(), _get_info_handler_log()]
+        else:
+            handlers = [_get_error_handler(), _get_error_handler_log()]
+
+        settings = config.context.settings
+        if settings.log_async:
+            records: queue.Queue = queue.Queue(max(1, settings.log_queue_size))
+            listener = _listeners[kind] = BatchingQueueListener(records, handlers,
+                                                                settings.log_batch_size)
+            listener.start()
+            handlers = [DroppingQueueHandler(records, kind)]
+        else:
+            for handler in handlers:
+                handler.flush = getattr(handler, "flush_batch", handler.flush)
+
+        _handlers[kind] = handlers
+        return handlers
+
+
+def stop_logging():
+    """Запись оставшихся сообщений из очереди и остановка фоновых потоков"""
+
+    with _lock:
+        listeners = list(_listeners.values())
+        _listeners.clear()
+
+    for listener in listeners:
+        listener.stop()
+
+
+atexit.register(stop_logging)
+
+
+class LazyHandler(logging.Handler):
+    """
+    Обработчик логеров одного вида (info или error).
+    Настоящие обработчики создаются при первой записи, а не при создании логера,
+    поэтому импорт модулей не читает настройки и не открывает файлы.
+    """
+
+    def __init__(self, kind: str):
+        super().__init__()
+        self.kind = kind
+        self._handlers: Optional[List[logging.Handler]] = None
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        handlers = self._handlers
+        if handlers is None:
+            handlers = self._create()
+
+        if not self.filter(record):
+            return False
+
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+    def emit(self, record: logging.LogRecord):
+        self.handle(record)
+
+    def _create(self) -> List[logging.Handler]:
+        with self.lock:  # type: ignore
+            if self._handlers is None:
+                sample_rate = config.context.settings.log_info_sample_rate
+                if self.kind == "info" and sample_rate < 1:
+                    self.addFilter(SamplingFilter(sample_rate))
+                self._handlers = _get_handlers(self.kind)
+            return self._handlers
+
+
+_lazy_handlers = {"info": LazyHandler("info"), "error": LazyHandler("error")}
+
+
+def _configure(logger: logging.Logger, level: int, kind: str) -> logging.Logger:
+    logger.setLevel(level)
+    if logger.handlers:
+        # Логер с таким именем уже настроен, повторно обработчики не добавляются
+        return logger
+
+    logger.addHandler(_lazy_handlers[kind])
+    return logger
+
+
 def get_info_logger(logger_name):
     """Создание логера для информационных сообщений"""
-    logger = logging.getLogger(logger_name)
-    logger.setLevel(logging.INFO)
-    logger.addHandler(_get_info_handler())
-    logger.addHandler(_get_info_handler_log())
-    return logger
+    return _configure(logging.getLogger(logger_name), logging.INFO, "info")
 
 
 def get_error_logger(logger_name):
     """Создание логера для ошибок"""
-    logger = logging.getLogger(logger_name)
-    logger.setLevel(logging.WARNING)
-    logger.addHandler(_get_error_handler())
-    logger.addHandler(_get_error_handler_log())
-    return logger
+    return _configure(logging.getLogger(logger_name), logging.WARNING, "error")
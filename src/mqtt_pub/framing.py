@@ -0,0 +1,122 @@
+"""
+Разбиение потока байт на сообщения (кадры).
+
+legacy - одно сообщение на подключение, без разделителей (старые клиенты).
+ndjson - сообщения разделены символом перевода строки.
+length - перед сообщением передается его длина: 4 байта, big-endian.
+auto - режим определяется по первому байту: 0x00 означает length, иначе legacy.
+"""
+import asyncio
+import socket
+import struct
+from typing import Optional, Tuple
+
+FRAMING_LEGACY = "legacy"
+FRAMING_NDJSON = "ndjson"
+FRAMING_LENGTH = "length"
+FRAMING_AUTO = "auto"
+FRAMINGS = (FRAMING_LEGACY, FRAMING_NDJSON, FRAMING_LENGTH, FRAMING_AUTO)
+
+LENGTH_PREFIX = struct.Struct("!I")
+NEWLINE = b"\n"
+
+
+class FrameError(Exception):
+    """Исключение для поврежденных или слишком больших кадров"""
+
+
+def encode_frame(payload: bytes, framing: str) -> bytes:
+    """Упаковка сообщения в кадр"""
+
+    if framing == FRAMING_LENGTH:
+        return LENGTH_PREFIX.pack(len(payload)) + payload
+
+    if framing == FRAMING_NDJSON:
+        return payload + NEWLINE
+
+    return payload
+
+
+async def detect_framing(reader: asyncio.StreamReader, framing: str) -> Tuple[str, bytes]:
+    """
+    Определение режима подключения.
+    Возвращает режим и уже прочитанные байты, которые относятся к первому сообщению.
+    """
+
+    if framing != FRAMING_AUTO:
+        return framing, b""
+
+    first = await reader.read(1)
+    if first == b"\x00":
+        return FRAMING_LENGTH, first
+    return FRAMING_LEGACY, first
+
+
+async def read_frame(reader: asyncio.StreamReader, framing: str,
+                     max_size: int, prefix: bytes = b"") -> Optional[bytes]:
+    """
+    Чтение одного кадра. Если клиент закрыл подключение, возвращается None.
+    prefix - байты кадра, прочитанные ранее (см. detect_framing).
+    """
+
+    try:
+        if framing == FRAMING_LENGTH:
+            header = prefix + await reader.readexactly(LENGTH_PREFIX.size - len(prefix))
+            (size,) = LENGTH_PREFIX.unpack(header)
+            if size > max_size:
+                raise FrameError(f"Размер сообщения {size} превышает {max_size}")
+            return await reader.readexactly(size)
+
+        if framing == FRAMING_NDJSON:
+            line = await reader.readuntil(NEWLINE)
+            return prefix + line[:-1]
+
+    except asyncio.IncompleteReadError as err:
+        if err.partial:
+            raise FrameError("Подключение закрыто посреди сообщения") from err
+        return None
+    except asyncio.LimitOverrunError as err:
+        raise FrameError(f"Размер сообщения превышает {max_size}") from err
+
+    data = prefix + await reader.read(max_size - len(prefix))
+    return data or None
+
+
+def send_frame(sock: socket.socket, payload: bytes, framing: str):
+    """Отправка кадра через блокирующий сокет (для клиентов)"""
+    sock.sendall(encode_frame(payload, framing))
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise FrameError("Подключение закрыто посреди сообщения")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_frame(sock: socket.socket, framing: str, buffer: bytearray) -> bytes:
+    """
+    Чтение кадра из блокирующего сокета (для клиентов).
+    buffer хранит байты следующих кадров между вызовами в режиме ndjson.
+    """
+
+    if framing == FRAMING_LENGTH:
+        (size,) = LENGTH_PREFIX.unpack(_recv_exactly(sock, LENGTH_PREFIX.size))
+        return _recv_exactly(sock, size)
+
+    if framing == FRAMING_NDJSON:
+        while NEWLINE not in buffer:
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise FrameError("Подключение закрыто посреди сообщения")
+            buffer.extend(chunk)
+        end = buffer.index(NEWLINE)
+        frame = bytes(buffer[:end])
+        del buffer[:end + 1]
+        return frame
+
+    return sock.recv(65536)
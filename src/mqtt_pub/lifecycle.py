@@ -0,0 +1,142 @@
+"""
+Остановка сервиса без потери запросов и передача сокета новому процессу.
+
+Остановка (SIGTERM, SIGINT) выполняется по этапам:
+1. сокет перестает принимать новые подключения;
+2. начатые запросы завершаются, постоянные подключения закрываются после ответа
+   на уже полученные запросы. Подключения, не завершенные за socket_drain_timeout, закрываются;
+3. очередь исходящих сообщений отправляется в брокер, публикации ожидают подтверждения брокера;
+4. клиенты брокера и подписчик отключаются (DISCONNECT вместо обрыва соединения).
+Сообщения, оставшиеся в очереди, сохраняются на диске и отправляются после запуска.
+
+Передача сокета (SIGUSR2): процесс запускает свою копию и передает ей прослушиваемый сокет
+(номер дескриптора в переменной окружения MQTT_PUB_LISTEN_FD). Новый процесс начинает
+принимать подключения на том же сокете и отправляет старому SIGTERM, после чего старый
+завершает начатые запросы и останавливается. Подключения из очереди сокета не теряются.
+Сокет, переданный systemd (socket activation, LISTEN_FDS), используется так же.
+"""
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+from time import monotonic
+from typing import Optional, Set, Tuple
+from .event_logger import get_info_logger, get_error_logger  # pylint: disable = import-error
+from .mqtt_pool import close_pools, drain_pools  # pylint: disable = import-error
+from .outbound_queue import close_outbound_queues  # pylint: disable = import-error
+from .reply_dispatcher import close_dispatchers  # pylint: disable = import-error
+from .routing import close_routers  # pylint: disable = import-error
+from .stream import close_hubs  # pylint: disable = import-error
+
+event_log = get_info_logger("INFO__lifecycle__")
+error_log = get_error_logger("ERR__lifecycle__")
+
+LISTEN_FD_ENV = "MQTT_PUB_LISTEN_FD"
+HANDOFF_PID_ENV = "MQTT_PUB_HANDOFF_PID"
+SYSTEMD_FIRST_FD = 3
+SYSTEMD_ENV = ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES")
+# Время на закрытие подключений, отмененных по истечении socket_drain_timeout
+CANCEL_TIMEOUT = 1.0
+
+
+def inherited_socket() -> Optional[socket.socket]:
+    """Прослушиваемый сокет, переданный предыдущим процессом или systemd. None, если сокета нет."""
+
+    fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if fd is None and os.environ.get("LISTEN_PID") == str(os.getpid()):
+        if os.environ.get("LISTEN_FDS", "0") != "0":
+            fd = str(SYSTEMD_FIRST_FD)
+        for name in SYSTEMD_ENV:
+            os.environ.pop(name, None)
+
+    if fd is None:
+        return None
+
+    sock = socket.socket(fileno=int(fd))
+    sock.set_inheritable(True)
+    event_log.info("Получен сокет %s", sock.getsockname())
+    return sock
+
+
+def spawn_successor(sock: Optional[socket.socket]) -> Optional[int]:
+    """
+    Запуск копии процесса с теми же аргументами, которой передается сокет sock
+    (None - новый процесс сам открывает сокет с SO_REUSEPORT).
+    Возвращает pid нового процесса или None, если запустить его не удалось.
+    """
+
+    env = {**os.environ, HANDOFF_PID_ENV: str(os.getpid())}
+    pass_fds: Tuple[int, ...] = ()
+    if sock is not None:
+        env[LISTEN_FD_ENV] = str(sock.fileno())
+        pass_fds = (sock.fileno(),)
+    command = list(getattr(sys, "orig_argv", None) or [sys.executable, *sys.argv])
+    try:
+        process = subprocess.Popen(  # pylint: disable = consider-using-with
+            command, env=env, pass_fds=pass_fds)
+    except OSError as err:
+        error_log.error("Не удалось запустить новый процесс для передачи сокета: %s", str(err))
+        return None
+
+    event_log.info("Запущен новый процесс для передачи сокета (pid %s)", process.pid)
+    return process.pid
+
+
+def notify_predecessor():
+    """
+    Сообщение процессу, передавшему сокет, что новый процесс принимает подключения:
+    предыдущий процесс получает SIGTERM и завершает начатые запросы.
+    """
+
+    pid = os.environ.pop(HANDOFF_PID_ENV, None)
+    # Только родителю: pid из окружения мог достаться другому процессу
+    if pid is None or not pid.isdigit() or int(pid) != os.getppid():
+        return
+
+    event_log.info("Остановка предыдущего процесса (pid %s)", pid)
+    try:
+        os.kill(int(pid), signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+async def drain_tasks(tasks: Set[asyncio.Task], timeout: float) -> int:
+    """
+    Ожидание завершения задач подключений, но не дольше timeout.
+    Незавершенные задачи отменяются. Возвращает количество отмененных задач.
+    """
+
+    if not tasks:
+        return 0
+
+    _, pending = await asyncio.wait(set(tasks), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending, timeout=CANCEL_TIMEOUT)
+    return len(pending)
+
+
+def release_broker_resources(timeout: float):
+    """
+    Отправка очереди исходящих сообщений, ожидание подтверждений публикаций
+    (всего не дольше timeout) и отключение от брокера клиентов пулов и подписчиков.
+    """
+
+    deadline = monotonic() + timeout
+    close_routers()
+
+    def remaining() -> float:
+        return max(0.0, deadline - monotonic())
+
+    close_outbound_queues(timeout=max(remaining(), CANCEL_TIMEOUT), flush_timeout=remaining())
+
+    undelivered = drain_pools(remaining())
+    if undelivered:
+        error_log.error("При остановке не подтверждено брокером публикаций: %s", undelivered)
+
+    close_hubs()
+    close_dispatchers()
+    close_pools()
@@ -1,113 +1,178 @@
 """This module is used to listen on a port to receive a message to write to the broker."""
+import asyncio
+import signal
 import socket
 import ssl
-import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+from . import protocol  # pylint: disable = import-error
+from .protocol import (KIND_ACTION, KIND_BATCH, KIND_STREAM,  # pylint: disable = import-error
+                       BatchItem, Request, parse_request)
+from .framing import (FRAMING_LEGACY, FRAMING_LENGTH, FrameError,  # pylint: disable = import-error
+                      detect_framing, encode_frame, read_frame)
 from .user_auth import client_authenticate, get_salt_from_hash  # pylint: disable = import-error
 from .event_logger import get_info_logger, get_error_logger  # pylint: disable = import-error
-from .mqtt_writer import read_from_mqtt  # pylint: disable = import-error
+from .mqtt_writer import (PUBLISH_MODE_ASYNC, PUBLISH_MODE_SYNC,  # pylint: disable = import-error
+                          TIMEOUT_ANSWER, TIMEOUT_WAIT_MQTT, publish_async, publish_batch,
+                          publish_to_mqtt, read_from_mqtt)
+from .metrics import counter, gauge, histogram, start_metrics_server  # pylint: disable = import-error
+from .outbound_queue import get_outbound_queue  # pylint: disable = import-error
+from .session import get_session_manager  # pylint: disable = import-error
+from .rate_limit import LIMIT_TOO_LARGE, get_rate_limiter  # pylint: disable = import-error
+from .routing import route_settings  # pylint: disable = import-error
+from .mqtt_pool import MQTTConnectionError  # pylint: disable = import-error
+from .stream import ClientStream, StreamError, check_filter  # pylint: disable = import-error
+from .payload import (BINARY_SEPARATOR, COMPRESSIONS,  # pylint: disable = import-error
+                      DEFAULT_MAX_SIZE, ENCODING_BINARY, ENCODINGS, Payload, PayloadError,
+                      check_codec, decode_message, split_binary_frame)
+from .config_watcher import start_config_watcher  # pylint: disable = import-error
+from .lifecycle import (drain_tasks, inherited_socket,  # pylint: disable = import-error
+                        notify_predecessor, release_broker_resources, spawn_successor)
+from .tls import server_context  # pylint: disable = import-error
 from .config import get_settings_to_socket, get_settings_to_publish  # pylint: disable = import-error
 
 MESSAGE_STATUS_SUCCESSFUL = "OK"
 INCORRECT_FORMAT_TITLE = "Incorrect format of the received file: %s"
+INCORRECT_JSON_ANSWER = "Неправильный формат сообщения"
 SLEEP_DURATION_AFTER_SENDING = 3
 AUTHENTICATION_CHECK = "/check_auth"
+LOGIN = "/login"
+LOGOUT = "/logout"
+INVALID_TOKEN_ANSWER = "Недействительный или просроченный токен"
 CLIENT_WAITING_ANSWER = "/in/params"
 COUNT_OF_CHAR = len(CLIENT_WAITING_ANSWER)
 TOPIC_WITH_ANSWERS = "/out/info"
+BATCH_ITEM_FAILED = "Сообщение не опубликовано"
+QUEUE_OVERFLOW_ANSWER = "Очередь сообщений переполнена"
+BUSY_ANSWER = "Сервис перегружен, повторите запрос позже"
+TOO_LARGE_ANSWER = "Запрос содержит больше сообщений, чем допускает ограничение скорости"
+SUBSCRIBE = "/subscribe"
+STREAM_UNAVAILABLE_ANSWER = "Подписка доступна только для подключений ndjson и length"
+BINARY_UNAVAILABLE_ANSWER = ("Двоичные данные передаются только в подключениях length"
+                             " после байта 0x00")
+INCORRECT_BINARY_ANSWER = "Сообщение с двоичными данными не должно содержать поле message"
+# Время на отправку очереди и отключение от брокера, если socket_drain_timeout уже истек
+MIN_RELEASE_TIMEOUT = 1.0
+
+# Результат обработки: ответ или Future ответа устройства (см. device_answer)
+Answer = Union[Payload, "Future[Payload]"]
 
 event_log = get_info_logger("INFO__listener__")
 error_log = get_error_logger("ERR__listener__")
 
+CONNECTIONS = counter("mqtt_pub_connections_total", "Accepted socket connections")
+ACTIVE_CONNECTIONS = gauge("mqtt_pub_active_connections", "Socket connections being served")
+REQUEST_LATENCY = histogram("mqtt_pub_request_seconds",
+                            "Time from receiving a request to having its answer", ["protocol"])
+AUTH_LATENCY = histogram("mqtt_pub_auth_seconds", "Time spent in check_authorization")
+AUTH_FAILURES = counter("mqtt_pub_auth_failures_total", "Rejected user/password pairs")
+
 
 class SocketConnectionError(Exception):
     """Исключение для ошибок при подключении к сокету"""
 
 
-class SocketConnection:
-    """Менеджер контекста для подключения к сокету"""
+def get_ssl_context(settings: dict) -> Optional[ssl.SSLContext]:
+    """SSL контекст сокета. Если ssl не используется, возвращается None."""
 
-    def __init__(self, settings):
-        self.host = settings.get("socket_host")
-        self.port = settings.get("socket_port")
+    if not settings.get("use_ssl"):
+        return None
 
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    return server_context(settings)
 
-        if settings.get("use_ssl"):
-            self.server_socket = ssl.wrap_socket(self.server_socket,  # pylint: disable = deprecated-method
-                                                 keyfile=settings.get("ssl_keyfile_path"),
-                                                 certfile=settings.get("ssl_certfile_path"),
-                                                 server_side=True)
 
-    def __enter__(self):
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+def execute_action(request: Request, settings_to_publish: dict) -> str:
+    """
+    Выполнение служебного действия, указанного в поле message.
 
-        try:
-            self.server_socket.bind((self.host, self.port))
-        except PermissionError as err:
-            raise SocketConnectionError from err
-        except socket.gaierror as err:
-            raise SocketConnectionError from err
+    Возвращаемое значение: строка с результатом действия
+    """
 
-        self.server_socket.listen(1)
-        return self.server_socket
+    handler = ACTIONS.get(request.action)  # type: ignore
+    if handler is None:
+        return f"Неизвестное действие: {request.action}"
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self.server_socket.close()
+    return handler(request, settings_to_publish)
 
 
-def is_correct_format_message(received_message: dict) -> bool:
-    """Сообщение должно содержать обязательные поля."""
+def action_get_salt(request: Request, settings_to_publish: dict) -> str:  # pylint: disable = unused-argument
+    """Соль для пароля пользователя"""
+    return get_salt_from_hash(request.user)  # type: ignore
 
-    if received_message.get("message") == "/get_salt" \
-            and received_message.get("user"):
-        return True
 
-    if received_message.get("message") == "/check_auth" \
-            and received_message.get("user")\
-            and received_message.get("password"):
-        return True
+def action_check_auth(request: Request, settings_to_publish: dict) -> str:  # pylint: disable = unused-argument
+    """Проверка логина и пароля"""
 
-    return sorted(list(received_message.keys())) == ["message", "password", "topic", "user"]
+    result = check_authorization(request)
+    if result:
+        event_log.info("login user %s : %s", request.user, result)
+    return result
 
 
-def execute_action(message: dict) -> str:
-    """
-    Выполнение действия указанного в поле action.
+def action_login(request: Request, settings_to_publish: dict) -> str:
+    """Выдача токена, который заменяет user/password в последующих сообщениях"""
 
-    Возвращаемое значение: строка с результатом действия
-    """
+    result = check_authorization(request)
+    if result != MESSAGE_STATUS_SUCCESSFUL:
+        return result
+    event_log.info("session started for user %s", request.user)
+    return get_session_manager(settings_to_publish["session"]).issue(request.user)  # type: ignore
 
-    action = message.get("message")
 
-    if action == "/get_salt":
-        return get_salt_from_hash(message["user"])
+def action_logout(request: Request, settings_to_publish: dict) -> str:
+    """Отзыв токена"""
 
-    if action == "/check_auth":
-        result = check_authorization(message)
-        if result:
-            event_log.info("login user %s : %s", message.get("user"), result)
-        return result
+    get_session_manager(settings_to_publish["session"]).revoke(request.token)  # type: ignore
+    return MESSAGE_STATUS_SUCCESSFUL
+
+
+def action_codecs(request: Request, settings_to_publish: dict) -> str:  # pylint: disable = unused-argument
+    """Кодировки и методы сжатия сообщений, которые поддерживает сервис (см. payload.py)"""
+    return protocol.dumps({"encoding": list(ENCODINGS), "compression": list(COMPRESSIONS)})
 
-    return f"Неизвестное действие: {action}"
 
+ACTIONS: Dict[str, Callable[[Request, dict], str]] = {"/get_salt": action_get_salt,
+                                                      AUTHENTICATION_CHECK: action_check_auth,
+                                                      LOGIN: action_login,
+                                                      LOGOUT: action_logout,
+                                                      "/codecs": action_codecs}
+# Проверка пароля ограничивается по пользователю, как сообщения, чтобы затруднить подбор
+PASSWORD_ACTIONS = frozenset((AUTHENTICATION_CHECK, LOGIN))
 
-def check_authorization(message: dict) -> str:
+
+def check_authorization(request: Request) -> str:
     """
     Проверяется правильность логина и пароля, который ввел пользователь.
 
     Возвращаемое значение: строка с результатом проверки.
     """
 
-    if message.get("user") is None or message.get("password") is None:
-        raise KeyError
+    with AUTH_LATENCY.time():
+        result = client_authenticate(request.user, request.password)  # type: ignore
 
-    result = client_authenticate(message["user"],
-                                 message["password"])
+    if not result:
+        AUTH_FAILURES.inc()
 
     return MESSAGE_STATUS_SUCCESSFUL if result else "Неизвестное имя пользователя или пароль"
 
 
-def message_handling(request: str, settings_to_publish: dict) -> str:
+def check_session(request: Request, settings_to_publish: dict) -> Tuple[str, str]:
+    """
+    Проверка сессионного токена, полученного через /login.
+
+    Возвращаемое значение: строка с результатом проверки и имя пользователя.
+    """
+
+    user = get_session_manager(settings_to_publish["session"]).validate(request.token)  # type: ignore
+    if user is None:
+        AUTH_FAILURES.inc()
+        return INVALID_TOKEN_ANSWER, ""
+
+    return MESSAGE_STATUS_SUCCESSFUL, user
+
+
+def message_handling(request: Union[str, bytes], settings_to_publish: dict) -> Answer:
     """
     Проверяет входящее сообщение и публикует в брокере mqtt.
     Если сообщение подразумевает ответ от брокера
@@ -119,63 +184,536 @@ def message_handling(request: str, settings_to_publish: dict) -> str:
 
     # Сообщение должно быть в формате JSON
     try:
-        received_message = json.loads(request)
-    except json.decoder.JSONDecodeError as err:
+        received_message = protocol.loads(request)
+    except protocol.DecodeError as err:
         event_log.error(INCORRECT_FORMAT_TITLE, str(err))
-        return "Неправильный формат сообщения"
+        return INCORRECT_JSON_ANSWER
+
+    return handle_message(received_message, settings_to_publish)
+
+
+def framed_message_handling(request: bytes, settings_to_publish: dict,
+                            stream: Optional[ClientStream] = None) -> Tuple[Any, Answer]:
+    """
+    Обработка сообщения в режиме с кадрами.
+    Поле id запроса возвращается в ответе, чтобы клиент мог сопоставить ответы
+    на несколько одновременно отправленных запросов.
+    stream - подписки подключения для запросов /subscribe и /unsubscribe.
+    В подключениях length кадр может содержать двоичные данные после JSON и байта 0x00
+    (см. payload.py), они передаются обработчику без копирования.
+
+    Возвращаемое значение: id запроса и результат обработки (кадр ответа - framed_answer).
+    """
+
+    request_id = None
+    header, data = (split_binary_frame(request) if stream is not None and stream.binary
+                    else (request, None))
+    try:
+        received_message = protocol.loads(header)
+    except protocol.DecodeError as err:
+        event_log.error(INCORRECT_FORMAT_TITLE, str(err))
+        result: Answer = INCORRECT_JSON_ANSWER
+    else:
+        if isinstance(received_message, dict):
+            request_id = received_message.pop("id", None)
+        if data is not None and not attach_binary(received_message, data):
+            result = INCORRECT_BINARY_ANSWER
+        else:
+            result = handle_message(received_message, settings_to_publish, stream, request_id)
+
+    return request_id, result
+
+
+def framed_answer(request_id: Any, result: Payload) -> bytes:
+    """
+    Кадр ответа: JSON {"id": ..., "result": str}; двоичный ответ устройства -
+    JSON {"id": ..., "result": "OK"}, байт 0x00 и данные ответа.
+    """
+
+    if isinstance(result, bytes):
+        return (protocol.dumps_bytes({"id": request_id, "result": MESSAGE_STATUS_SUCCESSFUL})
+                + BINARY_SEPARATOR + result)
+    return protocol.dumps_bytes({"id": request_id, "result": result})
+
+
+def attach_binary(received_message: Any, data: memoryview) -> bool:
+    """
+    Двоичные данные кадра становятся полем message в кодировке binary.
+    False, если сообщение уже содержит поле message или другую кодировку.
+    """
+
+    if (not isinstance(received_message, dict) or "message" in received_message
+            or received_message.get("encoding", ENCODING_BINARY) != ENCODING_BINARY):
+        return False
+
+    received_message["message"] = data
+    received_message["encoding"] = ENCODING_BINARY
+    return True
+
+
+def handle_message(received_message: dict, settings_to_publish: dict,
+                   stream: Optional[ClientStream] = None, request_id: Any = None) -> Answer:
+    """
+    Выполнение разобранного сообщения.
+    stream и request_id передаются только для постоянных подключений (см. handle_stream).
+    Для запросов с ответом устройства возвращается Future ответа (см. device_answer),
+    ответ на сообщение в кодировке binary - bytes.
+    """
 
     # Сообщение дожно иметь необходимые поля
-    if not is_correct_format_message(received_message):
+    request = parse_request(received_message)
+    if request is None:
         answer_for_client = "Сообщение не содержит необходимые поля"
         event_log.error(INCORRECT_FORMAT_TITLE, answer_for_client)
         return answer_for_client
 
-    # Выполнение служебный действий
-    if received_message.get("message") == "/get_salt" or\
-            received_message.get("message") == "/check_auth":
-        return execute_action(received_message)
+    limiter = get_rate_limiter(settings_to_publish["limits"])
 
-    # Проверка авторизации пользователя (при каждом сообщении)
-    answer_for_client = check_authorization(received_message)
+    # Выполнение служебный действий
+    if request.kind == KIND_ACTION:
+        if request.action in PASSWORD_ACTIONS and not limiter.allow(request.user, []):  # type: ignore
+            event_log.error("Превышено ограничение попыток входа для пользователя %s", request.user)
+            return BUSY_ANSWER
+        return execute_action(request, settings_to_publish)
+
+    codec_error = check_request_codec(request)
+    if codec_error is not None:
+        event_log.error(INCORRECT_FORMAT_TITLE, codec_error)
+        return codec_error
+
+    # Проверка авторизации пользователя (по токену или логину и паролю при каждом сообщении)
+    user: Optional[str]
+    if request.token is not None:
+        answer_for_client, user = check_session(request, settings_to_publish)
+    else:
+        answer_for_client, user = check_authorization(request), request.user
     if answer_for_client != MESSAGE_STATUS_SUCCESSFUL:
         event_log.error(answer_for_client)
         return answer_for_client
 
-    report = received_message.get("topic"), received_message.get("message")
+    # Ограничение скорости по пользователю и префиксу топика
+    topics = ([item[0] for item in request.batch] if request.kind == KIND_BATCH  # type: ignore
+              else [request.topic])
+    limit = limiter.check(user, topics)  # type: ignore
+    if limit == LIMIT_TOO_LARGE:
+        event_log.error("Запрос пользователя %s превышает ограничение скорости: %s сообщений",
+                        user, len(topics))
+        return TOO_LARGE_ANSWER
+    if limit is not None:
+        event_log.error("Превышено ограничение скорости для пользователя %s", user)
+        return BUSY_ANSWER
+
+    # Данные распаковываются только после проверки авторизации
+    try:
+        decode_request(request, settings_to_publish)
+    except PayloadError as err:
+        event_log.error(INCORRECT_FORMAT_TITLE, str(err))
+        return str(err)
+
+    if request.kind == KIND_BATCH:
+        return handle_batch(request.batch, settings_to_publish)  # type: ignore
+
+    if request.kind == KIND_STREAM:
+        return handle_stream(request, user, settings_to_publish, stream, request_id)  # type: ignore
 
-    if report[0][-COUNT_OF_CHAR:] == CLIENT_WAITING_ANSWER:
-        # Получение ответа от устройства
-        topic_with_answer = report[0][:-COUNT_OF_CHAR] + TOPIC_WITH_ANSWERS
-        return read_from_mqtt(settings=settings_to_publish,
-                              topic_for_read=topic_with_answer,
-                              topic_for_write=report[0],
-                              message=report[1])
+    topic, message = request.topic, request.message
+
+    if topic.endswith(CLIENT_WAITING_ANSWER):  # type: ignore
+        # Получение ответа от устройства.
+        # Количество одновременных ожиданий ограничено:
+        # место освобождается после ответа или таймаута
+        if not limiter.acquire_reply_slot():
+            return BUSY_ANSWER
+        topic_with_answer = topic[:-COUNT_OF_CHAR] + TOPIC_WITH_ANSWERS  # type: ignore
+        try:
+            answer = read_from_mqtt(settings=settings_to_publish,
+                                    topic_for_read=topic_with_answer,
+                                    topic_for_write=topic,  # type: ignore
+                                    message=message,
+                                    qos=request.qos,
+                                    encoding=request.encoding,
+                                    compression=request.compression)
+        except BaseException:
+            limiter.release_reply_slot()
+            raise
+        answer.add_done_callback(lambda done: limiter.release_reply_slot())
+        return answer
+
+    return publish_message(request, settings_to_publish)
+
+
+def check_request_codec(request: Request) -> Optional[str]:
+    """Проверка кодировки и сжатия сообщения. Возвращает сообщение об ошибке или None."""
+
+    error = check_codec(request.encoding, request.compression)
+    if error is not None:
+        return error
+    # Данные в кодировке binary есть только у сообщений из кадров length (см. attach_binary)
+    if (request.encoding == ENCODING_BINARY and request.kind != KIND_STREAM
+            and not isinstance(request.message, memoryview)):
+        return BINARY_UNAVAILABLE_ANSWER
+    return None
+
+
+def decode_request(request: Request, settings_to_publish: dict):
+    """Декодирование и распаковка данных сообщения или сообщений пакета для публикации"""
+
+    if request.encoding is None or request.kind == KIND_STREAM:
+        return
+
+    max_size = settings_to_publish.get("compression", {}).get("max_size", DEFAULT_MAX_SIZE)
+    if request.kind == KIND_BATCH:
+        request.batch = [(topic, decode_message(message, request.encoding, request.compression,
+                                                max_size), *options)
+                         for topic, message, *options in request.batch]  # type: ignore
+    else:
+        request.message = decode_message(request.message, request.encoding,
+                                         request.compression, max_size)
+
+
+def publish_message(request: Request, settings_to_publish: dict) -> str:
+    """
+    Публикация сообщения без ожидания ответа устройства в режиме publish.mode:
+    spool - через очередь на диске, сообщение не теряется, если брокер недоступен;
+    async - без ожидания подтверждения брокера; sync - после подтверждения брокера.
+    """
+
+    topic, message = request.topic, request.message
+    mode = settings_to_publish.get("publish", {}).get("mode")
+
+    if mode in (PUBLISH_MODE_ASYNC, PUBLISH_MODE_SYNC):
+        publish = publish_async if mode == PUBLISH_MODE_ASYNC else publish_to_mqtt
+        published = publish((topic, message, request.qos, request.retain), settings_to_publish)
+        return MESSAGE_STATUS_SUCCESSFUL if published else BATCH_ITEM_FAILED
+
+    if not get_outbound_queue(settings_to_publish).put(topic, message,  # type: ignore
+                                                       request.qos, request.retain):
+        event_log.error("Очередь исходящих сообщений переполнена, сообщение для %s отклонено",
+                        topic)
+        return QUEUE_OVERFLOW_ANSWER
 
     return MESSAGE_STATUS_SUCCESSFUL
 
 
-def open_socket(settings_to_socket: dict, settings_to_publish: dict):
+def handle_batch(reports: List[BatchItem], settings_to_publish: dict) -> str:
     """
-    Прослушивает порт и получает сообщение
+    Публикация пакета сообщений через одно подключение к брокеру.
+
+    Ответ: JSON список [{"topic": str, "status": str}] в порядке сообщений пакета.
+    """
+
+    results = publish_batch(reports, settings_to_publish)
+
+    return protocol.dumps([{"topic": topic,
+                            "status": MESSAGE_STATUS_SUCCESSFUL if published else BATCH_ITEM_FAILED}
+                           for (topic, *_), published in zip(reports, results)])
+
+
+def handle_stream(request: Request, user: str, settings_to_publish: dict,  # pylint: disable = too-many-arguments
+                  stream: Optional[ClientStream], request_id: Any) -> str:
+    """
+    Подписка подключения на сообщения фильтра request.topic или ее отмена.
+    Сообщения отправляются кадрами с id запроса подписки (см. stream.py).
     """
 
+    if stream is None:
+        return STREAM_UNAVAILABLE_ANSWER
+
+    topic_filter: str = request.topic  # type: ignore
+    if request.action != SUBSCRIBE:
+        stream.unsubscribe(topic_filter)
+        return MESSAGE_STATUS_SUCCESSFUL
+
+    if request.encoding == ENCODING_BINARY and not stream.binary:
+        return BINARY_UNAVAILABLE_ANSWER
+
+    error = check_filter(user, topic_filter)
+    if error is not None:
+        event_log.error("Подписка пользователя %s на %s отклонена: %s", user, topic_filter, error)
+        return error
+
     try:
-        with SocketConnection(settings_to_socket) as server_socket:
+        stream.subscribe(request_id, topic_filter,
+                         route_settings(settings_to_publish, topic_filter),
+                         (request.encoding, request.compression))
+    except StreamError as err:
+        return str(err)
+    except MQTTConnectionError as err:
+        event_log.error("Ошибка подключения mqtt. Невозможно оформить подписку по причине: %s",
+                        str(err))
+        return "Не удалось подписаться на топик"
+
+    event_log.info("Пользователь %s подписан на %s", user, topic_filter)
+    return MESSAGE_STATUS_SUCCESSFUL
 
+
+async def device_answer(answer: Answer) -> Payload:
+    """
+    Ожидание ответа устройства в цикле событий, не занимая поток обработки.
+    Если ответ не получен за TIMEOUT_WAIT_MQTT секунд, ожидание отменяется.
+    """
+
+    if not isinstance(answer, Future):
+        return answer
+
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(answer), TIMEOUT_WAIT_MQTT)
+    except asyncio.TimeoutError:
+        return TIMEOUT_ANSWER
+
+
+async def handle_connection(reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter,
+                            settings_to_socket: dict,
+                            settings_to_publish: dict,
+                            executor: ThreadPoolExecutor,
+                            stopping: Optional[asyncio.Event] = None):
+    """
+    Обработка одного подключения.
+    Блокирующая обработка сообщения выполняется в пуле потоков,
+    поэтому медленный клиент не задерживает остальных.
+    Ответ устройства ожидается в цикле событий (device_answer), не занимая поток.
+    stopping - событие остановки сервиса: постоянное подключение перестает читать запросы.
+    """
+
+    try:
+        framing, prefix = await asyncio.wait_for(
+            detect_framing(reader, settings_to_socket["socket_framing"]),
+            settings_to_socket["socket_timeout"])
+
+        if framing == FRAMING_LEGACY:
+            await handle_legacy_connection(reader, writer, prefix,
+                                           settings_to_socket, settings_to_publish, executor)
+        else:
+            await handle_framed_connection(reader, writer, framing, prefix,
+                                           settings_to_socket, settings_to_publish, executor,
+                                           stopping)
+    except asyncio.TimeoutError:
+        event_log.error("Превышено время ожидания клиента %s",
+                        writer.get_extra_info("peername"))
+    except (ConnectionError, UnicodeDecodeError, FrameError) as err:
+        event_log.error("Ошибка обработки подключения: %s", str(err))
+    finally:
+        writer.close()
+
+
+async def handle_legacy_connection(reader: asyncio.StreamReader,
+                                   writer: asyncio.StreamWriter,
+                                   prefix: bytes,
+                                   settings_to_socket: dict,
+                                   settings_to_publish: dict,
+                                   executor: ThreadPoolExecutor):
+    """Одно сообщение и один ответ на подключение"""
+
+    timeout = settings_to_socket["socket_timeout"]
+    loop = asyncio.get_running_loop()
+
+    request = await asyncio.wait_for(
+        read_frame(reader, FRAMING_LEGACY, settings_to_socket["socket_max_frame_size"], prefix),
+        timeout)
+    with REQUEST_LATENCY.time(protocol=FRAMING_LEGACY):
+        response = await device_answer(await loop.run_in_executor(
+            executor, message_handling, request or b"", settings_to_publish))
+
+    writer.write(response.encode() if isinstance(response, str) else response)
+    await asyncio.wait_for(writer.drain(), timeout)
+
+
+async def handle_framed_connection(reader: asyncio.StreamReader,  # pylint: disable = too-many-arguments
+                                   writer: asyncio.StreamWriter,
+                                   framing: str,
+                                   prefix: bytes,
+                                   settings_to_socket: dict,
+                                   settings_to_publish: dict,
+                                   executor: ThreadPoolExecutor,
+                                   stopping: Optional[asyncio.Event] = None):
+    """
+    Постоянное подключение: клиент может отправить несколько запросов, не дожидаясь ответов.
+    Запросы выполняются параллельно (не более socket_pipeline_depth на подключение),
+    ответы отправляются по мере готовности и содержат id запроса.
+    Сообщения подписок (/subscribe) отправляются отдельной задачей; пока у подключения
+    есть подписки, оно не закрывается по socket_idle_timeout.
+    После события stopping новые запросы не читаются: подключение закрывается,
+    как только отправлены ответы на уже полученные запросы.
+    """
+
+    timeout = settings_to_socket["socket_timeout"]
+    idle_timeout = settings_to_socket["socket_idle_timeout"]
+    max_size = settings_to_socket["socket_max_frame_size"]
+    window = asyncio.Semaphore(settings_to_socket["socket_pipeline_depth"])
+    write_lock = asyncio.Lock()
+    pending: Set[asyncio.Task] = set()
+    loop = asyncio.get_running_loop()
+    stream = ClientStream(loop, settings_to_socket, writer.close, binary=framing == FRAMING_LENGTH)
+
+    async def respond(request: bytes):
+        try:
+            with REQUEST_LATENCY.time(protocol=framing):
+                request_id, result = await loop.run_in_executor(
+                    executor, framed_message_handling, request, settings_to_publish, stream)
+                response = framed_answer(request_id, await device_answer(result))
+            async with write_lock:
+                writer.write(encode_frame(response, framing))
+                await asyncio.wait_for(writer.drain(), timeout)
+        finally:
+            window.release()
+
+    async def send_stream():
+        try:
             while True:
-                conn, _ = server_socket.accept()
-                request = conn.recv(1024).decode("utf-8")
+                frames = await stream.take()
+                async with write_lock:
+                    writer.writelines([encode_frame(frame, framing) for frame in frames])
+                    await asyncio.wait_for(writer.drain(), timeout)
+        except (asyncio.TimeoutError, ConnectionError) as err:
+            event_log.error("Ошибка отправки сообщений подписки: %s", str(err) or "таймаут")
+            writer.close()
+
+    sender = asyncio.create_task(send_stream())
+    stop = asyncio.ensure_future((stopping or asyncio.Event()).wait())
+    read: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if read is None:
+                read = asyncio.ensure_future(read_frame(reader, framing, max_size, prefix))
+                prefix = b""
+            done, _ = await asyncio.wait({read, stop}, timeout=idle_timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if read not in done:
+                if stop in done:
+                    break
+                if stream.active:
+                    continue
+                raise asyncio.TimeoutError
+            request = read.result()
+            read = None
+            if request is None:
+                break
+
+            await window.acquire()
+            task = asyncio.create_task(respond(request))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+    finally:
+        stop.cancel()
+        if read is not None:
+            read.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        sender.cancel()
+        if stream.active:
+            # Отмена подписки может ждать завершения чужой подписки в том же фильтре
+            await loop.run_in_executor(executor, stream.close)
+        else:
+            stream.close()
+
+
+async def serve(settings_to_socket: dict, settings_to_publish: dict,
+                sock: Optional[socket.socket] = None, handoff: bool = False,
+                on_listening: Optional[Callable[[], None]] = None):
+    """
+    Прослушивает порт и обрабатывает подключения конкурентно до получения SIGTERM или SIGINT,
+    после чего выполняет плавную остановку (см. lifecycle.py).
+    Количество одновременно обрабатываемых подключений ограничено socket_max_connections.
+    sock - уже открытый сокет (например, полученный от supervisor).
+    handoff - по SIGUSR2 сокет передается новому процессу.
+    on_listening - вызывается, когда сокет начал принимать подключения.
+    """
 
-                response = message_handling(request, settings_to_publish)
+    loop = asyncio.get_running_loop()
+    limiter = asyncio.Semaphore(settings_to_socket["socket_max_connections"])
+    executor = ThreadPoolExecutor(max_workers=settings_to_socket["socket_workers"],
+                                  thread_name_prefix="listener")
+    stopping = asyncio.Event()
+    connections: Set[asyncio.Task] = set()
+
+    async def on_connect(reader, writer):
+        CONNECTIONS.inc()
+        task = asyncio.current_task()
+        connections.add(task)  # type: ignore
+        try:
+            async with limiter:
+                ACTIVE_CONNECTIONS.inc()
+                try:
+                    await handle_connection(reader, writer, settings_to_socket,
+                                            settings_to_publish, executor, stopping)
+                finally:
+                    ACTIVE_CONNECTIONS.dec()
+        except asyncio.CancelledError:
+            # Подключение закрыто по истечении socket_drain_timeout
+            pass
+        finally:
+            connections.discard(task)  # type: ignore
+
+    address: Dict[str, Any]
+    if sock is not None:
+        address = {"sock": sock}
+    else:
+        address = {"host": settings_to_socket["socket_host"],
+                   "port": settings_to_socket["socket_port"],
+                   "reuse_address": True,
+                   "reuse_port": settings_to_socket["socket_reuse_port"] or None}
 
-                conn.sendall(response.encode())
-                conn.close()
+    try:
+        server = await asyncio.start_server(on_connect,
+                                            **address,
+                                            ssl=get_ssl_context(settings_to_socket),
+                                            ssl_handshake_timeout=(
+                                                settings_to_socket["socket_timeout"]
+                                                if settings_to_socket["use_ssl"] else None),
+                                            backlog=settings_to_socket["socket_backlog"],
+                                            limit=settings_to_socket["socket_max_frame_size"])
+    except (PermissionError, socket.gaierror) as err:
+        raise SocketConnectionError from err
+
+    # Сигналы принимает только главный поток (в остальных serve работает до отмены задачи)
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            # SIGINT игнорируется рабочими процессами supervisor
+            if signal.getsignal(signum) is not signal.SIG_IGN:
+                loop.add_signal_handler(signum, stopping.set)
+        if handoff:
+            loop.add_signal_handler(signal.SIGUSR2, spawn_successor, server.sockets[0])
+    if on_listening is not None:
+        on_listening()
+
+    watcher = start_config_watcher(settings_to_publish,
+                                   settings_to_socket["config_reload_interval"])
+    drain_timeout = settings_to_socket["socket_drain_timeout"]
+    try:
+        await stopping.wait()
+        deadline = loop.time() + drain_timeout
+        event_log.info("Остановка: новые подключения не принимаются, активных подключений: %s",
+                       len(connections))
+        server.close()
+        cancelled = await drain_tasks(connections, drain_timeout)
+        if cancelled:
+            error_log.error("Подключений закрыто до завершения запросов: %s", cancelled)
+    finally:
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR2):
+            loop.remove_signal_handler(signum)
+        if watcher is not None:
+            watcher.stop()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # Очередь и подтверждения публикаций ожидаются в пределах того же socket_drain_timeout
+    await loop.run_in_executor(None, release_broker_resources,
+                               max(deadline - loop.time(), MIN_RELEASE_TIMEOUT))
+    event_log.info("Остановка завершена")
+
+
+def open_socket(settings_to_socket: dict, settings_to_publish: dict,
+                sock: Optional[socket.socket] = None, handoff: bool = False,
+                on_listening: Optional[Callable[[], None]] = None):
+    """
+    Прослушивает порт и получает сообщение
+    """
 
+    try:
+        asyncio.run(serve(settings_to_socket, settings_to_publish, sock, handoff, on_listening))
     except SocketConnectionError as err:
         event_log.error("Ошибка подключения к сокету."
                         " Не удалось получить сообщение по причине: %s", str(err))
-    except socket.timeout:
-        open_socket(settings_to_socket, settings_to_publish)
     except KeyboardInterrupt:
         event_log.info("Ручная остановка программы")
 
@@ -190,6 +728,20 @@ def start_listening():
                    settings_to_socket.get("socket_host"),
                    settings_to_socket.get("socket_port"))
 
-    open_socket(settings_to_socket, settings_to_publish)
+    if settings_to_socket.get("workers", 1) > 1:
+        # Импорт здесь: supervisor сам использует функции этого модуля
+        from .supervisor import Supervisor  # pylint: disable = import-outside-toplevel
+        Supervisor(settings_to_socket, settings_to_publish).run()
+        event_log.info("Завершение работы")
+        return
+
+    try:
+        start_metrics_server(settings_to_socket.get("metrics_host"),
+                             settings_to_socket.get("metrics_port"))
+    except OSError as err:
+        event_log.error("Не удалось запустить сервер метрик: %s", str(err))
+
+    open_socket(settings_to_socket, settings_to_publish, inherited_socket(),
+                handoff=True, on_listening=notify_predecessor)
 
     event_log.info("Завершение работы")
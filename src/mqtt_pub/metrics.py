@@ -0,0 +1,341 @@
+"""
+Метрики сервиса в формате Prometheus.
+
+Счетчики, измерители и гистограммы регистрируются в общем реестре REGISTRY
+и отдаются по HTTP на адрес /metrics (см. start_metrics_server).
+"""
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Базовый класс метрики. Значения хранятся по кортежу значений меток."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        """Строки со значениями метрики"""
+        raise NotImplementedError
+
+    def snapshot(self) -> dict:
+        """Текущие значения метрики по кортежам меток (для передачи между процессами)"""
+        raise NotImplementedError
+
+    def merge(self, values: dict):
+        """Добавление значений из snapshot() другого процесса"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """Метрика в текстовом формате Prometheus"""
+
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Монотонно возрастающий счетчик"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        """Увеличение счетчика"""
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Текущее значение"""
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    """Значение, которое может расти и уменьшаться, либо вычисляется функцией при чтении"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        """Установка значения"""
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        """Увеличение значения"""
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        """Уменьшение значения"""
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        """Значение будет вычисляться при каждом чтении метрики"""
+
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def value(self, **labels) -> float:
+        """Текущее значение"""
+
+        key = self._key(labels)
+        function = self._functions.get(key)
+        return function() if function else self._values.get(key, 0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self.snapshot().items()]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                values[key] = function()
+            except Exception:  # pylint: disable = broad-except
+                continue
+        return values
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0) + value
+
+
+class Histogram(Metric):
+    """Распределение значений (например, длительности операций) по корзинам"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        """Добавление значения"""
+
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * len(self.buckets)
+            counts[index] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Измерение длительности блока кода"""
+
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        """Количество наблюдений"""
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            counts = {key: list(value) for key, value in self._counts.items()}
+            sums = dict(self._sums)
+
+        lines = []
+        for key, bucket_counts in counts.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                le_label = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket"
+                             f"{_format_labels(self.labelnames, key, le_label)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(sums[key])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: (list(counts), self._sums[key]) for key, counts in self._counts.items()}
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, (counts, total) in values.items():
+                own = self._counts.setdefault(key, [0] * len(self.buckets))
+                for index, bucket_count in enumerate(counts):
+                    own[index] += bucket_count
+                self._sums[key] = self._sums.get(key, 0.0) + total
+
+
+class Registry:
+    """Реестр метрик"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """Регистрация метрики. Повторная регистрация возвращает существующую метрику."""
+
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+    def snapshot(self) -> List[tuple]:
+        """Описание и значения всех метрик (для передачи между процессами)"""
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return [(type(metric).__name__, metric.name, metric.documentation, metric.labelnames,
+                 getattr(metric, "buckets", ())[:-1], metric.snapshot())
+                for metric in metrics]
+
+
+METRIC_CLASSES = {"Counter": Counter, "Gauge": Gauge, "Histogram": Histogram}
+
+
+def merge_snapshots(snapshots: List[List[tuple]]) -> Registry:
+    """
+    Объединение метрик нескольких процессов.
+    Значения с одинаковыми метками суммируются, корзины гистограмм складываются.
+    """
+
+    registry = Registry()
+    for snapshot in snapshots:
+        for kind, name, documentation, labelnames, buckets, values in snapshot:
+            metric_class = METRIC_CLASSES[kind]
+            metric = (metric_class(name, documentation, labelnames, buckets)  # type: ignore
+                      if buckets else metric_class(name, documentation, labelnames))
+            registry.register(metric).merge(values)
+    return registry
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    """Счетчик в общем реестре"""
+    return REGISTRY.register(Counter(name, documentation, labelnames))  # type: ignore
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    """Измеритель в общем реестре"""
+    return REGISTRY.register(Gauge(name, documentation, labelnames))  # type: ignore
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """Гистограмма в общем реестре"""
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))  # type: ignore
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Обработчик HTTP запросов к /metrics"""
+
+    render: Callable[[], str] = staticmethod(REGISTRY.render)  # type: ignore
+
+    def do_GET(self):  # pylint: disable = invalid-name
+        """Отдача метрик"""
+
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+
+        body = self.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable = redefined-builtin
+        """Запросы к метрикам не записываются в лог"""
+
+
+def start_metrics_server(host: str, port: int,
+                         render: Callable[[], str] = REGISTRY.render) -> Optional[ThreadingHTTPServer]:
+    """
+    Запуск HTTP сервера метрик в фоновом потоке.
+    render - функция, возвращающая метрики в текстовом формате.
+    Если port равен 0, сервер не запускается.
+    """
+
+    if not port:
+        return None
+
+    handler = type("RegistryMetricsHandler", (MetricsHandler,), {"render": staticmethod(render)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
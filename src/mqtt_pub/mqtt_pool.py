@@ -0,0 +1,421 @@
+"""
+Пул постоянных подключений к mqtt брокеру.
+
+Клиенты подключаются один раз и переиспользуются между публикациями.
+Переподключение с экспоненциальной задержкой выполняет сетевой цикл paho,
+состояние каждого подключения отслеживается в PooledClient.
+
+Количество сообщений, ожидающих подтверждения брокера (max_inflight), и размер очереди
+клиента paho (max_queued) задаются в pool: на медленных каналах к брокеру
+большее окно увеличивает пропускную способность.
+"""
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from socket import SHUT_RDWR, gaierror
+from time import monotonic, perf_counter, sleep
+from typing import Any, Callable, Collection, Dict, Iterator, List, Optional
+import paho.mqtt.client as mqtt
+from .event_logger import get_info_logger, get_error_logger  # pylint: disable = import-error
+from .metrics import counter, gauge, histogram  # pylint: disable = import-error
+from .tls import clear_client_contexts, get_client_context  # pylint: disable = import-error
+
+event_log = get_info_logger("INFO__mqtt_pool__")
+error_log = get_error_logger("ERR__mqtt_pool__")
+
+BROKER_CONNECTS = counter("mqtt_pub_broker_connects_total", "Successful broker (re)connections")
+BROKER_DISCONNECTS = counter("mqtt_pub_broker_disconnects_total", "Lost broker connections")
+BROKER_CONNECTED = gauge("mqtt_pub_broker_connected_clients", "Pooled clients currently connected")
+BROKER_CONNECT_LATENCY = histogram("mqtt_pub_broker_connect_seconds",
+                                   "Time from (re)connect start to CONNACK")
+POOL_WAIT = histogram("mqtt_pub_pool_wait_seconds", "Time waiting for a connected pooled client")
+
+DEFAULT_POOL_SETTINGS = {"size": 2,
+                         "reconnect_min_delay": 1,
+                         "reconnect_max_delay": 60,
+                         "connect_timeout": 10.0,
+                         "max_inflight": 20,
+                         "max_queued": 0}
+
+DRAIN_POLL_INTERVAL = 0.05
+
+# Подтверждения, полученные раньше, чем publish вернул mid сообщения
+MAX_EARLY_DELIVERIES = 1024
+
+DeliveryCallback = Callable[[bool], None]
+
+
+class MQTTConnectionError(Exception):
+    """Исключение для ошибок подключения к mqtt брокеру"""
+
+
+class PublishTimeoutError(MQTTConnectionError):
+    """Брокер не подтвердил публикацию вовремя: подключение считается неисправным"""
+
+
+def wait_published(info: mqtt.MQTTMessageInfo, timeout: float):
+    """
+    Ожидание подтверждения публикации брокером (для QoS 0 - отправки), но не дольше timeout.
+    ValueError и RuntimeError - сообщение не принято клиентом paho.
+    PublishTimeoutError - подтверждение не получено, клиент, выданный connection(),
+    возвращается в пул как неисправный и подключается заново.
+    """
+
+    info.wait_for_publish(timeout)
+    if not info.is_published():
+        raise PublishTimeoutError(f"Брокер не подтвердил публикацию за {timeout} сек")
+
+
+def is_accepted(info: mqtt.MQTTMessageInfo, qos: int) -> bool:
+    """
+    Сообщение принято клиентом paho: отправлено
+    или (QoS 1, 2) будет отправлено после переподключения
+    """
+    return info.rc == mqtt.MQTT_ERR_SUCCESS or (info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0)
+
+
+class PooledClient:
+    """Подключение к брокеру, которое живет все время работы сервиса"""
+
+    def __init__(self, settings: dict, pool_settings: dict):
+        self.settings = settings
+        self.client = mqtt.Client()
+        self.connected = threading.Event()
+        self.connect_count = 0
+        self.disconnect_count = 0
+        self.last_error = ""
+        self._connect_started = perf_counter()
+        self._deliveries: Dict[int, DeliveryCallback] = {}
+        self._early_deliveries: "OrderedDict[int, None]" = OrderedDict()
+        self._registering = 0
+        self._delivery_lock = threading.Lock()
+
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+        self.client.reconnect_delay_set(min_delay=pool_settings["reconnect_min_delay"],
+                                        max_delay=pool_settings["reconnect_max_delay"])
+        self.client.max_inflight_messages_set(max(1, pool_settings.get("max_inflight", 20)))
+        self.client.max_queued_messages_set(max(0, pool_settings.get("max_queued", 0)))
+
+    def start(self):
+        """Асинхронное подключение. Повторные попытки выполняет сетевой цикл paho."""
+
+        self._connect_started = perf_counter()
+        try:
+            if self.settings.get("broker_use_tls"):
+                # Общий контекст: сертификаты не читаются заново, сессия TLS возобновляется
+                self.client.tls_set_context(get_client_context(self.settings.get("tls")))
+            self.client.connect_async(**self.settings.get("broker_settings"))
+        except (gaierror, OSError, TypeError, ValueError) as err:
+            raise MQTTConnectionError from err
+
+        self.client.loop_start()
+
+    def stop(self):
+        """
+        Отключение от брокера и остановка сетевого цикла.
+        Неподтвержденные публикации не доставлены.
+        """
+        self.client.disconnect()
+        self.client.loop_stop()
+        self.connected.clear()
+
+        with self._delivery_lock:
+            callbacks = list(self._deliveries.values())
+            self._deliveries.clear()
+        for callback in callbacks:
+            callback(False)
+
+    def publish(self, topic: str, payload: Any, qos: int = 1, retain: bool = False,
+                on_delivered: Optional[DeliveryCallback] = None) -> mqtt.MQTTMessageInfo:
+        """
+        Публикация без ожидания подтверждения брокера.
+
+        on_delivered(True) вызывается в сетевом потоке paho после PUBACK (QoS 1), PUBCOMP (QoS 2)
+        или отправки сообщения (QoS 0). on_delivered(False) - сообщение не принято клиентом
+        или подключение закрыто до подтверждения. Сообщения QoS 1 и 2, опубликованные
+        без подключения, отправляются после переподключения.
+        """
+
+        if on_delivered is None:
+            return self.client.publish(topic, payload, qos=qos, retain=retain)
+
+        with self._delivery_lock:
+            self._registering += 1
+        try:
+            info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        except (ValueError, TypeError):
+            self._finish_registration()
+            raise
+
+        accepted = is_accepted(info, qos)
+        with self._delivery_lock:
+            # Сетевой поток мог подтвердить сообщение до возврата из client.publish
+            delivered = info.mid in self._early_deliveries
+            if delivered:
+                del self._early_deliveries[info.mid]
+            elif accepted:
+                self._deliveries[info.mid] = on_delivered
+        self._finish_registration()
+
+        if delivered or not accepted:
+            on_delivered(delivered)
+        return info
+
+    @property
+    def undelivered(self) -> int:
+        """Публикации с on_delivered, еще не подтвержденные брокером"""
+        return len(self._deliveries)
+
+    def wait_delivered(self, timeout: float) -> bool:
+        """
+        Ожидание подтверждения брокером всех публикаций с on_delivered.
+        True, если все подтверждены.
+        """
+
+        deadline = monotonic() + timeout
+        while self._deliveries and self.connected.is_set() and monotonic() < deadline:
+            sleep(DRAIN_POLL_INTERVAL)
+        return not self._deliveries
+
+    def wait_connected(self, timeout: float) -> bool:
+        """Ожидание подключения к брокеру"""
+        return self.connected.wait(timeout)
+
+    def reset(self):
+        """Подключение неисправно: сокет закрывается, сетевой цикл paho подключается заново"""
+
+        sock = self.client.socket()
+        if sock is None:
+            return
+        error_log.error("Подключение к брокеру %s не отвечает, переподключение",
+                        self.settings["broker_settings"].get("host"))
+        try:
+            sock.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _on_connect(self, client, userdata, flags, result_code):  # pylint: disable = unused-argument
+        if result_code == mqtt.MQTT_ERR_SUCCESS:
+            self.connect_count += 1
+            self.connected.set()
+            BROKER_CONNECTS.inc()
+            BROKER_CONNECTED.inc()
+            BROKER_CONNECT_LATENCY.observe(perf_counter() - self._connect_started)
+            event_log.info("Подключение к брокеру %s установлено",
+                           self.settings["broker_settings"].get("host"))
+        else:
+            self.last_error = mqtt.connack_string(result_code)
+            error_log.error("Брокер отклонил подключение: %s", self.last_error)
+
+    def _finish_registration(self):
+        with self._delivery_lock:
+            self._registering -= 1
+            if not self._registering:
+                self._early_deliveries.clear()
+
+    def _on_publish(self, client, userdata, mid):  # pylint: disable = unused-argument
+        with self._delivery_lock:
+            callback = self._deliveries.pop(mid, None)
+            if callback is None and self._registering:
+                self._early_deliveries[mid] = None
+                if len(self._early_deliveries) > MAX_EARLY_DELIVERIES:
+                    self._early_deliveries.popitem(last=False)
+        if callback is not None:
+            callback(True)
+
+    def _on_disconnect(self, client, userdata, result_code):  # pylint: disable = unused-argument
+        if self.connected.is_set():
+            BROKER_CONNECTED.dec()
+        self.connected.clear()
+        self.disconnect_count += 1
+        self._connect_started = perf_counter()
+        BROKER_DISCONNECTS.inc()
+        if result_code != mqtt.MQTT_ERR_SUCCESS:
+            self.last_error = mqtt.error_string(result_code)
+            error_log.error("Потеряно подключение к брокеру: %s", self.last_error)
+
+
+class MqttClientPool:
+    """
+    Пул подключений к одному брокеру.
+
+    Клиент выдается в монопольное пользование через connection()
+    и возвращается в пул после использования.
+    """
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.pool_settings = {**DEFAULT_POOL_SETTINGS, **settings.get("pool", {})}
+        self._clients: List[PooledClient] = []
+        self._idle: queue.Queue = queue.Queue()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Создание и подключение клиентов пула"""
+
+        with self._lock:
+            if self._started:
+                return
+
+            for _ in range(max(1, self.pool_settings["size"])):
+                pooled = PooledClient(self.settings, self.pool_settings)
+                pooled.start()
+                self._clients.append(pooled)
+                self._idle.put(pooled)
+
+            self._started = True
+
+    def close(self):
+        """Отключение всех клиентов пула"""
+
+        with self._lock:
+            for pooled in self._clients:
+                pooled.stop()
+            self._clients.clear()
+            self._idle = queue.Queue()
+            self._started = False
+
+    def drain(self, timeout: float) -> int:
+        """
+        Ожидание подтверждений публикаций всех клиентов пула, но не дольше timeout.
+        Возвращает количество неподтвержденных публикаций.
+        """
+
+        deadline = monotonic() + timeout
+        with self._lock:
+            clients = list(self._clients)
+        for pooled in clients:
+            pooled.wait_delivered(max(0.0, deadline - monotonic()))
+        return sum(pooled.undelivered for pooled in clients)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[mqtt.Client]:
+        """
+        Выдает подключенного клиента из пула.
+        Если за timeout подключенный клиент не найден, возникает MQTTConnectionError.
+        Если блок завершился PublishTimeoutError (см. wait_published), клиент переподключается.
+        """
+
+        with self._checkout(timeout) as pooled:
+            yield pooled.client
+
+    def publish(self, topic: str, payload: Any, qos: int = 1, retain: bool = False,
+                on_delivered: Optional[DeliveryCallback] = None) -> mqtt.MQTTMessageInfo:
+        """
+        Публикация через клиента пула без ожидания подтверждения (см. PooledClient.publish).
+        Клиент занят только на время передачи сообщения в очередь paho.
+        """
+
+        with self._checkout() as pooled:
+            return pooled.publish(topic, payload, qos=qos, retain=retain, on_delivered=on_delivered)
+
+    @contextmanager
+    def _checkout(self, timeout: Optional[float] = None) -> Iterator[PooledClient]:
+        self.start()
+        timeout = self.pool_settings["connect_timeout"] if timeout is None else timeout
+        with POOL_WAIT.time():
+            pooled = self._acquire(timeout)
+        try:
+            yield pooled
+        except PublishTimeoutError:
+            pooled.reset()
+            raise
+        finally:
+            self._idle.put(pooled)
+
+    def _acquire(self, timeout: float) -> PooledClient:
+        deadline = monotonic() + timeout
+
+        try:
+            pooled = self._idle.get(timeout=timeout)
+        except queue.Empty as err:
+            raise MQTTConnectionError("Нет свободных подключений к брокеру") from err
+
+        if pooled.wait_connected(max(0.0, deadline - monotonic())):
+            return pooled
+
+        self._idle.put(pooled)
+        raise MQTTConnectionError(pooled.last_error or "Брокер недоступен")
+
+    def health(self) -> dict:
+        """Состояние подключений пула"""
+
+        return {"size": len(self._clients),
+                "connected": sum(pooled.connected.is_set() for pooled in self._clients),
+                "idle": self._idle.qsize(),
+                "reconnects": sum(max(0, pooled.connect_count - 1) for pooled in self._clients),
+                "disconnects": sum(pooled.disconnect_count for pooled in self._clients),
+                "last_errors": [pooled.last_error for pooled in self._clients if pooled.last_error]}
+
+
+_pools: Dict[tuple, MqttClientPool] = {}
+_pools_lock = threading.Lock()
+
+
+def broker_key(settings: dict) -> tuple:
+    """Ключ брокера: адрес, порт и признак tls"""
+
+    broker = settings.get("broker_settings", {})
+    return broker.get("host"), broker.get("port"), settings.get("broker_use_tls")
+
+
+def get_pool(settings: dict) -> MqttClientPool:
+    """Возвращает общий пул для брокера из settings, создавая его при первом обращении"""
+
+    key = broker_key(settings)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = MqttClientPool(settings)
+    return pool
+
+
+def drain_pools(timeout: float) -> int:
+    """Ожидание подтверждений публикаций всех пулов. Возвращает количество неподтвержденных."""
+
+    with _pools_lock:
+        pools = list(_pools.values())
+
+    deadline = monotonic() + timeout
+    return sum(pool.drain(max(0.0, deadline - monotonic())) for pool in pools)
+
+
+def close_pools(delay: float = 0, keys: Optional[Collection[tuple]] = None):
+    """
+    Закрытие всех пулов подключений.
+    delay - пауза перед закрытием, чтобы завершились уже начатые публикации.
+    keys - закрываются только пулы этих брокеров (см. broker_key).
+    Новые обращения к get_pool сразу получают новый пул.
+    """
+
+    with _pools_lock:
+        if keys is None:
+            pools = list(_pools.values())
+            _pools.clear()
+        else:
+            pools = [_pools.pop(key) for key in keys if key in _pools]
+    if keys is None:
+        clear_client_contexts()
+    close_later(pools, delay)
+
+
+def close_later(closing: List[Any], delay: float = 0):
+    """
+    Вызов close() у объектов closing через delay секунд в фоновом потоке
+    (если delay равен 0 - сразу).
+    """
+
+    def close():
+        for item in closing:
+            item.close()
+
+    if delay and closing:
+        timer = threading.Timer(delay, close)
+        timer.daemon = True
+        timer.start()
+    else:
+        close()
@@ -1,124 +1,313 @@
-"""Этот модуль используется для отправки сообщений в mqtt брокер"""
-from socket import gaierror
-from time import sleep
-import multiprocessing
-from multiprocessing.queues import Queue as mQueue
-from datetime import datetime
+"""
+Этот модуль используется для отправки сообщений в mqtt брокер.
+
+Сообщение публикуется с QoS и признаком retain из сообщения клиента, если они заданы,
+иначе QoS выбирается по первому подходящему правилу publish.topic_qos или равен publish.qos.
+Сообщения топиков compression.topics сжимаются перед публикацией (см. payload.py).
+Брокер для топика выбирается по правилам routing (см. routing.py).
+"""
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from functools import lru_cache
+from time import perf_counter
+from typing import Any, Deque, Dict, List, Optional, Tuple
 import paho.mqtt.client as mqtt
-import paho.mqtt.subscribe as subscribe
 from .event_logger import get_info_logger, get_error_logger  # pylint: disable = import-error
+from .metrics import counter, histogram  # pylint: disable = import-error
+from .payload import (Payload, encode_answer, from_broker,  # pylint: disable = import-error
+                      message_bytes, to_broker)
+from .mqtt_pool import (DeliveryCallback, MQTTConnectionError,  # pylint: disable = import-error
+                        broker_key, get_pool, is_accepted, wait_published)
+from .reply_cache import get_reply_cache  # pylint: disable = import-error
+from .reply_dispatcher import get_dispatcher  # pylint: disable = import-error
+from .routing import route_settings  # pylint: disable = import-error
+from .topic_trie import TopicTrie, is_valid_filter  # pylint: disable = import-error
 
 event_log = get_info_logger("INFO__mqtt_writer__")
 error_log = get_error_logger("ERR__mqtt_writer__")
 TIMEOUT_WAIT_MQTT = 30
+TIMEOUT_ANSWER = "Таймаут получения ответа от брокера"
 
+# Режимы публикации сообщений без ожидания ответа устройства (см. message_listener.publish_message)
+PUBLISH_MODE_SPOOL = "spool"
+PUBLISH_MODE_ASYNC = "async"
+PUBLISH_MODE_SYNC = "sync"
 
-class MQTTConnectionError(Exception):
-    """Исключение для ошибок подключения к mqtt брокеру"""
+PUBLISH_LATENCY = histogram("mqtt_pub_publish_seconds",
+                            "Time to publish one message until the broker confirms it"
+                            " (PUBACK for QoS 1, PUBCOMP for QoS 2, sent for QoS 0)")
+PUBLISH_ERRORS = counter("mqtt_pub_publish_errors_total", "Messages that could not be published")
+REPLY_WAIT = histogram("mqtt_pub_reply_wait_seconds", "Time waiting for a device reply",
+                       buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0))
+REPLY_TIMEOUTS = counter("mqtt_pub_reply_timeouts_total", "Device replies not received in time")
+ASYNC_DELIVERIES = counter("mqtt_pub_async_deliveries_total",
+                           "Messages published without waiting, by broker confirmation", ["result"])
 
 
-class MqttConnection:
-    """Context manager for connect to mqtt broker"""
+@lru_cache(maxsize=8)
+def _topic_qos_trie(rules: Tuple[Tuple[str, int], ...]) -> "TopicTrie[Tuple[int, int]]":
+    trie: "TopicTrie[Tuple[int, int]]" = TopicTrie()
+    for index, (topic_filter, qos) in enumerate(rules):
+        if is_valid_filter(topic_filter):
+            trie.insert(topic_filter, (index, qos))
+    return trie
 
-    def __init__(self, settings):
-        self.settings = settings
-        self._client = mqtt.Client()
 
-    def __enter__(self):
-        try:
-            self._client.tls_set(**self.settings.get("tls"))
-            self._client.connect(**self.settings.get("broker_settings"))
-        except gaierror as err:
-            raise MQTTConnectionError from err
-        except OSError as err:
-            raise MQTTConnectionError from err
-        except TypeError as err:
-            raise MQTTConnectionError from err
+def publish_options(settings: dict, topic: str, qos: Optional[int] = None,
+                    retain: Optional[bool] = None) -> Tuple[int, bool]:
+    """
+    QoS и retain публикации в топик topic.
+    qos и retain - значения из сообщения клиента (None - не заданы).
+    """
+
+    publish = settings.get("publish", {})
+    if qos is None:
+        rules = publish.get("topic_qos")
+        matched = _topic_qos_trie(tuple(map(tuple, rules))).match(topic) if rules else None
+        qos = min(matched)[1] if matched else publish.get("qos", 1)
+    if retain is None:
+        retain = publish.get("retain", False)
+    return qos, retain  # type: ignore
+
+
+def publish_async(report: tuple, settings: dict,
+                  on_delivered: Optional[DeliveryCallback] = None) -> bool:
+    """
+    Публикация без ожидания подтверждения брокера.
+    Возвращается True, если сообщение передано подключению к брокеру.
 
-        self._client.loop_start()
-        return self._client
+    report: tuple (topic: str, message: str[, qos: int, retain: bool])
+    on_delivered(delivered: bool) вызывается после подтверждения брокера (см. PooledClient.publish).
+    Без on_delivered результат подтверждения учитывается только в метриках.
+    """
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        self._client.disconnect()
+    topic, message, *options = report
+    settings = route_settings(settings, topic)
+    qos, retain = publish_options(settings, topic, *options)
+
+    def delivered(result: bool):
+        ASYNC_DELIVERIES.inc(result="ok" if result else "error")
+        if not result:
+            PUBLISH_ERRORS.inc()
+            event_log.error("Брокер не подтвердил сообщение для %s", topic)
+        if on_delivered is not None:
+            on_delivered(result)
+
+    try:
+        info = get_pool(settings).publish(topic, to_broker(settings, topic, message),
+                                          qos=qos, retain=retain, on_delivered=delivered)
+    except MQTTConnectionError as err:
+        PUBLISH_ERRORS.inc()
+        event_log.error("Ошибка подключения mqtt."
+                        " Невозможно опубликовать сообщение по причине: %s", str(err))
+        return False
+    except (ValueError, TypeError) as err:
+        PUBLISH_ERRORS.inc()
+        event_log.error("Сообщение не опубликовано %s: %s", topic, str(err))
+        return False
+
+    return is_accepted(info, qos)
 
 
 def publish_to_mqtt(report: tuple, settings: dict) -> bool:
     """
     Публикуется сообщение в mqtt брокер. Возвращается результат отправки.
 
-    Ответ: tuple (topic: str, message: str)
+    Ответ: tuple (topic: str, message: str[, qos: int, retain: bool])
 
-    settings: dict (broker_settings: dict, tls: dict)
+    settings: dict (broker_settings: dict, tls: dict, pool: dict, publish: dict)
     broker_settings: dict (broker_host: str, broker_port: int, broker_keep_alive: int)
     tls: dict (ca_certs: str, certfile: str, keyfile: str)
+
+    Подключение берется из общего пула брокера топика (get_pool, route_settings).
+    Возврат после подтверждения брокера (для QoS 0 - после отправки).
     """
 
+    topic, message, *options = report
+    settings = route_settings(settings, topic)
+    qos, retain = publish_options(settings, topic, *options)
+
+    pool = get_pool(settings)
     try:
-        with MqttConnection(settings) as client:
-            topic, message = report
-            info = client.publish(topic, message, qos=1)
-            info.wait_for_publish()  # Сообщение гарантировано отправлено
+        with PUBLISH_LATENCY.time(), pool.connection() as client:
+            info = client.publish(topic, to_broker(settings, topic, message),
+                                  qos=qos, retain=retain)
+            # Сообщение гарантировано отправлено
+            wait_published(info, pool.pool_settings["connect_timeout"])
 
-            event_log.info("Сообщение %s было опубликовано %s", message, topic)
+            event_log.info("Сообщение %s было опубликовано %s",
+                           message if isinstance(message, str) else f"({len(message)} байт)", topic)
 
     except MQTTConnectionError as err:
+        PUBLISH_ERRORS.inc()
         event_log.error("Ошибка подключения mqtt."
                         " Невозможно опубликовать сообщение по причине: %s", str(err))
         return False
+    except (ValueError, RuntimeError, TypeError) as err:
+        # Очередь клиента переполнена (max_queued) или подключение потеряно до отправки
+        PUBLISH_ERRORS.inc()
+        event_log.error("Сообщение не опубликовано %s: %s", topic, str(err))
+        return False
 
     return info.is_published()
 
 
-def read_from_mqtt(settings: dict, message: str,
-                   topic_for_write: str, topic_for_read: str) -> str:
+def publish_batch(reports: List[tuple], settings: dict) -> List[bool]:
     """
-    Получим ответ из mqtt с помощью функции get_answer_from_mqtt.
-    Функция является блокирующей, поэтому предусмотрим возможность отказаться от ожидания ответа.
-    Для этого создаем процесс, и контролируем время его работы. Если оно превышает TIME_LIMIT, то
-    останавливаем процесс.
+    Публикация пакета сообщений через одно подключение из пула каждого брокера
+    (сообщения распределяются по брокерам топиков, см. routing.py).
+    Одновременно ожидают подтверждения не более batch_window сообщений одного брокера.
 
-    Возвращаемое значение: строка с полученным ответом или сообщением о таймауте.
+    reports: list of tuple (topic: str, message: str[, qos: int, retain: bool])
+
+    Возвращаемое значение: результат отправки каждого сообщения в порядке reports.
     """
 
-    ctx = multiprocessing.get_context("spawn")
-    result_queue = ctx.Queue()
-    proc = ctx.Process(target=get_answer_from_mqtt,
-                       args=(result_queue,
-                             topic_for_read,
-                             settings.get("broker_settings"),
-                             settings.get("tls")))
-    proc.start()
-    sleep(1)  # делаем паузу перед отправкой сообщения
+    results = [False] * len(reports)
+    brokers: Dict[tuple, Tuple[dict, List[int]]] = {}
+    for index, (topic, *_) in enumerate(reports):
+        routed = route_settings(settings, topic)
+        brokers.setdefault(broker_key(routed), (routed, []))[1].append(index)
 
-    publish_to_mqtt((topic_for_write, message), settings)
+    for routed, indexes in brokers.values():
+        _publish_broker_batch(reports, indexes, routed, results)
 
-    start = datetime.now()
-    while (datetime.now() - start).seconds < TIMEOUT_WAIT_MQTT:
-        if not proc.is_alive():
-            answer = result_queue.get()
-            break
+    event_log.info("Опубликовано сообщений из пакета: %s из %s", sum(results), len(results))
+    return results
 
-    else:
-        answer = "Таймаут получения ответа от брокера"
-        proc.terminate()
 
-    return answer
+def _publish_broker_batch(reports: List[tuple], indexes: List[int], settings: dict,
+                          results: List[bool]):
+    """Публикация сообщений reports[indexes] в один брокер, результаты записываются в results"""
+
+    window = max(1, settings.get("batch_window", 1))
+    in_flight: Deque[Tuple[int, mqtt.MQTTMessageInfo]] = deque()
+    pool = get_pool(settings)
 
+    def wait_oldest():
+        index, info = in_flight.popleft()
+        try:
+            wait_published(info, pool.pool_settings["connect_timeout"])
+        except (ValueError, RuntimeError) as err:
+            PUBLISH_ERRORS.inc()
+            event_log.error("Сообщение не опубликовано %s: %s", reports[index][0], str(err))
+            return
+        results[index] = info.is_published()
+
+    try:
+        with pool.connection() as client:
+            for index in indexes:
+                topic, message, *options = reports[index]
+                if len(in_flight) >= window:
+                    wait_oldest()
 
-def get_answer_from_mqtt(reply_queue: mQueue,
-                         topic: str,
-                         broker_settings: dict,
-                         tls: dict) -> None:
+                qos, retain = publish_options(settings, topic, *options)
+                try:
+                    in_flight.append((index, client.publish(topic,
+                                                            to_broker(settings, topic, message),
+                                                            qos=qos, retain=retain)))
+                except (ValueError, TypeError) as err:
+                    PUBLISH_ERRORS.inc()
+                    event_log.error("Сообщение не опубликовано %s: %s", topic, str(err))
+
+            while in_flight:
+                wait_oldest()
+
+    except MQTTConnectionError as err:
+        PUBLISH_ERRORS.inc(sum(not results[index] for index in indexes))
+        event_log.error("Ошибка подключения mqtt."
+                        " Невозможно опубликовать пакет по причине: %s", str(err))
+
+
+def read_from_mqtt(settings: dict, message: Any,  # pylint: disable = too-many-arguments
+                   topic_for_write: str, topic_for_read: str, qos: Optional[int] = None,
+                   encoding: Optional[str] = None, compression: Optional[str] = None
+                   ) -> "Future[Payload]":
+    """
+    Публикует сообщение и начинает ожидание ответа устройства в топике topic_for_read.
+
+    Одинаковые одновременные запросы (тот же топик и сообщение) выполняются один раз,
+    ответ получают все клиенты. Если задан reply_cache.ttl, недавний ответ возвращается
+    без обращения к брокеру.
+    qos - QoS запроса из сообщения клиента (None - из настроек).
+    encoding, compression - кодировка и сжатие ответа, запрошенные клиентом (см. payload.py).
+
+    Запрос и ответ передаются через брокер топика topic_for_write (см. routing.py).
+
+    Возвращаемое значение: Future с ответом устройства (bytes для кодировки binary)
+    или сообщением о таймауте. Вызывающий ограничивает ожидание (TIMEOUT_WAIT_MQTT)
+    и отменяет Future, если ответ не получен.
+    """
+
+    settings = route_settings(settings, topic_for_write)
+    # Данные сообщения в ключе: память кадра и значения JSON (объект, список) не хэшируются
+    key = (broker_key(settings), topic_for_write, topic_for_read, message_bytes(message),
+           qos, encoding, compression)
+    return get_reply_cache(settings.get("reply_cache", {})).request(
+        key,
+        lambda: request_reply(settings, message, topic_for_write, topic_for_read, qos,
+                              encoding, compression),
+        cacheable=lambda answer: answer != TIMEOUT_ANSWER,
+        fallback=TIMEOUT_ANSWER)
+
+
+def request_reply(settings: dict, message: Any,  # pylint: disable = too-many-arguments
+                  topic_for_write: str, topic_for_read: str, qos: Optional[int] = None,
+                  encoding: Optional[str] = None, compression: Optional[str] = None
+                  ) -> "Future[Payload]":
     """
-    Функция subscribe.simple() получает ответ из mqtt, который помещается в очередь.
+    Публикует сообщение и начинает ожидание ответа устройства в топике topic_for_read.
+    Ожидание регистрируется в общем подписчике до публикации, поэтому ответ не будет пропущен.
+    Подтверждение брокера не ожидается: ответ устройства подтверждает доставку,
+    а если брокер не примет сообщение, ожидание ответа завершается сообщением о таймауте.
+    Поток не блокируется до ответа: если возвращенный Future отменен (таймаут),
+    ожидание удаляется из подписчика.
+
+    Возвращаемое значение: Future с ответом устройства в кодировке encoding
+    или сообщением о таймауте.
     """
 
-    answer = subscribe.simple(topic,
-                              hostname=broker_settings["host"],
-                              port=broker_settings["port"],
-                              retained=False,
-                              msg_count=1,
-                              tls=tls)
+    answer: "Future[Payload]" = Future()
+    dispatcher = get_dispatcher(settings)
+
+    try:
+        reply = dispatcher.expect(topic_for_read)
+    except MQTTConnectionError as err:
+        event_log.error("Ошибка подключения mqtt."
+                        " Невозможно получить ответ по причине: %s", str(err))
+        answer.set_result(TIMEOUT_ANSWER)
+        return answer
+
+    started = perf_counter()
 
-    event_log.info("Получено сообщение из топика %s", str(topic))
-    reply_queue.put(answer.payload.decode())  # pylint: disable = no-member
+    def delivered(result: bool):
+        if not result:
+            reply.cancel()
+
+    def replied(done: Future):
+        REPLY_WAIT.observe(perf_counter() - started)
+        if done.cancelled():
+            # Брокер не принял сообщение или ответ больше не ожидается
+            REPLY_TIMEOUTS.inc()
+            dispatcher.discard(topic_for_read, done)
+            result: Payload = TIMEOUT_ANSWER
+        else:
+            result = encode_answer(from_broker(settings, topic_for_read, done.result()),
+                                   encoding, compression)
+        try:
+            answer.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def abandoned(done: Future):
+        if done.cancelled():
+            reply.cancel()
+
+    if not publish_async((topic_for_write, message, qos), settings, on_delivered=delivered):
+        dispatcher.discard(topic_for_read, reply)
+        answer.set_result(TIMEOUT_ANSWER)
+        return answer
+
+    answer.add_done_callback(abandoned)
+    reply.add_done_callback(replied)
+    return answer
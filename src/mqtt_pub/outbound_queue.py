@@ -0,0 +1,324 @@
+"""
+Очередь исходящих сообщений на диске (store-and-forward).
+
+Сообщения сохраняются в sqlite базу и сразу подтверждаются клиенту.
+Фоновый поток отправляет их в брокер пакетами и удаляет доставленные.
+Если брокер недоступен, сообщения ожидают в очереди и переживают перезапуск сервиса.
+Очередь на диске отправляет один процесс: поток отправки держит блокировку flock файла
+<path>.lock (при плавном перезапуске старый и новый процессы открывают одну очередь).
+"""
+import fcntl
+import os
+import sqlite3
+import threading
+from time import monotonic, sleep
+from typing import IO, Any, Dict, List, Optional
+from .event_logger import get_info_logger, get_error_logger  # pylint: disable = import-error
+from .metrics import gauge  # pylint: disable = import-error
+from .mqtt_writer import publish_batch  # pylint: disable = import-error
+from .payload import message_bytes  # pylint: disable = import-error
+
+event_log = get_info_logger("INFO__outbound_queue__")
+error_log = get_error_logger("ERR__outbound_queue__")
+
+OVERFLOW_REJECT = "reject"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+RATE_SMOOTHING = 0.3
+FLUSH_POLL_INTERVAL = 0.05
+
+SPOOL_DEPTH = gauge("mqtt_pub_spool_depth", "Messages waiting in the outbound queue")
+SPOOL_BYTES = gauge("mqtt_pub_spool_bytes", "Payload bytes waiting in the outbound queue")
+SPOOL_DRAIN_RATE = gauge("mqtt_pub_spool_drain_rate", "Messages delivered per second (smoothed)")
+SPOOL_MESSAGES = gauge("mqtt_pub_spool_messages", "Outbound queue message counts", ["state"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    qos INTEGER,
+    retain INTEGER
+)
+"""
+# Столбцы, добавленные после создания первых очередей
+MIGRATIONS = (("qos", "ALTER TABLE messages ADD COLUMN qos INTEGER"),
+              ("retain", "ALTER TABLE messages ADD COLUMN retain INTEGER"))
+
+
+class OutboundQueue:  # pylint: disable = too-many-instance-attributes
+    """
+    Очередь с ограничением по количеству сообщений и занимаемому месту.
+
+    При переполнении действует overflow_policy:
+    reject - новое сообщение не принимается;
+    drop_oldest - удаляются самые старые сообщения.
+    """
+
+    def __init__(self, settings: dict):
+        spool = settings["spool"]
+        self.settings = settings
+        self.path = spool["path"]
+        self.max_messages = spool["max_messages"]
+        self.max_bytes = spool["max_bytes"]
+        self.overflow_policy = spool["overflow_policy"]
+        self.batch_size = spool["batch_size"]
+        self.retry_delay = spool["retry_delay"]
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(messages)")}
+        for column, statement in MIGRATIONS:
+            if column not in columns:
+                self._db.execute(statement)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._drainer: Optional[threading.Thread] = None
+        self._draining = False
+        self._closed = False
+        # Последняя отправка не удалась, следующая попытка через retry_delay
+        self.retrying = False
+
+        self.depth, self.size = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM messages").fetchone()
+        self.enqueued = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.drain_rate = 0.0
+
+    def start(self):
+        """Запуск фоновой отправки сообщений"""
+
+        if self._drainer is None:
+            self._draining = True
+            self._drainer = threading.Thread(target=self._drain_forever,
+                                             name="outbound-drainer", daemon=True)
+            self._drainer.start()
+            if self.depth:
+                event_log.info("В очереди ожидают отправки сообщений: %s", self.depth)
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Остановка фоновой отправки. Недоставленные сообщения остаются на диске.
+        Если отправка пакета не завершилась за timeout, база закрывается фоновым потоком
+        после удаления доставленных сообщений пакета (иначе они были бы отправлены повторно).
+        """
+
+        self._stopped.set()
+        self._wakeup.set()
+        if self._drainer is not None:
+            self._drainer.join(timeout)
+        with self._lock:
+            self._closed = True
+            if not self._draining:
+                self._db.close()
+
+    def flush(self, timeout: float) -> bool:
+        """
+        Ожидание отправки сообщений очереди, но не дольше timeout.
+        Ожидание прекращается, если брокер недоступен. True, если очередь пуста.
+        """
+
+        deadline = monotonic() + timeout
+        self._wakeup.set()
+        while (self.depth and not self.retrying and monotonic() < deadline
+               and self._drainer is not None and self._drainer.is_alive()):
+            sleep(FLUSH_POLL_INTERVAL)
+        return not self.depth
+
+    def put(self, topic: str, message: Any, qos: Optional[int] = None,
+            retain: Optional[bool] = None) -> bool:
+        """
+        Сохранение сообщения в очередь.
+        message - значение поля message (см. payload.message_bytes).
+        qos и retain - параметры из сообщения клиента (None - из настроек при отправке).
+        Возвращает False, если сообщение не принято из-за переполнения.
+        """
+
+        payload = message_bytes(message)
+
+        with self._lock:
+            if not self._make_room(len(payload)):
+                self.rejected += 1
+                return False
+
+            self._db.execute("INSERT INTO messages (topic, payload, size, qos, retain)"
+                             " VALUES (?, ?, ?, ?, ?)",
+                             (topic, payload, len(payload), qos, retain))
+            self.depth += 1
+            self.size += len(payload)
+            self.enqueued += 1
+
+        self._wakeup.set()
+        return True
+
+    def stats(self) -> Dict[str, float]:
+        """Метрики очереди"""
+
+        return {"depth": self.depth,
+                "bytes": self.size,
+                "enqueued": self.enqueued,
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "rejected": self.rejected,
+                "drain_rate": round(self.drain_rate, 2)}
+
+    def _make_room(self, size: int) -> bool:
+        if self.depth < self.max_messages and self.size + size <= self.max_bytes:
+            return True
+
+        if self.overflow_policy != OVERFLOW_DROP_OLDEST or size > self.max_bytes:
+            return False
+
+        while self.depth and (self.depth >= self.max_messages
+                              or self.size + size > self.max_bytes):
+            oldest = self._db.execute(
+                "SELECT id, size FROM messages ORDER BY id LIMIT ?", (self.batch_size,)).fetchall()
+            for message_id, message_size in oldest:
+                self._db.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+                self.depth -= 1
+                self.size -= message_size
+                self.dropped += 1
+                if self.depth < self.max_messages and self.size + size <= self.max_bytes:
+                    break
+
+        return True
+
+    def _fetch(self) -> List[tuple]:
+        with self._lock:
+            return self._db.execute("SELECT id, topic, payload, size, qos, retain FROM messages"
+                                    " ORDER BY id LIMIT ?", (self.batch_size,)).fetchall()
+
+    def _remove(self, rows: List[tuple]):
+        with self._lock:
+            self._db.executemany("DELETE FROM messages WHERE id = ?",
+                                 [(row[0],) for row in rows])
+            # Строки могли быть удалены политикой drop_oldest во время отправки
+            self.depth, self.size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM messages").fetchone()
+            self.delivered += len(rows)
+
+    def _drain_forever(self):
+        lock_file = open(self.path + ".lock", "a")  # pylint: disable = consider-using-with
+        try:
+            if self._lock_spool(lock_file):
+                self._drain()
+        finally:
+            lock_file.close()
+            with self._lock:
+                self._draining = False
+                if self._closed:
+                    self._db.close()
+
+    def _lock_spool(self, lock_file: IO) -> bool:
+        """
+        Ожидание блокировки очереди, пока ее отправляет другой процесс.
+        Возвращает False, если очередь остановлена раньше.
+        """
+
+        while not self._stopped.is_set():
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if not self.retrying:
+                    event_log.info("Очередь %s отправляет другой процесс, ожидание", self.path)
+                # flush не ожидает отправки, которую выполняет другой процесс
+                self.retrying = True
+                self._stopped.wait(self.retry_delay)
+                continue
+
+            self.retrying = False
+            # Другой процесс мог отправить или добавить сообщения
+            with self._lock:
+                self.depth, self.size = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM messages").fetchone()
+            return True
+        return False
+
+    def _drain(self):
+        while not self._stopped.is_set():
+            try:
+                self._drain_batch()
+            except Exception as err:  # pylint: disable = broad-except
+                # Неожиданная ошибка не должна останавливать отправку очереди
+                error_log.error("Ошибка отправки очереди %s: %s. Повтор через %s сек",
+                                self.path, str(err), self.retry_delay)
+                self._retry_later()
+
+    def _drain_batch(self):
+        """Отправка очередной пачки сообщений; если очередь пуста - ожидание новых сообщений"""
+
+        rows = self._fetch()
+        if not rows:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            return
+
+        started = monotonic()
+        results = publish_batch([(topic, payload, qos, None if retain is None else bool(retain))
+                                 for _, topic, payload, _, qos, retain in rows],
+                                self.settings)
+        delivered = [row for row, published in zip(rows, results) if published]
+        if delivered:
+            self._remove(delivered)
+
+        rate = len(delivered) / max(monotonic() - started, 1e-6)
+        self.drain_rate += RATE_SMOOTHING * (rate - self.drain_rate)
+
+        if len(delivered) < len(rows):
+            error_log.error("Брокер недоступен, в очереди %s сообщений."
+                            " Повтор через %s сек", self.depth, self.retry_delay)
+            self._retry_later()
+
+    def _retry_later(self):
+        self.retrying = True
+        self._stopped.wait(self.retry_delay)
+        self.retrying = False
+
+
+_queues: Dict[str, OutboundQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_outbound_queue(settings: dict) -> OutboundQueue:
+    """Возвращает общую очередь исходящих сообщений, запуская ее отправку при первом обращении"""
+
+    path = settings["spool"]["path"]
+    with _queues_lock:
+        outbound = _queues.get(path)
+        if outbound is None:
+            outbound = _queues[path] = OutboundQueue(settings)
+            outbound.start()
+            _export_metrics(outbound)
+    return outbound
+
+
+def _export_metrics(outbound: OutboundQueue):
+    SPOOL_DEPTH.set_function(lambda: outbound.depth)
+    SPOOL_BYTES.set_function(lambda: outbound.size)
+    SPOOL_DRAIN_RATE.set_function(lambda: outbound.drain_rate)
+    for state in ("enqueued", "delivered", "dropped", "rejected"):
+        SPOOL_MESSAGES.set_function(lambda state=state: getattr(outbound, state), state=state)
+
+
+def close_outbound_queues(timeout: Optional[float] = None, flush_timeout: float = 0):
+    """
+    Остановка всех очередей.
+    flush_timeout - время на отправку накопленных сообщений перед остановкой,
+    неотправленные сообщения остаются на диске до следующего запуска.
+    """
+
+    with _queues_lock:
+        queues = list(_queues.values())
+        _queues.clear()
+
+    deadline = monotonic() + flush_timeout
+    for outbound in queues:
+        if flush_timeout and not outbound.flush(max(0.0, deadline - monotonic())):
+            event_log.info("При остановке в очереди осталось сообщений: %s", outbound.depth)
+        outbound.close(timeout)
@@ -0,0 +1,248 @@
+"""
+Кодирование и сжатие сообщений.
+
+Клиент сокета указывает в сообщении необязательные поля:
+encoding - text (по умолчанию, поле message - строка или значение JSON), base64 (поле message -
+двоичные данные в base64) или binary (только в режиме length: данные передаются в том же кадре
+после JSON и байта 0x00, без поля message);
+compression - zlib или zstd (с encoding base64 или binary): данные сжаты клиентом.
+Ответ устройства и сообщения подписки возвращаются клиенту в той же кодировке и с тем же сжатием.
+Доступные сервису варианты возвращает действие /codecs.
+
+Сжатие сообщений для брокера (settings["compression"]) выполняется для топиков
+compression.topics, если размер сообщения не меньше compression.min_size. Сообщения из этих
+топиков распаковываются при получении; данные, которые не удается распаковать, передаются как есть.
+
+zstd доступен, если установлена библиотека zstandard.
+"""
+import binascii
+import threading
+import zlib
+from functools import lru_cache
+from typing import Any, Optional, Tuple, Union
+from .metrics import counter  # pylint: disable = import-error
+from .protocol import dumps_bytes  # pylint: disable = import-error
+from .topic_trie import TopicTrie, is_valid_filter  # pylint: disable = import-error
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+ENCODING_TEXT = "text"
+ENCODING_BASE64 = "base64"
+ENCODING_BINARY = "binary"
+ENCODINGS = (ENCODING_TEXT, ENCODING_BASE64, ENCODING_BINARY)
+
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_ZSTD = "zstd"
+COMPRESSIONS: Tuple[str, ...] = ((COMPRESSION_ZLIB, COMPRESSION_ZSTD) if zstandard is not None
+                                 else (COMPRESSION_ZLIB,))
+
+# Разделитель JSON и двоичных данных в кадре: в тексте JSON байт 0x00 не встречается
+BINARY_SEPARATOR = b"\x00"
+DEFAULT_MAX_SIZE = 1024 * 1024
+
+BROKER_PAYLOAD_BYTES = counter("mqtt_pub_broker_payload_bytes_total",
+                               "Compressed broker payloads: bytes before and after compression",
+                               ["stage"])
+
+Payload = Union[str, bytes]
+
+
+class PayloadError(ValueError):
+    """Данные не удается декодировать или распаковать"""
+
+
+def compress(data: Union[bytes, memoryview], method: str, level: Optional[int] = None) -> bytes:
+    """Сжатие данных методом method (zlib или zstd). level - None: уровень по умолчанию."""
+
+    if method == COMPRESSION_ZLIB:
+        return zlib.compress(data, -1 if level is None else level)
+    if method == COMPRESSION_ZSTD and zstandard is not None:
+        return _zstd_compressor(3 if level is None else level).compress(data)
+    raise PayloadError(f"Сжатие {method} не поддерживается")
+
+
+def decompress(data: Union[bytes, memoryview], method: str,
+               max_size: int = DEFAULT_MAX_SIZE) -> bytes:
+    """Распаковка данных. Распакованные данные больше max_size байт не принимаются."""
+
+    if method == COMPRESSION_ZLIB:
+        decompressor = zlib.decompressobj()
+        try:
+            result = decompressor.decompress(data, max_size)
+        except zlib.error as err:
+            raise PayloadError(f"Не удалось распаковать данные zlib: {err}") from err
+        if decompressor.unconsumed_tail:
+            raise PayloadError("Размер распакованного сообщения превышает допустимый")
+        if not decompressor.eof:
+            raise PayloadError("Данные zlib неполные")
+        return result
+
+    if method == COMPRESSION_ZSTD and zstandard is not None:
+        try:
+            return _zstd().decompressor.decompress(data, max_output_size=max_size)
+        except zstandard.ZstdError as err:
+            raise PayloadError(f"Не удалось распаковать данные zstd: {err}") from err
+
+    raise PayloadError(f"Сжатие {method} не поддерживается")
+
+
+# Объекты zstandard не потокобезопасны: у каждого потока свои
+_zstd_local = threading.local()
+
+
+def _zstd():
+    if not hasattr(_zstd_local, "decompressor"):
+        _zstd_local.compressors = {}
+        _zstd_local.decompressor = zstandard.ZstdDecompressor()
+    return _zstd_local
+
+
+def _zstd_compressor(level: int):
+    compressors = _zstd().compressors
+    compressor = compressors.get(level)
+    if compressor is None:
+        compressor = compressors[level] = zstandard.ZstdCompressor(level=level)
+    return compressor
+
+
+def message_bytes(message: Any) -> bytes:
+    """
+    Данные сообщения для брокера: строка - в UTF-8, двоичные данные - без изменений,
+    None - пустое сообщение, остальные значения JSON (число, список, объект) - текстом JSON.
+    """
+
+    if isinstance(message, str):
+        return message.encode()
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return bytes(message)
+    if message is None:
+        return b""
+    return dumps_bytes(message)
+
+
+def check_codec(encoding: Optional[str], compression: Optional[str]) -> Optional[str]:
+    """Проверка полей encoding и compression сообщения. Возвращает сообщение об ошибке или None."""
+
+    if encoding is not None and encoding not in ENCODINGS:
+        return f"Неизвестная кодировка: {encoding}"
+    if compression is None:
+        return None
+    if encoding in (None, ENCODING_TEXT):
+        return "Сжатое сообщение передается в кодировке base64 или binary"
+    if compression not in COMPRESSIONS:
+        return f"Сжатие {compression} не поддерживается"
+    return None
+
+
+def decode_message(message: Any, encoding: Optional[str], compression: Optional[str],
+                   max_size: int = DEFAULT_MAX_SIZE) -> Any:
+    """
+    Данные сообщения клиента для публикации.
+    В кодировке text сообщение возвращается без изменений, иначе - bytes.
+    message в кодировке binary - memoryview части кадра (без копирования до распаковки).
+    """
+
+    if encoding in (None, ENCODING_TEXT):
+        return message
+
+    if encoding == ENCODING_BASE64:
+        if not isinstance(message, str):
+            raise PayloadError("Поле message в кодировке base64 должно быть строкой")
+        try:
+            data: Union[bytes, memoryview] = binascii.a2b_base64(message)
+        except (binascii.Error, ValueError) as err:
+            raise PayloadError(f"Некорректные данные base64: {err}") from err
+    else:
+        data = message
+
+    if compression is not None:
+        return decompress(data, compression, max_size)
+    if len(data) > max_size:
+        raise PayloadError("Размер сообщения превышает допустимый")
+    return bytes(data)
+
+
+def encode_answer(payload: bytes, encoding: Optional[str], compression: Optional[str]) -> Payload:
+    """
+    Данные для клиента в запрошенной им кодировке:
+    text - строка (некорректные символы UTF-8 заменяются), base64 - строка, binary - bytes.
+    """
+
+    if encoding in (None, ENCODING_TEXT):
+        return payload.decode("utf-8", errors="replace")
+
+    if compression is not None:
+        payload = compress(payload, compression)
+    if encoding == ENCODING_BINARY:
+        return payload
+    return binascii.b2a_base64(payload, newline=False).decode("ascii")
+
+
+def split_binary_frame(frame: bytes) -> Tuple[bytes, Optional[memoryview]]:
+    """
+    Разделение кадра на JSON и двоичные данные (см. BINARY_SEPARATOR).
+    Данные возвращаются как memoryview кадра без копирования; None - кадр без данных.
+    """
+
+    separator = frame.find(BINARY_SEPARATOR)
+    if separator < 0:
+        return frame, None
+    view = memoryview(frame)
+    return frame[:separator], view[separator + 1:]
+
+
+@lru_cache(maxsize=8)
+def _compressed_topics(topic_filters: Tuple[str, ...]) -> "TopicTrie[bool]":
+    trie: "TopicTrie[bool]" = TopicTrie()
+    for topic_filter in topic_filters:
+        if is_valid_filter(topic_filter):
+            trie.insert(topic_filter, True)
+    return trie
+
+
+def _compression_for(settings: dict, topic: str) -> Optional[dict]:
+    compression = settings.get("compression") or {}
+    if not compression.get("method"):
+        return None
+    topics = compression.get("topics")
+    if topics and not _compressed_topics(tuple(topics)).match(topic):
+        return None
+    return compression
+
+
+def to_broker(settings: dict, topic: str, message: Any) -> Any:
+    """
+    Сообщение для публикации в топик topic: сжатое, если топик входит в compression.topics.
+    Значения, отличные от строки и bytes, преобразуются message_bytes.
+    """
+
+    compression = _compression_for(settings, topic)
+    if compression is None and isinstance(message, (str, bytes, bytearray)):
+        return message
+
+    data = message_bytes(message)
+    if compression is None or len(data) < compression.get("min_size", 0):
+        return message if isinstance(message, (str, bytes, bytearray)) else data
+
+    compressed = compress(data, compression["method"], compression.get("level"))
+    BROKER_PAYLOAD_BYTES.inc(len(data), stage="raw")
+    BROKER_PAYLOAD_BYTES.inc(len(compressed), stage="compressed")
+    return compressed
+
+
+def from_broker(settings: dict, topic: str, payload: bytes) -> bytes:
+    """Сообщение из топика topic: распакованное, если топик входит в compression.topics"""
+
+    compression = _compression_for(settings, topic)
+    if compression is None:
+        return payload
+
+    try:
+        return decompress(payload, compression["method"],
+                          compression.get("max_size", DEFAULT_MAX_SIZE))
+    except PayloadError:
+        # Сообщение меньше min_size или от устройства без сжатия
+        return payload
@@ -0,0 +1,204 @@
+"""
+Разбор и проверка входящих сообщений.
+
+JSON разбирается библиотекой orjson или ujson, если она установлена, иначе модулем json.
+Проверка сообщения выполняется за один проход и возвращает объект Request
+вместо словаря, чтобы обработчики не проверяли поля повторно.
+"""
+from typing import AbstractSet, Any, Callable, Dict, List, Optional, Tuple, Union
+
+try:
+    import orjson  # type: ignore
+
+    JSON_BACKEND = "orjson"
+    loads: Callable[[Union[str, bytes]], Any] = orjson.loads
+
+    def dumps_bytes(value: Any) -> bytes:
+        """JSON в кодировке utf-8"""
+        return orjson.dumps(value)
+
+except ImportError:
+    try:
+        import ujson as _json  # type: ignore
+
+        JSON_BACKEND = "ujson"
+    except ImportError:
+        import json as _json  # type: ignore
+
+        JSON_BACKEND = "json"
+
+    loads = _json.loads
+
+    def dumps_bytes(value: Any) -> bytes:
+        """JSON в кодировке utf-8"""
+        return _json.dumps(value, ensure_ascii=False).encode()
+
+
+def dumps(value: Any) -> str:
+    """JSON строка (символы не экранируются)"""
+    return dumps_bytes(value).decode()
+
+
+# Ошибки разбора всех библиотек (и UnicodeDecodeError) наследуют ValueError
+DecodeError = ValueError
+
+KIND_ACTION = "action"
+KIND_PUBLISH = "publish"
+KIND_BATCH = "batch"
+KIND_STREAM = "stream"
+
+MAX_BATCH_SIZE = 1000
+
+# Служебные действия и их обязательные поля
+ACTION_FIELDS: Dict[str, Tuple[str, ...]] = {"/get_salt": ("user",),
+                                             "/check_auth": ("user", "password"),
+                                             "/login": ("user", "password"),
+                                             "/logout": ("token",),
+                                             "/codecs": ()}
+
+# Подписка постоянного подключения на сообщения брокера: поле topic содержит фильтр
+STREAM_ACTIONS = frozenset(("/subscribe", "/unsubscribe"))
+
+# Допустимые наборы полей сообщения: (поля, вид сообщения)
+SHAPES: Tuple[Tuple[frozenset, str], ...] = (
+    (frozenset(("message", "password", "topic", "user")), KIND_PUBLISH),
+    (frozenset(("message", "token", "topic")), KIND_PUBLISH),
+    (frozenset(("batch", "password", "user")), KIND_BATCH),
+    (frozenset(("batch", "token")), KIND_BATCH),
+)
+BATCH_ITEM_FIELDS = frozenset(("message", "topic"))
+
+# Необязательные поля публикации и пакета (для пакета - значения по умолчанию для сообщений)
+PUBLISH_OPTIONS = frozenset(("qos", "retain"))
+QOS_LEVELS = (0, 1, 2)
+# Кодировка и сжатие сообщения (см. payload.py), для пакета - всех его сообщений
+CODEC_OPTIONS = frozenset(("encoding", "compression"))
+OPTIONS = PUBLISH_OPTIONS | CODEC_OPTIONS
+
+# Сообщение пакета: topic, message, qos, retain (None - значение из настроек)
+BatchItem = Tuple[str, Any, Optional[int], Optional[bool]]
+
+
+class Request:  # pylint: disable = too-few-public-methods
+    """
+    Проверенное сообщение клиента.
+
+    kind - вид сообщения: KIND_ACTION, KIND_PUBLISH, KIND_BATCH или KIND_STREAM.
+    action - служебное действие (для KIND_ACTION и KIND_STREAM).
+    Авторизация: user и password, либо token.
+    qos, retain - параметры публикации из сообщения или None.
+    encoding, compression - кодировка и сжатие поля message или None.
+    batch - список BatchItem для KIND_BATCH.
+    """
+
+    __slots__ = ("kind", "action", "user", "password", "token", "topic", "message", "batch",
+                 "qos", "retain", "encoding", "compression")
+
+    def __init__(self, kind: str, data: dict, batch: Optional[List[BatchItem]] = None):
+        self.kind = kind
+        self.action: Optional[str] = (data.get("message") if kind in (KIND_ACTION, KIND_STREAM)
+                                      else None)
+        self.user: Optional[str] = data.get("user")
+        self.password: Optional[str] = data.get("password")
+        self.token: Optional[str] = data.get("token")
+        self.topic: Optional[str] = data.get("topic")
+        self.message: Any = data.get("message")
+        self.batch = batch
+        self.qos: Optional[int] = data.get("qos")
+        self.retain: Optional[bool] = data.get("retain")
+        self.encoding: Optional[str] = data.get("encoding")
+        self.compression: Optional[str] = data.get("compression")
+
+
+def valid_options(data: dict) -> bool:
+    """
+    Поле qos - 0, 1 или 2, поле retain - true или false, поля encoding и compression - строки
+    (если поля заданы). Значения encoding и compression проверяет payload.check_codec.
+    """
+
+    qos = data.get("qos")
+    # bool - подкласс int, true не должно означать QoS 1
+    if qos is not None and (isinstance(qos, bool) or not isinstance(qos, int)
+                            or qos not in QOS_LEVELS):
+        return False
+    retain = data.get("retain")
+    if retain is not None and not isinstance(retain, bool):
+        return False
+    return all(isinstance(data.get(field, ""), str) for field in CODEC_OPTIONS)
+
+
+def parse_batch(batch: Any, qos: Optional[int] = None,
+                retain: Optional[bool] = None) -> Optional[List[BatchItem]]:
+    """
+    Пакет - непустой список сообщений, каждое содержит topic и message,
+    и может содержать qos и retain (по умолчанию - значения qos и retain пакета).
+    """
+
+    if not isinstance(batch, list) or not 0 < len(batch) <= MAX_BATCH_SIZE:
+        return None
+
+    items = []
+    for item in batch:
+        if not isinstance(item, dict):
+            return None
+        keys = item.keys()
+        if keys == BATCH_ITEM_FIELDS:
+            item_qos, item_retain = qos, retain
+        elif keys - PUBLISH_OPTIONS == BATCH_ITEM_FIELDS and valid_options(item):
+            item_qos, item_retain = item.get("qos", qos), item.get("retain", retain)
+        else:
+            return None
+        topic = item["topic"]
+        if not isinstance(topic, str):
+            return None
+        items.append((topic, item["message"], item_qos, item_retain))
+    return items
+
+
+def parse_request(data: Any) -> Optional[Request]:
+    """
+    Проверка разобранного JSON сообщения.
+    Возвращает Request или None, если сообщение не содержит необходимые поля.
+    """
+
+    if not isinstance(data, dict):
+        return None
+
+    message = data.get("message")
+    # Поле message публикуемого сообщения может быть любым значением JSON, в том числе списком
+    # Служебное действие выполняется, даже если сообщение содержит topic (как и ранее)
+    action_fields = ACTION_FIELDS.get(message) if isinstance(message, str) else None
+    if action_fields is not None:
+        for field in action_fields:
+            value = data.get(field)
+            if not value or not isinstance(value, str):
+                return None
+        return Request(KIND_ACTION, data)
+
+    keys: AbstractSet[str] = data.keys()
+    if not OPTIONS.isdisjoint(keys):
+        if not valid_options(data):
+            return None
+        keys = keys - OPTIONS
+
+    for fields, kind in SHAPES:
+        if keys != fields:
+            continue
+
+        credentials = (data.get("token"),) if "token" in data \
+            else (data["user"], data["password"])
+        if any(not isinstance(value, str) for value in credentials):
+            return None
+
+        if kind == KIND_BATCH:
+            batch = parse_batch(data["batch"], data.get("qos"), data.get("retain"))
+            return Request(kind, data, batch) if batch is not None else None
+
+        if not isinstance(data["topic"], str):
+            return None
+        message = data["message"]
+        if isinstance(message, str) and message in STREAM_ACTIONS:
+            return Request(KIND_STREAM, data)
+        return Request(kind, data)
+
+    return None
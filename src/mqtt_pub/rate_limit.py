@@ -0,0 +1,228 @@
+"""
+Ограничение нагрузки от клиентов.
+
+Скорость сообщений ограничивается алгоритмом token bucket отдельно для каждого пользователя
+и для каждого префикса топика (первые уровни топика, например user/device).
+Количество одновременных ожиданий ответа устройства ограничено для всего процесса.
+При превышении ограничений клиент сразу получает ответ о перегрузке.
+"""
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from time import monotonic
+from typing import Iterator, List, Optional, Sequence, Tuple
+from .metrics import counter, gauge  # pylint: disable = import-error
+
+# Максимальное количество хранимых счетчиков каждого вида (давно не использованные удаляются)
+MAX_BUCKETS = 10000
+
+# Виды ограничений (см. RateLimiter.check)
+LIMIT_USER = "user"
+LIMIT_TOPIC = "topic"
+LIMIT_TOO_LARGE = "too_large"
+
+RATE_LIMITED = counter("mqtt_pub_rate_limited_total", "Requests rejected by admission control",
+                       ["limit"])
+PENDING_REPLIES = gauge("mqtt_pub_pending_replies", "Requests waiting for a device answer")
+RATE_LIMIT_BUCKETS = gauge("mqtt_pub_rate_limit_buckets", "Tracked rate limit buckets", ["limit"])
+
+
+class TokenBucket:  # pylint: disable = too-few-public-methods
+    """Не более rate событий в секунду в среднем и не более burst подряд"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    def refill(self) -> float:
+        """Пополнение за прошедшее время. Возвращает доступное количество событий."""
+
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def take(self, amount: float = 1) -> bool:
+        """Списание amount событий. False, если лимит исчерпан."""
+
+        if self.refill() < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+
+class BucketGroup:
+    """Счетчики token bucket по ключу (имя пользователя или префикс топика)"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def bucket(self, key: str) -> TokenBucket:
+        """Счетчик для key (создается при первом обращении). Вызывается под блокировкой RateLimiter."""
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def take(self, key: str, amount: float = 1) -> bool:
+        """Списание amount событий для key. Вызывается под блокировкой RateLimiter."""
+        return self.bucket(key).take(amount)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RateLimiter:
+    """
+    Проверка ограничений для входящих сообщений.
+
+    settings: dict (user_rate: float, user_burst: int, topic_rate: float, topic_burst: int,
+    topic_levels: int, max_pending_replies: int). Нулевое значение отключает ограничение.
+    """
+
+    def __init__(self, settings: dict):
+        self.settings: dict = {}
+        self.users: Optional[BucketGroup] = None
+        self.topics: Optional[BucketGroup] = None
+        self.topic_levels = 0
+        self.max_pending_replies = 0
+        self.pending_replies = 0
+        self._lock = threading.Lock()
+        self.configure(settings)
+
+    def configure(self, settings: dict):
+        """Применение новых ограничений (например, после перезагрузки настроек)"""
+
+        with self._lock:
+            changed = settings != self.settings
+            self.settings = settings
+            if not changed:
+                return
+            self.users = (BucketGroup(settings["user_rate"], settings["user_burst"])
+                          if settings.get("user_rate") else None)
+            self.topics = (BucketGroup(settings["topic_rate"], settings["topic_burst"])
+                           if settings.get("topic_rate") else None)
+            self.topic_levels = settings.get("topic_levels") or 0
+            self.max_pending_replies = settings.get("max_pending_replies") or 0
+
+    def topic_prefix(self, topic: str) -> str:
+        """Первые topic_levels уровней топика без начального слэша"""
+        return "/".join(topic.lstrip("/").split("/")[:self.topic_levels])
+
+    def allow(self, user: str, topics: Sequence[str]) -> bool:
+        """Списание сообщений пользователя user в топики topics. False при любом отказе (см. check)."""
+        return self.check(user, topics) is None
+
+    def check(self, user: str, topics: Sequence[str]) -> Optional[str]:
+        """
+        Списание сообщений пользователя user в топики topics.
+        Запрос без топиков (вход пользователя) списывается как одно сообщение.
+
+        Возвращаемое значение: None, если запрос допущен, иначе превышенное ограничение:
+        LIMIT_USER или LIMIT_TOPIC - лимит исчерпан, запрос можно повторить позже;
+        LIMIT_TOO_LARGE - сообщений больше, чем ограничение допускает подряд,
+        такой запрос не будет допущен никогда.
+        События списываются, только если запрос допущен всеми ограничениями.
+        """
+
+        if self.users is None and self.topics is None:
+            return None
+
+        with self._lock:
+            demand: List[Tuple[str, BucketGroup, str, int]] = []
+            if self.users is not None:
+                demand.append((LIMIT_USER, self.users, user, max(1, len(topics))))
+            if self.topics is not None:
+                prefixes = Counter(self.topic_prefix(topic) for topic in topics)
+                demand.extend((LIMIT_TOPIC, self.topics, prefix, count)
+                              for prefix, count in prefixes.items())
+
+            if any(amount > group.burst for _, group, _, amount in demand):
+                RATE_LIMITED.inc(limit=LIMIT_TOO_LARGE)
+                return LIMIT_TOO_LARGE
+
+            buckets = [(group.bucket(key), amount) for _, group, key, amount in demand]
+            for (limit, *_), (bucket, amount) in zip(demand, buckets):
+                if bucket.refill() < amount:
+                    RATE_LIMITED.inc(limit=limit)
+                    return limit
+
+            for bucket, amount in buckets:
+                bucket.tokens -= amount
+
+        return None
+
+    def acquire_reply_slot(self) -> bool:
+        """
+        Место для ожидания ответа устройства (освобождается release_reply_slot).
+        Возвращает False, если одновременно ожидается уже max_pending_replies ответов.
+        """
+
+        with self._lock:
+            admitted = not self.max_pending_replies \
+                or self.pending_replies < self.max_pending_replies
+            if admitted:
+                self.pending_replies += 1
+
+        if not admitted:
+            RATE_LIMITED.inc(limit="pending_replies")
+        return admitted
+
+    def release_reply_slot(self):
+        """Освобождение места, занятого acquire_reply_slot"""
+
+        with self._lock:
+            self.pending_replies -= 1
+
+    @contextmanager
+    def reply_slot(self) -> Iterator[bool]:
+        """Место для ожидания ответа устройства на время блока (см. acquire_reply_slot)"""
+
+        admitted = self.acquire_reply_slot()
+        try:
+            yield admitted
+        finally:
+            if admitted:
+                self.release_reply_slot()
+
+    def bucket_count(self, kind: str) -> int:
+        """Количество хранимых счетчиков: users или topics"""
+
+        group = getattr(self, kind)
+        return len(group) if group is not None else 0
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter(settings: dict) -> RateLimiter:
+    """Общий для процесса RateLimiter с ограничениями из settings"""
+
+    global _limiter  # pylint: disable = global-statement
+
+    limiter = _limiter
+    if limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(settings)
+                PENDING_REPLIES.set_function(lambda: _limiter.pending_replies)
+                RATE_LIMIT_BUCKETS.set_function(lambda: _limiter.bucket_count("users"),
+                                                limit="user")
+                RATE_LIMIT_BUCKETS.set_function(lambda: _limiter.bucket_count("topics"),
+                                                limit="topic")
+            limiter = _limiter
+    elif limiter.settings is not settings:
+        limiter.configure(settings)
+    return limiter
@@ -0,0 +1,184 @@
+"""
+Объединение одинаковых запросов к устройствам.
+
+Если несколько клиентов одновременно отправляют одно и то же сообщение в один топик .../in/params,
+в брокер публикуется одно сообщение, а полученный ответ возвращается всем клиентам.
+Дополнительно ответы устройств могут кэшироваться на короткое время (ttl):
+повторный запрос в течение ttl получает ответ без обращения к брокеру.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError
+from time import monotonic
+from typing import Callable, Dict, Hashable, Optional, Tuple
+from .event_logger import get_error_logger  # pylint: disable = import-error
+from .metrics import counter  # pylint: disable = import-error
+
+error_log = get_error_logger("ERR__reply_cache__")
+
+COALESCED_REQUESTS = counter("mqtt_pub_coalesced_requests_total",
+                             "Requests served by an identical request already in flight")
+REPLY_CACHE_HITS = counter("mqtt_pub_reply_cache_hits_total",
+                           "Requests served from the reply cache")
+
+
+class _InFlight:  # pylint: disable = too-few-public-methods
+    """
+    Выполняемый запрос: общий Future ответа и количество ожидающих его клиентов.
+    failed - запрос завершился ошибкой, ответ (fallback) не кэшируется.
+    """
+
+    __slots__ = ("future", "waiters", "failed")
+
+    def __init__(self):
+        self.future: Future = Future()
+        self.waiters = 1
+        self.failed = False
+
+
+def chain_result(source: Future, target: Future):
+    """Передача результата выполненного source в target (если target еще не выполнен)"""
+
+    if source.cancelled():
+        target.cancel()
+        return
+    try:
+        error = source.exception()
+        if error is not None:
+            target.set_exception(error)
+        else:
+            target.set_result(source.result())
+    except InvalidStateError:
+        pass
+
+
+class ReplyCache:
+    """
+    Выполнение одинаковых запросов один раз.
+
+    settings: dict (ttl: float, size: int). Если ttl равен 0, ответы не кэшируются.
+    """
+
+    def __init__(self, settings: dict):
+        self.ttl = settings.get("ttl") or 0
+        self.size = settings.get("size") or 0
+        self._in_flight: Dict[Hashable, _InFlight] = {}
+        self._answers: "OrderedDict[Hashable, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def request(self, key: Hashable, fetch: Callable[[], Future],
+                cacheable: Callable[[str], bool] = bool, fallback: Optional[str] = None) -> Future:
+        """
+        Ответ на запрос key: Future, который будет выполнен ответом.
+        fetch начинает запрос и возвращает его Future; fetch выполняется, только если
+        такой же запрос сейчас не выполняется и ответа нет в кэше.
+        Каждый вызов получает свой Future: отмена ожидания одного клиента (таймаут)
+        не затрагивает остальных, а запрос отменяется, когда его ответ больше никто не ожидает.
+        cacheable - проверка, можно ли сохранить ответ в кэш (например, не сохранять таймаут).
+        fallback - ответ всем клиентам, если запрос завершился ошибкой (без fallback -
+        исключение запроса).
+        """
+
+        answer: Future = Future()
+        with self._lock:
+            cached = self._cached(key)
+            if cached is not None:
+                REPLY_CACHE_HITS.inc()
+                answer.set_result(cached)
+                return answer
+
+            existing = self._in_flight.get(key)
+            leader = existing is None
+            if existing is None:
+                entry = self._in_flight[key] = _InFlight()
+            else:
+                entry = existing
+                entry.waiters += 1
+
+        shared = entry.future
+        if leader:
+            shared.add_done_callback(lambda done: self._finish(key, entry, cacheable))
+            try:
+                fetched = fetch()
+            except Exception as err:  # pylint: disable = broad-except
+                fetched = Future()
+                fetched.set_exception(err)
+            fetched.add_done_callback(lambda done: self._settle(done, entry, fallback))
+            shared.add_done_callback(lambda done: fetched.cancel() if done.cancelled() else None)
+        else:
+            COALESCED_REQUESTS.inc()
+
+        shared.add_done_callback(lambda done: chain_result(done, answer))
+        answer.add_done_callback(
+            lambda done: self._leave(key, entry) if done.cancelled() else None)
+        return answer
+
+    def clear(self):
+        """Удаление всех сохраненных ответов"""
+
+        with self._lock:
+            self._answers.clear()
+
+    @staticmethod
+    def _settle(fetched: Future, entry: _InFlight, fallback: Optional[str]):
+        """Результат запроса становится ответом всех ожидающих его клиентов"""
+
+        if not fetched.cancelled() and fetched.exception() is not None and fallback is not None:
+            error_log.error("Запрос завершился с ошибкой: %s", str(fetched.exception()))
+            entry.failed = True
+            replacement: Future = Future()
+            replacement.set_result(fallback)
+            fetched = replacement
+        chain_result(fetched, entry.future)
+
+    def _leave(self, key: Hashable, entry: _InFlight):
+        """Клиент больше не ожидает ответ. Запрос без ожидающих клиентов отменяется."""
+
+        with self._lock:
+            entry.waiters -= 1
+            if entry.waiters or self._in_flight.get(key) is not entry:
+                return
+            del self._in_flight[key]
+        entry.future.cancel()
+
+    def _finish(self, key: Hashable, entry: _InFlight, cacheable: Callable[[str], bool]):
+        """Запрос выполнен: новые запросы key выполняются заново или получают ответ из кэша"""
+
+        future = entry.future
+        with self._lock:
+            if self._in_flight.get(key) is entry:
+                del self._in_flight[key]
+            if (self.ttl and not entry.failed and not future.cancelled()
+                    and future.exception() is None and cacheable(future.result())):
+                self._store(key, future.result())
+
+    def _cached(self, key: Hashable) -> Optional[str]:
+        entry = self._answers.get(key)
+        if entry is None:
+            return None
+        expires, answer = entry
+        if expires < monotonic():
+            del self._answers[key]
+            return None
+        return answer
+
+    def _store(self, key: Hashable, answer: str):
+        self._answers[key] = (monotonic() + self.ttl, answer)
+        self._answers.move_to_end(key)
+        while len(self._answers) > self.size:
+            self._answers.popitem(last=False)
+
+
+_caches: Dict[Tuple, ReplyCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_reply_cache(settings: dict) -> ReplyCache:
+    """Общий ReplyCache для параметров settings"""
+
+    key = (settings.get("ttl"), settings.get("size"))
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = ReplyCache(settings)
+    return cache
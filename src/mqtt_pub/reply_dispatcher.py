@@ -0,0 +1,344 @@
+"""
+Сопоставление запросов к устройствам и их ответов.
+
+Один долгоживущий подписчик подписан на фильтры топиков с ответами (reply_topic_filters,
+например +/+/+/out/info), поэтому количество подписок не зависит от количества устройств.
+Полученные сообщения передаются через дерево фильтров (TopicTrie) ожидающим запросам
+и обработчикам. Каждый запрос представлен объектом Future, ожидающие запросы одного топика
+обслуживаются в порядке поступления.
+"""
+import threading
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, Collection, Deque, Dict, List, Optional, Tuple
+import paho.mqtt.client as mqtt
+from .event_logger import get_info_logger, get_error_logger  # pylint: disable = import-error
+from .mqtt_pool import (PooledClient, MQTTConnectionError,  # pylint: disable = import-error
+                        DEFAULT_POOL_SETTINGS, broker_key, close_later)
+from .topic_trie import (TopicTrie, filter_covers,  # pylint: disable = import-error
+                         has_wildcards, is_valid_filter)  # pylint: disable = import-error
+
+event_log = get_info_logger("INFO__reply_dispatcher__")
+error_log = get_error_logger("ERR__reply_dispatcher__")
+
+MessageHandler = Callable[[str, bytes], None]
+
+
+class SubscriberClient(PooledClient):
+    """Подключение подписчика. После переподключения подписки восстанавливаются."""
+
+    def __init__(self, settings: dict, pool_settings: dict, dispatcher: "ReplyDispatcher"):
+        super().__init__(settings, pool_settings)
+        self.dispatcher = dispatcher
+        self.client.on_message = dispatcher.on_message
+        self.client.on_subscribe = dispatcher.on_subscribe
+
+    def _on_connect(self, client, userdata, flags, result_code):
+        super()._on_connect(client, userdata, flags, result_code)
+        if result_code == mqtt.MQTT_ERR_SUCCESS:
+            self.dispatcher.resubscribe()
+
+
+class Route:  # pylint: disable = too-few-public-methods
+    """
+    Получатели сообщений одного фильтра: разовые ожидания ответа и постоянные обработчики.
+    subscription - подписка, через которую получатели получают сообщения.
+    """
+
+    __slots__ = ("topic_filter", "waiters", "handlers", "subscription")
+
+    def __init__(self, topic_filter: str):
+        self.topic_filter = topic_filter
+        self.waiters: Deque[Future] = deque()
+        self.handlers: List[MessageHandler] = []
+        self.subscription: Optional[str] = None
+
+    def __bool__(self) -> bool:
+        return bool(self.waiters or self.handlers)
+
+
+class ReplyDispatcher:
+    """
+    Таблица ожидающих запросов и обработчиков сообщений.
+
+    reply_topic_filters - фильтры, на которые подписчик подписывается при подключении.
+    Если топик с ответом не соответствует ни одному из них, подписка на этот топик
+    оформляется при первом запросе и отменяется, когда у нее не остается получателей.
+    """
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.pool_settings = {**DEFAULT_POOL_SETTINGS, **settings.get("pool", {})}
+        self.reply_topic_filters = [topic_filter
+                                    for topic_filter in settings.get("reply_topic_filters", [])
+                                    if is_valid_filter(topic_filter)]
+        self._routes: Dict[str, Route] = {}
+        self._trie: "TopicTrie[Route]" = TopicTrie()
+        self._subscribed: "TopicTrie[str]" = TopicTrie()
+        self._subscriptions: Dict[str, threading.Event] = {}
+        # Количество фильтров с получателями у подписок вне reply_topic_filters
+        self._subscription_users: Dict[str, int] = {}
+        self._pending_subscriptions: Dict[int, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._subscriber = SubscriberClient(settings, self.pool_settings, self)
+        self._started = False
+
+    def start(self):
+        """Подключение подписчика к брокеру"""
+
+        with self._lock:
+            if self._started:
+                return
+            for topic_filter in self.reply_topic_filters:
+                self._add_subscription(topic_filter)
+            self._subscriber.start()
+            self._started = True
+
+    def close(self):
+        """Отключение подписчика. Ожидающие запросы отменяются."""
+
+        self._subscriber.stop()
+        with self._lock:
+            for route in self._routes.values():
+                for future in route.waiters:
+                    future.cancel()
+            self._routes.clear()
+            self._trie = TopicTrie()
+
+    def expect(self, topic: str) -> Future:
+        """
+        Регистрирует ожидание ответа в топике topic.
+        Возвращает Future, который будет выполнен при получении ответа (payload сообщения).
+        Подписка на топик подтверждена брокером к моменту возврата.
+        """
+
+        future: Future = Future()
+        self._register(topic, lambda route: route.waiters.append(future),
+                       lambda: self.discard(topic, future))
+        return future
+
+    def discard(self, topic: str, future: Future):
+        """Удаляет запрос из таблицы ожидания (таймаут или ошибка отправки)"""
+
+        with self._lock:
+            route = self._routes.get(topic)
+            if route is None:
+                return
+            try:
+                route.waiters.remove(future)
+            except ValueError:
+                pass
+            self._drop_if_empty(topic, route)
+
+    def add_handler(self, topic_filter: str, handler: MessageHandler):
+        """
+        Регистрирует обработчик handler(topic, payload) всех сообщений,
+        соответствующих фильтру topic_filter (до вызова remove_handler).
+        """
+
+        self._register(topic_filter, lambda route: route.handlers.append(handler),
+                       lambda: self.remove_handler(topic_filter, handler))
+
+    def remove_handler(self, topic_filter: str, handler: MessageHandler):
+        """Удаление обработчика"""
+
+        with self._lock:
+            route = self._routes.get(topic_filter)
+            if route is None:
+                return
+            try:
+                route.handlers.remove(handler)
+            except ValueError:
+                pass
+            self._drop_if_empty(topic_filter, route)
+
+    def resubscribe(self):
+        """Повторная подписка на все топики после (пере)подключения"""
+
+        with self._lock:
+            for topic, acknowledged in self._subscriptions.items():
+                result, mid = self._subscriber.client.subscribe(topic)
+                if result == mqtt.MQTT_ERR_SUCCESS:
+                    self._pending_subscriptions[mid] = acknowledged
+
+    def on_message(self, client, userdata, message):  # pylint: disable = unused-argument
+        """
+        Передача сообщения получателям всех подходящих фильтров:
+        самому раннему ожидающему запросу каждого фильтра и всем обработчикам.
+        """
+
+        futures: List[Future] = []
+        handlers: List[MessageHandler] = []
+        with self._lock:
+            for route in self._trie.match(message.topic):
+                handlers.extend(route.handlers)
+                # Ожидание могло быть отменено (брокер не принял запрос) до вызова discard:
+                # ответ получает первый неотмененный запрос
+                while route.waiters:
+                    future = route.waiters.popleft()
+                    if future.set_running_or_notify_cancel():
+                        futures.append(future)
+                        break
+                self._drop_if_empty(route.topic_filter, route)
+
+        if not futures and not handlers:
+            return
+
+        event_log.info("Получено сообщение из топика %s", message.topic)
+        for future in futures:
+            try:
+                future.set_result(message.payload)
+            except InvalidStateError:
+                pass
+        for handler in handlers:
+            try:
+                handler(message.topic, message.payload)
+            except Exception as err:  # pylint: disable = broad-except
+                error_log.error("Ошибка обработчика сообщений %s: %s", message.topic, str(err))
+
+    def on_subscribe(self, client, userdata, mid, granted_qos):  # pylint: disable = unused-argument
+        """Подтверждение подписки брокером"""
+
+        with self._lock:
+            event = self._pending_subscriptions.pop(mid, None)
+        if event is not None:
+            event.set()
+
+    def _register(self, topic_filter: str, add: Callable[[Route], None],
+                  rollback: Callable[[], None]):
+        """Добавление получателя и ожидание подтверждения подписки, покрывающей topic_filter"""
+
+        self.start()
+        timeout = self.pool_settings["connect_timeout"]
+        if not self._subscriber.wait_connected(timeout):
+            raise MQTTConnectionError(self._subscriber.last_error or "Брокер недоступен")
+
+        with self._lock:
+            route = self._routes.get(topic_filter)
+            if route is None:
+                route = self._routes[topic_filter] = Route(topic_filter)
+                self._trie.insert(topic_filter, route)
+            add(route)
+
+            try:
+                acknowledged: Optional[threading.Event] = self._subscribe_route(route)
+            except MQTTConnectionError:
+                acknowledged = None
+
+        if acknowledged is None:
+            rollback()
+            raise MQTTConnectionError("Не удалось подписаться на топик " + topic_filter)
+
+        if not acknowledged.wait(timeout):
+            error_log.error("Брокер не подтвердил подписку на топик %s", topic_filter)
+
+    def _subscribe_route(self, route: Route) -> threading.Event:
+        """
+        Подписка, через которую получатели route получают сообщения. Вызывается под блокировкой.
+        Возвращает событие подтверждения подписки брокером.
+        """
+
+        if route.subscription is not None:
+            return self._subscriptions[route.subscription]
+
+        # Получатель использует уже оформленную подписку, если она покрывает topic_filter:
+        # иначе брокер доставлял бы одно сообщение по каждой из подписок
+        topic_filter = route.topic_filter
+        if topic_filter in self._subscriptions:
+            covering = [topic_filter]
+        elif has_wildcards(topic_filter):
+            covering = [subscription for subscription in self._subscriptions
+                        if filter_covers(subscription, topic_filter)]
+        else:
+            covering = self._subscribed.match(topic_filter)
+
+        if covering:
+            subscription = covering[0]
+            acknowledged = self._subscriptions[subscription]
+        else:
+            subscription = topic_filter
+            acknowledged = self._add_subscription(topic_filter, subscribe=True)
+            self._subscription_users[subscription] = 0
+
+        route.subscription = subscription
+        if subscription in self._subscription_users:
+            self._subscription_users[subscription] += 1
+        return acknowledged
+
+    def _release_subscription(self, subscription: str):
+        """Отмена подписки вне reply_topic_filters без получателей. Вызывается под блокировкой."""
+
+        users = self._subscription_users.get(subscription)
+        if users is None:
+            return
+        if users > 1:
+            self._subscription_users[subscription] = users - 1
+            return
+
+        del self._subscription_users[subscription]
+        del self._subscriptions[subscription]
+        self._subscribed.remove(subscription, subscription)
+        result, _ = self._subscriber.client.unsubscribe(subscription)
+        if result != mqtt.MQTT_ERR_SUCCESS:
+            # Без подключения подписка не будет восстановлена при переподключении
+            error_log.error("Подписка на %s не отменена: %s",
+                            subscription, mqtt.error_string(result))
+
+    def _add_subscription(self, topic_filter: str, subscribe: bool = False) -> threading.Event:
+        """
+        Регистрация подписки.
+        Вызывается под блокировкой, чтобы подтверждение не обогнало таблицу.
+        """
+
+        acknowledged = self._subscriptions[topic_filter] = threading.Event()
+        self._subscribed.insert(topic_filter, topic_filter)
+        if subscribe:
+            result, mid = self._subscriber.client.subscribe(topic_filter)
+            if result != mqtt.MQTT_ERR_SUCCESS:
+                del self._subscriptions[topic_filter]
+                self._subscribed.remove(topic_filter, topic_filter)
+                raise MQTTConnectionError(mqtt.error_string(result))
+            self._pending_subscriptions[mid] = acknowledged
+        return acknowledged
+
+    def _drop_if_empty(self, topic_filter: str, route: Route):
+        if not route:
+            del self._routes[topic_filter]
+            self._trie.remove(topic_filter, route)
+            if route.subscription is not None:
+                self._release_subscription(route.subscription)
+
+    def stats(self) -> Tuple[int, int]:
+        """Количество фильтров с получателями и количество подписок"""
+        return len(self._routes), len(self._subscriptions)
+
+
+_dispatchers: Dict[tuple, ReplyDispatcher] = {}
+_dispatchers_lock = threading.Lock()
+
+
+def get_dispatcher(settings: dict) -> ReplyDispatcher:
+    """Возвращает общий подписчик для брокера из settings"""
+
+    key = broker_key(settings)
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.get(key)
+        if dispatcher is None:
+            dispatcher = _dispatchers[key] = ReplyDispatcher(settings)
+    return dispatcher
+
+
+def close_dispatchers(delay: float = 0, keys: Optional[Collection[tuple]] = None):
+    """
+    Отключение всех подписчиков.
+    delay - пауза перед отключением, чтобы уже ожидающие запросы получили ответ.
+    keys - отключаются только подписчики этих брокеров (см. broker_key).
+    """
+
+    with _dispatchers_lock:
+        if keys is None:
+            dispatchers = list(_dispatchers.values())
+            _dispatchers.clear()
+        else:
+            dispatchers = [_dispatchers.pop(key) for key in keys if key in _dispatchers]
+    close_later(dispatchers, delay)
@@ -0,0 +1,260 @@
+"""
+Распределение топиков между брокерами и переключение на резервный брокер.
+
+Правила routing.routes (BROKER_ROUTES) сопоставляют фильтрам топиков группы брокеров,
+например "site1/#=mqtt-a:1883|mqtt-a2:1883,site2/#=mqtt-b:1883|mqtt-b2:1883".
+Топик обслуживает группа первого подходящего правила, остальные топики - основная группа:
+broker_settings и резервные брокеры routing.standby (BROKER_STANDBY_HOSTS).
+route_settings возвращает настройки с адресом брокера группы. Пул подключений, подписчик
+ответов и подписки клиентов создаются для каждого брокера (ключ broker_key), поэтому
+недоступность одного брокера затрагивает только топики его группы.
+
+Первый брокер группы основной, остальные резервные. Фоновый поток каждые health_interval секунд
+проверяет подключение TCP к брокерам групп, у которых есть резервные. Брокер считается недоступным
+после health_failures неудачных проверок подряд и снова доступным после стольких же удачных.
+Группа использует первый доступный брокер в порядке перечисления, поэтому после восстановления
+основного брокера сообщения снова направляются ему. При переключении подписки клиентов сокета
+на прежнем брокере закрываются (клиенты подписываются заново), а подписчик и пул прежнего брокера
+закрываются после ожидания ответов на уже отправленные запросы.
+
+Подписка клиента сокета оформляется в группе, которой соответствует фильтр подписки как топик:
+фильтр, охватывающий топики нескольких групп (например, +/+/out/#), обслуживает основная группа.
+Параметры TLS, пула и публикации общие для всех брокеров.
+"""
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from .event_logger import get_info_logger, get_error_logger  # pylint: disable = import-error
+from .metrics import counter, gauge  # pylint: disable = import-error
+from .mqtt_pool import broker_key, close_pools  # pylint: disable = import-error
+from .reply_dispatcher import close_dispatchers  # pylint: disable = import-error
+from .stream import close_hubs  # pylint: disable = import-error
+from .topic_trie import TopicTrie, is_valid_filter  # pylint: disable = import-error
+
+event_log = get_info_logger("INFO__routing__")
+error_log = get_error_logger("ERR__routing__")
+
+DEFAULT_GROUP = "default"
+# Ожидание ответов на запросы, отправленные прежнему брокеру (TIMEOUT_WAIT_MQTT)
+RELEASE_DELAY = 30
+
+BROKER_HEALTHY = gauge("mqtt_pub_broker_healthy", "Broker health check result (1 - reachable)",
+                       ["broker"])
+BROKER_ACTIVE = gauge("mqtt_pub_broker_group_active", "Broker currently used by a routing group",
+                      ["group", "broker"])
+BROKER_FAILOVERS = counter("mqtt_pub_broker_failovers_total",
+                           "Routing group switches to another broker", ["group"])
+
+Address = Tuple[str, int]
+
+
+def probe(address: Address, timeout: float) -> bool:
+    """Проверка доступности брокера: подключение TCP за timeout секунд"""
+
+    try:
+        with socket.create_connection(address, timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _label(address: Address) -> str:
+    return f"{address[0]}:{address[1]}"
+
+
+class BrokerGroup:  # pylint: disable = too-few-public-methods
+    """Основной и резервные брокеры группы. active - индекс используемого брокера."""
+
+    def __init__(self, name: str, members: List[Address]):
+        self.name = name
+        self.members = members
+        self.active = 0
+
+    @property
+    def address(self) -> Address:
+        """Адрес используемого брокера"""
+        return self.members[self.active]
+
+
+class BrokerRouter:
+    """Таблица распределения топиков и проверка доступности брокеров"""
+
+    def __init__(self, settings: dict):
+        routing = settings["routing"]
+        broker = settings["broker_settings"]
+        self.use_tls = settings.get("broker_use_tls")
+        self.interval = routing.get("health_interval", 0)
+        self.timeout = routing.get("health_timeout", 2.0)
+        self.failures = max(1, routing.get("health_failures", 3))
+
+        self.default = BrokerGroup(DEFAULT_GROUP, [(broker.get("host"), broker.get("port")),
+                                                   *map(tuple, routing.get("standby", []))])
+        self.groups = [self.default]
+        self._routes: "TopicTrie[int]" = TopicTrie()
+        for topic_filter, members in routing.get("routes", []):
+            if members and is_valid_filter(topic_filter):
+                self._routes.insert(topic_filter, len(self.groups))
+                self.groups.append(BrokerGroup(topic_filter, [tuple(member) for member in members]))
+
+        # Брокеры групп с резервными брокерами: состояние и количество проверок подряд
+        # с результатом, противоположным состоянию
+        self._healthy: Dict[Address, bool] = {}
+        self._streaks: Dict[Address, int] = {}
+        for group in self.groups:
+            BROKER_ACTIVE.set(1, group=group.name, broker=_label(group.address))
+            if len(group.members) > 1:
+                for address in group.members:
+                    self._healthy[address] = True
+                    self._streaks[address] = 0
+                    BROKER_HEALTHY.set(1, broker=_label(address))
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def route(self, topic: str) -> BrokerGroup:
+        """Группа брокеров топика: первое подходящее правило или основная группа"""
+
+        matched = self._routes.match(topic)
+        return self.groups[min(matched)] if matched else self.default
+
+    def settings_for(self, settings: dict, topic: str) -> dict:
+        """Настройки с адресом брокера, который обслуживает топик"""
+
+        host, port = self.route(topic).address
+        broker = settings["broker_settings"]
+        if broker.get("host") != host or broker.get("port") != port:
+            broker = {**broker, "host": host, "port": port}
+        # routing: None - настройки уже относятся к одному брокеру
+        return {**settings, "broker_settings": broker, "routing": None}
+
+    def start(self):
+        """Запуск проверки доступности, если у какой-либо группы есть резервные брокеры"""
+
+        if not self.interval or not self._healthy:
+            return
+        self._thread = threading.Thread(target=self._watch, name="broker-health", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Остановка проверки доступности"""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def check(self, executor: Optional[ThreadPoolExecutor] = None):
+        """Проверка доступности брокеров и переключение групп на доступные брокеры"""
+
+        addresses = list(self._healthy)
+        if executor is None:
+            results = [probe(address, self.timeout) for address in addresses]
+        else:
+            results = list(executor.map(lambda address: probe(address, self.timeout), addresses))
+        for address, reachable in zip(addresses, results):
+            self._record(address, reachable)
+
+        previous: Set[Address] = set()
+        for group in self.groups:
+            active = next((index for index, address in enumerate(group.members)
+                           if self._healthy.get(address, True)), group.active)
+            if active == group.active:
+                continue
+
+            previous.add(group.address)
+            BROKER_ACTIVE.set(0, group=group.name, broker=_label(group.address))
+            BROKER_ACTIVE.set(1, group=group.name, broker=_label(group.members[active]))
+            BROKER_FAILOVERS.inc(group=group.name)
+            # Возврат на брокер с большим приоритетом - штатная ситуация
+            log = event_log.info if active < group.active else error_log.error
+            log("Группа %s переключена с брокера %s на %s", group.name,
+                _label(group.address), _label(group.members[active]))
+            group.active = active
+
+        # Брокер мог остаться используемым в другой группе
+        released = previous - {group.address for group in self.groups}
+        if released:
+            self._release(released)
+
+    def _record(self, address: Address, reachable: bool):
+        if reachable == self._healthy[address]:
+            self._streaks[address] = 0
+            return
+
+        self._streaks[address] += 1
+        if self._streaks[address] < self.failures:
+            return
+
+        self._healthy[address] = reachable
+        self._streaks[address] = 0
+        BROKER_HEALTHY.set(int(reachable), broker=_label(address))
+        if reachable:
+            event_log.info("Брокер %s снова доступен", _label(address))
+        else:
+            error_log.error("Брокер %s недоступен", _label(address))
+
+    def _release(self, addresses: Set[Address]):
+        """
+        Закрытие подключений к брокерам, которые больше не используются:
+        подписки клиентов - сразу, подписчик и пул - после ожидания начатых запросов.
+        """
+
+        keys = [(host, port, self.use_tls) for host, port in addresses]
+        close_hubs(keys)
+        close_dispatchers(delay=RELEASE_DELAY, keys=keys)
+        close_pools(delay=RELEASE_DELAY, keys=keys)
+
+    def _watch(self):
+        with ThreadPoolExecutor(len(self._healthy), thread_name_prefix="broker-probe") as executor:
+            while not self._stop.wait(self.interval):
+                try:
+                    self.check(executor)
+                except Exception as err:  # pylint: disable = broad-except
+                    error_log.error("Ошибка проверки доступности брокеров: %s", str(err))
+
+
+_routers: Dict[tuple, BrokerRouter] = {}
+_routers_lock = threading.Lock()
+
+
+def _router_key(settings: dict) -> tuple:
+    routing = settings["routing"]
+    return (broker_key(settings),
+            tuple((topic_filter, tuple(map(tuple, members)))
+                  for topic_filter, members in routing.get("routes", [])),
+            tuple(map(tuple, routing.get("standby", []))))
+
+
+def get_router(settings: dict) -> BrokerRouter:
+    """Возвращает общую таблицу распределения для settings, запуская проверку доступности"""
+
+    key = _router_key(settings)
+    with _routers_lock:
+        router = _routers.get(key)
+        if router is None:
+            router = _routers[key] = BrokerRouter(settings)
+            router.start()
+    return router
+
+
+def route_settings(settings: dict, topic: str) -> dict:
+    """
+    Настройки для публикации в топик topic (или подписки на фильтр topic):
+    broker_settings заменяется адресом брокера группы топика.
+    Без правил и резервных брокеров settings возвращаются без изменений.
+    """
+
+    routing = settings.get("routing")
+    if not routing or not (routing.get("routes") or routing.get("standby")):
+        return settings
+    return get_router(settings).settings_for(settings, topic)
+
+
+def close_routers():
+    """Остановка проверки доступности всех таблиц. Новые обращения создают новую таблицу."""
+
+    with _routers_lock:
+        routers = list(_routers.values())
+        _routers.clear()
+    for router in routers:
+        router.close()
@@ -0,0 +1,139 @@
+"""
+Сессионные токены.
+
+После входа (/login) клиент получает токен и передает его вместо user/password.
+Токен подписан HMAC: секрет сервиса + хэш пароля пользователя. Поэтому токен
+перестает действовать, если пароль пользователя изменился или пользователь удален.
+Проверенные токены кэшируются (LRU с истечением срока).
+"""
+import base64
+import hashlib
+import hmac
+import secrets
+import threading
+from collections import OrderedDict
+from time import time
+from typing import Dict, Optional, Tuple
+from .user_auth import get_password_hash  # pylint: disable = import-error
+
+TOKEN_SEPARATOR = "."
+PAYLOAD_SEPARATOR = ":"
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class SessionManager:
+    """
+    Выдача и проверка токенов.
+
+    settings: dict (secret: str, ttl: float, cache_size: int)
+    """
+
+    def __init__(self, settings: dict):
+        self.secret = (settings.get("secret") or secrets.token_hex(32)).encode()
+        self.ttl = settings["ttl"]
+        self.cache_size = settings["cache_size"]
+        self._cache: "OrderedDict[str, Tuple[str, float, str]]" = OrderedDict()
+        self._revoked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def issue(self, user: str) -> str:
+        """Новый токен пользователя"""
+
+        expires = int(time() + self.ttl)
+        payload = PAYLOAD_SEPARATOR.join((user, str(expires), secrets.token_hex(8))).encode()
+        return _encode(payload) + TOKEN_SEPARATOR + _encode(self._sign(payload,
+                                                                         get_password_hash(user)))
+
+    def validate(self, token: str) -> Optional[str]:
+        """
+        Проверка токена. Возвращает имя пользователя или None,
+        если токен недействителен, просрочен или отозван.
+        """
+
+        now = time()
+        with self._lock:
+            cached = self._cache.get(token)
+            if cached is not None:
+                self._cache.move_to_end(token)
+
+        if cached is None:
+            cached = self._verify(token)
+            if cached is None:
+                return None
+            with self._lock:
+                self._cache[token] = cached
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        user, expires, password_hash = cached
+        if expires < now or token in self._revoked \
+                or not hmac.compare_digest(password_hash, get_password_hash(user)):
+            self._forget(token)
+            return None
+
+        return user
+
+    def revoke(self, token: str):
+        """Отзыв токена (выход пользователя)"""
+
+        cached = self._verify(token)
+        if cached is None:
+            return
+
+        with self._lock:
+            now = time()
+            self._revoked = {revoked: expires for revoked, expires in self._revoked.items()
+                             if expires > now}
+            self._revoked[token] = cached[1]
+            self._cache.pop(token, None)
+
+    def revoke_all(self):
+        """Сброс кэша проверенных токенов (например, после изменения списка пользователей)"""
+
+        with self._lock:
+            self._cache.clear()
+
+    def _sign(self, payload: bytes, password_hash: str) -> bytes:
+        return hmac.new(self.secret + password_hash.encode(), payload, hashlib.sha256).digest()
+
+    def _verify(self, token: str) -> Optional[Tuple[str, float, str]]:
+        try:
+            payload_part, signature_part = token.split(TOKEN_SEPARATOR)
+            payload = _decode(payload_part)
+            user, expires, _ = payload.decode().rsplit(PAYLOAD_SEPARATOR, 2)
+            signature = _decode(signature_part)
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+        password_hash = get_password_hash(user)
+        if not password_hash \
+                or not hmac.compare_digest(signature, self._sign(payload, password_hash)):
+            return None
+
+        return user, float(expires), password_hash
+
+    def _forget(self, token: str):
+        with self._lock:
+            self._cache.pop(token, None)
+
+
+_managers: Dict[bytes, SessionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_session_manager(settings: dict) -> SessionManager:
+    """Общий менеджер сессий для секрета из settings"""
+
+    key = settings.get("secret", "").encode()
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = SessionManager(settings)
+    return manager
@@ -0,0 +1,222 @@
+"""Описание настроек сервиса. Значения загружаются в config.load_settings."""
+from pydantic import BaseSettings
+from .config import (get_full_path, SPOOL_PATH, SSL_CERTFILE_PATH,  # pylint: disable = import-error
+                     SSL_KEYFILE_PATH, TLS_CA_CERTS_PATH, TLS_CERTFILE_PATH, TLS_KEYFILE_PATH)
+
+
+class Settings(BaseSettings):  # pylint: disable = too-few-public-methods
+    """
+    Параметры подключения к внешним ресурсам.
+
+    mqtt_settings - подключение к брокеру mqtt для получения сообщений от устройств.
+    broker_host - адрес mqtt брокера.
+    broker_port - порт mqtt брокера.
+    broker_use_tls - Признак использования tls для соединения с брокером.
+    broker_keep_alive - Период активности соединения.
+    broker_pool_size - Количество постоянных подключений к брокеру.
+    broker_reconnect_min_delay - Начальная задержка переподключения к брокеру (сек).
+    broker_reconnect_max_delay - Максимальная задержка переподключения к брокеру (сек).
+    broker_connect_timeout - Время ожидания подключенного клиента из пула (сек).
+    broker_reply_topic_filters - Общие подписки на ответы устройств через запятую.
+    По умолчанию +/+/+/out/info (топики вида /user/device/out/info) и +/+/out/info
+    (user/device/out/info). На топики, не покрытые ими, подписка оформляется на время ожидания.
+    broker_tls_ciphers - Допустимые шифры TLS 1.2 в формате OpenSSL. Пусто - шифры по умолчанию.
+    broker_tls_alpn - Протоколы ALPN через запятую (например, x-amzn-mqtt-ca).
+    broker_tls_session_resumption - Возобновление сессии TLS при переподключении
+    и подключении клиентов пула (см. tls.py).
+    broker_batch_window - Количество сообщений пакета, одновременно ожидающих подтверждения.
+    broker_max_inflight - Количество сообщений одного подключения, ожидающих подтверждения брокера.
+    broker_max_queued - Размер очереди сообщений одного подключения сверх max_inflight.
+    0 - без ограничения.
+    broker_publish_mode - Публикация сообщений без ожидания ответа устройства:
+    spool - через очередь на диске (ответ клиенту после сохранения сообщения);
+    async - ответ клиенту после передачи сообщения подключению к брокеру, подтверждение
+    брокера учитывается в метриках; sync - ответ после подтверждения брокера.
+    broker_qos - Уровень QoS публикаций (0, 1 или 2), если не задан в сообщении.
+    broker_retain - Признак retain публикаций, если не задан в сообщении.
+    broker_topic_qos - QoS по топикам: "фильтр:qos" через запятую, действует первое
+    подходящее правило. Применяется, если QoS не задан в сообщении.
+    broker_reply_cache_ttl - Время, в течение которого ответ устройства возвращается
+    на такой же запрос без обращения к брокеру (сек). 0 - ответы не кэшируются.
+    broker_reply_cache_size - Максимальное количество кэшированных ответов.
+    broker_compression - Сжатие сообщений для брокера: zlib, zstd (см. payload.py). Пусто - без сжатия.
+    broker_compression_level - Уровень сжатия. 0 - уровень по умолчанию.
+    broker_compression_min_size - Сообщения меньшего размера не сжимаются (байт).
+    broker_compression_topics - Фильтры сжимаемых топиков через запятую. Пусто - все топики.
+    broker_max_payload_size - Максимальный размер распакованного сообщения (байт).
+    broker_routes - Распределение топиков между брокерами (см. routing.py):
+    "фильтр=хост:порт|резервный_хост:порт" через запятую, действует первое подходящее правило.
+    Остальные топики публикуются в broker_host.
+    broker_standby_hosts - Резервные брокеры для broker_host: "хост:порт" через запятую.
+    broker_health_interval - Период проверки доступности брокеров, у которых есть резервные (сек).
+    0 - без проверки и переключения на резервный брокер.
+    broker_health_timeout - Время ожидания подключения при проверке доступности (сек).
+    broker_health_failures - Количество неудачных проверок подряд, после которого брокер считается
+    недоступным (и удачных, после которого он снова доступен).
+
+    limits_settings - ограничение нагрузки от клиентов (см. rate_limit.py). 0 - без ограничения.
+    limit_user_rate - Сообщений в секунду от одного пользователя.
+    limit_user_burst - Сообщений подряд от одного пользователя сверх limit_user_rate.
+    limit_topic_rate - Сообщений в секунду в топики с одним префиксом.
+    limit_topic_burst - Сообщений подряд в топики с одним префиксом.
+    limit_topic_levels - Количество уровней топика в префиксе (2: user/device).
+    limit_max_pending_replies - Количество одновременно ожидаемых ответов устройств.
+    Ожидание ответа не занимает потоки обработки (socket_workers).
+
+    session_settings - сессионные токены (см. session.py).
+    session_secret - Секрет для подписи токенов. Если не задан, создается при запуске.
+    session_ttl - Время действия токена (сек).
+    session_cache_size - Количество проверенных токенов в кэше.
+
+    spool_settings - очередь исходящих сообщений на диске.
+    spool_path - Путь к файлу очереди.
+    spool_max_messages - Максимальное количество сообщений в очереди.
+    spool_max_bytes - Максимальный объем сообщений в очереди (байт).
+    spool_overflow_policy - Действие при переполнении: reject или drop_oldest.
+    spool_batch_size - Количество сообщений, отправляемых в брокер за один раз.
+    spool_retry_delay - Пауза перед повторной отправкой, если брокер недоступен (сек).
+
+    socket_settings - сокет, который слушает mqtt_publisher.
+    socket_host - ip адрес сокета, к которому подключается клиент.
+    socket_port - порт сокета, к которому подключается клиент.
+    socket_backlog - Размер очереди входящих подключений.
+    socket_max_connections - Максимальное количество одновременно обрабатываемых подключений.
+    socket_workers - Количество потоков для обработки сообщений.
+    socket_timeout - Время ожидания чтения и записи для одного подключения (сек).
+    socket_idle_timeout - Время простоя постоянного подключения до его закрытия (сек).
+    socket_framing - Протокол обмена: legacy, ndjson, length или auto (см. framing.py).
+    socket_max_frame_size - Максимальный размер одного сообщения (байт).
+    socket_pipeline_depth - Максимальное количество одновременных запросов в одном подключении.
+    socket_stream_buffer - Количество сообщений подписки в очереди к клиенту (см. stream.py).
+    socket_stream_overflow_policy - Действие при переполнении: drop_oldest, drop_new или disconnect.
+    socket_stream_max_subscriptions - Максимальное количество подписок одного подключения.
+    socket_drain_timeout - Время завершения начатых запросов и отправки очереди при остановке (сек).
+    use_ssl - Признак использования ssl для соединения с сокетом.
+    ssl_ciphers - Допустимые шифры TLS 1.2 сокета в формате OpenSSL.
+    ssl_alpn - Протоколы ALPN сокета через запятую.
+    ssl_session_tickets - Выдача клиентам session tickets для возобновления сессии.
+
+    workers_settings - запуск нескольких рабочих процессов (см. supervisor.py).
+    workers - Количество рабочих процессов. 1 - обработка в текущем процессе.
+    socket_reuse_port - Каждый процесс открывает свой сокет с SO_REUSEPORT
+    (иначе процессы используют общий сокет, открытый supervisor).
+    stats_interval - Период сбора статистики рабочих процессов (сек).
+
+    log_settings - запись логов (см. event_logger.py).
+    log_async - Запись логов в фоновом потоке через очередь.
+    log_batch_size - Максимальное количество записей, сбрасываемых на диск за один раз.
+    log_queue_size - Максимальное количество записей в очереди. При переполнении записи отбрасываются.
+    log_format - Формат записей: text или json.
+    log_max_bytes - Размер файла лога, при котором выполняется ротация (байт).
+    log_rotate_when - Ротация по времени (например, midnight). Если задана, размер не учитывается.
+    log_backup_count - Количество хранимых старых файлов лога.
+    log_info_sample_rate - Доля записываемых информационных сообщений (от 0 до 1).
+
+    metrics_settings - HTTP сервер метрик (адрес /metrics).
+    metrics_host - ip адрес сервера метрик.
+    metrics_port - порт сервера метрик. 0 - сервер не запускается.
+
+    reload_settings - перечитывание настроек без перезапуска (см. config_watcher.py).
+    config_reload_interval - Период проверки изменений users.json и .env (сек). 0 - не проверять.
+    """
+
+    # mqtt_settings
+    broker_host: str = ""
+    broker_port: int = 8883
+    broker_use_tls: bool = False
+    broker_keep_alive: int = 60
+    broker_pool_size: int = 2
+    broker_reconnect_min_delay: int = 1
+    broker_reconnect_max_delay: int = 60
+    broker_connect_timeout: float = 10.0
+    broker_reply_topic_filters: str = "+/+/+/out/info,+/+/out/info"
+    broker_tls_ciphers: str = ""
+    broker_tls_alpn: str = ""
+    broker_tls_session_resumption: bool = True
+    broker_batch_window: int = 20
+    broker_max_inflight: int = 20
+    broker_max_queued: int = 0
+    broker_publish_mode: str = "spool"
+    broker_qos: int = 1
+    broker_retain: bool = False
+    broker_topic_qos: str = ""
+    broker_reply_cache_ttl: float = 0.0
+    broker_reply_cache_size: int = 1000
+    broker_compression: str = ""
+    broker_compression_level: int = 0
+    broker_compression_min_size: int = 256
+    broker_compression_topics: str = ""
+    broker_max_payload_size: int = 1024 * 1024
+    broker_routes: str = ""
+    broker_standby_hosts: str = ""
+    broker_health_interval: float = 5.0
+    broker_health_timeout: float = 2.0
+    broker_health_failures: int = 3
+    tls_ca_certs_path: str = get_full_path(TLS_CA_CERTS_PATH)
+    tls_certfile_path: str = get_full_path(TLS_CERTFILE_PATH)
+    tls_keyfile_path: str = get_full_path(TLS_KEYFILE_PATH)
+
+    # limits_settings
+    limit_user_rate: float = 0.0
+    limit_user_burst: int = 100
+    limit_topic_rate: float = 0.0
+    limit_topic_burst: int = 20
+    limit_topic_levels: int = 2
+    limit_max_pending_replies: int = 48
+
+    # session_settings
+    session_secret: str = ""
+    session_ttl: float = 3600.0
+    session_cache_size: int = 10000
+
+    # spool_settings
+    spool_path: str = get_full_path(SPOOL_PATH)
+    spool_max_messages: int = 100000
+    spool_max_bytes: int = 64 * 1024 * 1024
+    spool_overflow_policy: str = "reject"
+    spool_batch_size: int = 100
+    spool_retry_delay: float = 5.0
+
+    # socket_settings
+    socket_host: str = "127.0.0.1"
+    socket_port: int = 5000
+    socket_backlog: int = 128
+    socket_max_connections: int = 1000
+    socket_workers: int = 64
+    socket_timeout: float = 10.0
+    socket_idle_timeout: float = 300.0
+    socket_framing: str = "legacy"
+    socket_max_frame_size: int = 65536
+    socket_pipeline_depth: int = 32
+    socket_stream_buffer: int = 1000
+    socket_stream_overflow_policy: str = "drop_oldest"
+    socket_stream_max_subscriptions: int = 16
+    socket_drain_timeout: float = 30.0
+    use_ssl: bool = False
+    ssl_keyfile_path: str = get_full_path(SSL_KEYFILE_PATH)
+    ssl_certfile_path: str = get_full_path(SSL_CERTFILE_PATH)
+    ssl_ciphers: str = ""
+    ssl_alpn: str = ""
+    ssl_session_tickets: bool = True
+
+    # workers_settings
+    workers: int = 1
+    socket_reuse_port: bool = False
+    stats_interval: float = 15.0
+
+    # log_settings
+    log_async: bool = True
+    log_batch_size: int = 100
+    log_queue_size: int = 10000
+    log_format: str = "text"
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_rotate_when: str = ""
+    log_backup_count: int = 5
+    log_info_sample_rate: float = 1.0
+
+    # metrics_settings
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9108
+
+    # reload_settings
+    config_reload_interval: float = 5.0
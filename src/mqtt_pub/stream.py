@@ -0,0 +1,309 @@
+"""
+Потоковая подписка клиентов сокета на сообщения брокера.
+
+Клиент постоянного подключения (ndjson, length) отправляет
+{"id": ..., "message": "/subscribe", "topic": фильтр, авторизация} и после ответа
+{"id": ..., "result": "OK"} получает все сообщения, соответствующие фильтру,
+кадрами {"id": ..., "topic": str, "message": str}. Подписка отменяется запросом
+/unsubscribe с тем же фильтром или закрытием подключения.
+
+Все клиенты одного фильтра используют один обработчик общего подписчика (ReplyDispatcher),
+поэтому брокер доставляет сообщение сервису один раз, сколько бы клиентов его ни ждали.
+Кадр сообщения кодируется один раз для каждой кодировки (поля encoding и compression запроса
+подписки, см. payload.py) и отправляется всем клиентам фильтра. В кодировке binary кадр
+содержит {"id": ..., "topic": str}, байт 0x00 и данные сообщения.
+
+У каждого подключения ограниченный буфер (socket_stream_buffer). Если клиент не успевает
+читать, применяется socket_stream_overflow_policy: drop_oldest - удаляется самое старое
+сообщение буфера, drop_new - отбрасывается новое, disconnect - подключение закрывается.
+"""
+import asyncio
+import functools
+import threading
+from collections import deque
+from typing import Callable, Collection, Deque, Dict, List, Optional, Tuple
+from . import protocol  # pylint: disable = import-error
+from .payload import (BINARY_SEPARATOR, ENCODING_BINARY,  # pylint: disable = import-error
+                      encode_answer, from_broker)
+from .event_logger import get_info_logger  # pylint: disable = import-error
+from .metrics import counter, gauge  # pylint: disable = import-error
+from .mqtt_pool import broker_key  # pylint: disable = import-error
+from .reply_dispatcher import MessageHandler, get_dispatcher  # pylint: disable = import-error
+from .topic_trie import is_valid_filter  # pylint: disable = import-error
+
+event_log = get_info_logger("INFO__stream__")
+
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DROP_NEW = "drop_new"
+POLICY_DISCONNECT = "disconnect"
+OVERFLOW_POLICIES = (POLICY_DROP_OLDEST, POLICY_DROP_NEW, POLICY_DISCONNECT)
+
+STREAM_SUBSCRIPTIONS = gauge("mqtt_pub_stream_subscriptions", "Active socket client subscriptions")
+STREAM_MESSAGES = counter("mqtt_pub_stream_messages_total", "Messages queued to socket subscribers")
+STREAM_DROPPED = counter("mqtt_pub_stream_dropped_total",
+                         "Messages dropped for slow socket subscribers", ["policy"])
+
+# Кодировка и сжатие сообщений подписки
+Codec = Tuple[Optional[str], Optional[str]]
+
+
+class StreamError(Exception):
+    """Подписка не может быть оформлена"""
+
+
+def check_filter(user: str, topic_filter: str) -> Optional[str]:
+    """
+    Проверка фильтра подписки. Возвращает сообщение об ошибке или None.
+    Фильтр ограничен топиками пользователя: первый уровень (без начального "/")
+    совпадает с именем пользователя, например /user/+/out/info.
+    """
+
+    if not is_valid_filter(topic_filter):
+        return "Некорректный фильтр топиков"
+
+    levels = topic_filter[1:] if topic_filter.startswith("/") else topic_filter
+    if levels.split("/", 1)[0] != user:
+        return "Подписка разрешена только на топики пользователя"
+    return None
+
+
+class ClientStream:
+    """
+    Подписки одного подключения и буфер еще не отправленных кадров.
+
+    Методы subscribe и unsubscribe вызываются из потоков обработки запросов,
+    offer и take - в цикле событий подключения.
+    disconnect - закрытие подключения (политика disconnect, переподключение к брокеру).
+    binary - подключение передает двоичные данные в кадрах (режим length).
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, settings_to_socket: dict,
+                 disconnect: Callable[[], None], binary: bool = False):
+        self.loop = loop
+        self.binary = binary
+        self.buffer_size = max(1, settings_to_socket.get("socket_stream_buffer", 1000))
+        self.policy = settings_to_socket.get("socket_stream_overflow_policy", POLICY_DROP_OLDEST)
+        self.max_subscriptions = settings_to_socket.get("socket_stream_max_subscriptions", 16)
+        self.disconnect = disconnect
+        self._buffer: Deque[bytes] = deque()
+        self._ready = asyncio.Event()
+        self._hubs: Dict[str, "StreamHub"] = {}
+        self._lock = threading.Lock()
+        self.closed = False
+
+    @property
+    def active(self) -> bool:
+        """Есть оформленные подписки"""
+        return bool(self._hubs)
+
+    def subscribe(self, request_id, topic_filter: str, settings_to_publish: dict,
+                  codec: Codec = (None, None)):
+        """
+        Подписка на фильтр. Повторная подписка на тот же фильтр меняет id и кодировку кадров.
+        codec - кодировка и сжатие сообщений (encoding, compression).
+        """
+
+        with self._lock:
+            if self.closed:
+                raise StreamError("Подключение закрыто")
+            if topic_filter not in self._hubs and len(self._hubs) >= self.max_subscriptions:
+                raise StreamError("Превышено количество подписок подключения")
+            hub = self._hubs[topic_filter] = get_hub(settings_to_publish)
+
+        try:
+            hub.subscribe(topic_filter, self, request_id, codec)
+        except Exception:
+            with self._lock:
+                self._hubs.pop(topic_filter, None)
+            raise
+
+    def unsubscribe(self, topic_filter: str) -> bool:
+        """Отмена подписки. False, если подписки не было."""
+
+        with self._lock:
+            hub = self._hubs.pop(topic_filter, None)
+        if hub is None:
+            return False
+        hub.unsubscribe(topic_filter, self)
+        return True
+
+    def close(self):
+        """Отмена всех подписок подключения"""
+
+        with self._lock:
+            self.closed = True
+            hubs, self._hubs = self._hubs, {}
+        for topic_filter, hub in hubs.items():
+            hub.unsubscribe(topic_filter, self)
+
+    def offer(self, frame: bytes):
+        """Добавление кадра в буфер с учетом политики переполнения"""
+
+        if self.closed:
+            return
+
+        if len(self._buffer) >= self.buffer_size:
+            STREAM_DROPPED.inc(policy=self.policy)
+            if self.policy == POLICY_DROP_NEW:
+                return
+            if self.policy == POLICY_DISCONNECT:
+                event_log.error("Клиент не успевает читать сообщения подписки, подключение закрыто")
+                self.closed = True
+                self._buffer.clear()
+                self.disconnect()
+                return
+            self._buffer.popleft()
+
+        STREAM_MESSAGES.inc()
+        self._buffer.append(frame)
+        self._ready.set()
+
+    async def take(self) -> List[bytes]:
+        """Ожидание и получение всех накопленных кадров"""
+
+        await self._ready.wait()
+        self._ready.clear()
+        frames = list(self._buffer)
+        self._buffer.clear()
+        return frames
+
+
+def _offer_all(streams: List[ClientStream], frames: List[bytes]):
+    for stream, frame in zip(streams, frames):
+        stream.offer(frame)
+
+
+def encode_body(topic: str, payload: bytes, codec: Codec) -> bytes:
+    """Кадр сообщения подписки без начала с id запроса"""
+
+    encoding, compression = codec
+    message = encode_answer(payload, encoding, compression)
+    if encoding == ENCODING_BINARY:
+        return protocol.dumps_bytes({"topic": topic})[1:] + BINARY_SEPARATOR + message  # type: ignore
+    return protocol.dumps_bytes({"topic": topic, "message": message})[1:]
+
+
+class StreamHub:
+    """
+    Подписки клиентов на сообщения одного брокера.
+    На каждый фильтр в общем подписчике регистрируется один обработчик.
+    """
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        # Фильтр -> подключение -> начало кадра с id запроса подписки и кодировка сообщений
+        self._streams: Dict[str, Dict[ClientStream, Tuple[bytes, Codec]]] = {}
+        self._handlers: Dict[str, MessageHandler] = {}
+        # _lock защищает таблицы и берется в потоке подписчика при получении сообщения,
+        # _subscribe_lock упорядочивает подписки: подтверждение подписки обрабатывает
+        # тот же поток подписчика, поэтому ожидать его под _lock нельзя
+        self._lock = threading.Lock()
+        self._subscribe_lock = threading.Lock()
+
+    def subscribe(self, topic_filter: str, stream: ClientStream, request_id,
+                  codec: Codec = (None, None)):
+        """Добавление подключения к получателям фильтра"""
+
+        receiver = (b'{"id":' + protocol.dumps_bytes(request_id) + b",", codec)
+        with self._subscribe_lock:
+            with self._lock:
+                streams = self._streams.get(topic_filter)
+                if streams is not None:
+                    if stream not in streams:
+                        STREAM_SUBSCRIPTIONS.inc()
+                    streams[stream] = receiver
+                    return
+
+            handler = functools.partial(self._fan_out, topic_filter)
+            get_dispatcher(self.settings).add_handler(topic_filter, handler)
+            with self._lock:
+                self._streams[topic_filter] = {stream: receiver}
+                self._handlers[topic_filter] = handler
+            STREAM_SUBSCRIPTIONS.inc()
+
+    def unsubscribe(self, topic_filter: str, stream: ClientStream):
+        """Удаление подключения. Обработчик последнего получателя фильтра удаляется."""
+
+        with self._subscribe_lock:
+            with self._lock:
+                streams = self._streams.get(topic_filter)
+                if streams is None or streams.pop(stream, None) is None:
+                    return
+                STREAM_SUBSCRIPTIONS.dec()
+                if streams:
+                    return
+                del self._streams[topic_filter]
+                handler = self._handlers.pop(topic_filter)
+            get_dispatcher(self.settings).remove_handler(topic_filter, handler)
+
+    def close(self):
+        """Закрытие подключений всех подписчиков (например, при смене брокера)"""
+
+        with self._lock:
+            streams = {stream for receivers in self._streams.values() for stream in receivers}
+        for stream in streams:
+            stream.loop.call_soon_threadsafe(stream.disconnect)
+
+    def _fan_out(self, topic_filter: str, topic: str, payload: bytes):
+        """Передача сообщения всем подключениям фильтра (вызывается в потоке подписчика)"""
+
+        with self._lock:
+            receivers = list(self._streams.get(topic_filter, {}).items())
+        if not receivers:
+            return
+
+        payload = from_broker(self.settings, topic, payload)
+        bodies: Dict[Codec, bytes] = {}
+
+        # Один вызов на цикл событий: обычно все подключения процесса обслуживает один цикл
+        by_loop: Dict[asyncio.AbstractEventLoop, tuple] = {}
+        for stream, (prefix, codec) in receivers:
+            body = bodies.get(codec)
+            if body is None:
+                body = bodies[codec] = encode_body(topic, payload, codec)
+            streams, frames = by_loop.setdefault(stream.loop, ([], []))
+            streams.append(stream)
+            frames.append(prefix + body)
+        for loop, (streams, frames) in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_offer_all, streams, frames)
+            except RuntimeError:
+                # Цикл событий уже закрыт
+                pass
+
+    def stats(self) -> int:
+        """Количество фильтров с подписчиками"""
+        return len(self._streams)
+
+
+_hubs: Dict[tuple, StreamHub] = {}
+_hubs_lock = threading.Lock()
+
+
+def get_hub(settings: dict) -> StreamHub:
+    """Возвращает подписки клиентов для брокера из settings"""
+
+    key = broker_key(settings)
+    with _hubs_lock:
+        hub = _hubs.get(key)
+        if hub is None:
+            hub = _hubs[key] = StreamHub(settings)
+    return hub
+
+
+def close_hubs(keys: Optional[Collection[tuple]] = None):
+    """
+    Закрытие подключений всех подписчиков.
+    Вызывается вместе с close_dispatchers: обработчики старого подписчика
+    больше не получат сообщений, клиенты подключаются заново и подписываются через новый подписчик.
+    keys - закрываются только подписки этих брокеров (см. broker_key).
+    """
+
+    with _hubs_lock:
+        if keys is None:
+            hubs = list(_hubs.values())
+            _hubs.clear()
+        else:
+            hubs = [_hubs.pop(key) for key in keys if key in _hubs]
+    for hub in hubs:
+        hub.close()
@@ -0,0 +1,243 @@
+"""
+Запуск нескольких рабочих процессов, которые обслуживают один порт.
+
+Supervisor открывает сокет и передает его рабочим процессам (либо каждый процесс
+открывает свой сокет с SO_REUSEPORT). У каждого процесса свои подключения к брокеру.
+Supervisor перезапускает упавшие процессы, выполняет плавный перезапуск по SIGHUP
+и объединяет метрики процессов. По SIGTERM и SIGINT рабочие процессы завершают начатые
+запросы (см. lifecycle.py), по SIGUSR2 сокет передается новому supervisor.
+"""
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+from multiprocessing.process import BaseProcess
+from time import monotonic, sleep
+from typing import Dict, Optional
+from .event_logger import get_info_logger, get_error_logger  # pylint: disable = import-error
+from .lifecycle import inherited_socket, notify_predecessor, spawn_successor  # pylint: disable = import-error
+from .metrics import REGISTRY, merge_snapshots, start_metrics_server  # pylint: disable = import-error
+
+event_log = get_info_logger("INFO__supervisor__")
+error_log = get_error_logger("ERR__supervisor__")
+
+POLL_INTERVAL = 0.5
+RESPAWN_MIN_DELAY = 1.0
+RESPAWN_MAX_DELAY = 30.0
+# Время на завершение процесса сверх socket_drain_timeout
+STOP_TIMEOUT = 10.0
+
+
+def run_worker(index: int, sock: Optional[socket.socket],
+               settings_to_socket: dict, settings_to_publish: dict,
+               stats: multiprocessing.Queue):
+    """
+    Рабочий процесс: обслуживает сокет и периодически отправляет свои метрики supervisor.
+    Очередь исходящих сообщений у каждого индекса своя. При плавном перезапуске старый
+    и новый процессы индекса открывают одну очередь, отправляет ее только один (см. outbound_queue).
+    """
+
+    # Импорт здесь: модуль загружается в новом процессе
+    from .message_listener import open_socket  # pylint: disable = import-outside-toplevel
+
+    # Остановку выполняет supervisor через SIGTERM, SIGINT терминала процессу не нужен
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    spool = settings_to_publish["spool"]
+    spool["path"] = f"{spool['path']}.{index}"
+
+    def report_stats():
+        while True:
+            sleep(settings_to_socket.get("stats_interval"))
+            stats.put((index, os.getpid(), REGISTRY.snapshot()))
+
+    def on_listening():
+        # Первые метрики сообщают supervisor, что процесс принимает подключения
+        stats.put((index, os.getpid(), REGISTRY.snapshot()))
+        threading.Thread(target=report_stats, name="worker-stats", daemon=True).start()
+
+    event_log.info("Рабочий процесс %s запущен (pid %s)", index, os.getpid())
+
+    open_socket(settings_to_socket, settings_to_publish, sock, on_listening=on_listening)
+
+
+class Supervisor:
+    """Управление рабочими процессами"""
+
+    def __init__(self, settings_to_socket: dict, settings_to_publish: dict):
+        self.settings_to_socket = settings_to_socket
+        self.settings_to_publish = settings_to_publish
+        self.workers_count = settings_to_socket.get("workers")
+        self.context = multiprocessing.get_context("spawn")
+        self.stats: multiprocessing.Queue = self.context.Queue()
+        self.sock: Optional[socket.socket] = None
+        self.workers: Dict[int, BaseProcess] = {}
+        self._snapshots: Dict[int, list] = {}
+        self._respawn_delay: Dict[int, float] = {}
+        self._started_at: Dict[int, float] = {}
+        self._died_at: Dict[int, float] = {}
+        self.stop_timeout = settings_to_socket.get("socket_drain_timeout", 30.0) + STOP_TIMEOUT
+        self._stopping = False
+        self._restart_requested = False
+        self._handoff_requested = False
+
+    def run(self):
+        """Запуск процессов и наблюдение за ними до получения SIGINT или SIGTERM"""
+
+        if not self.settings_to_socket.get("socket_reuse_port"):
+            self.sock = inherited_socket() or self._open_socket()
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_restart)
+        signal.signal(signal.SIGUSR2, self._on_handoff)
+
+        try:
+            start_metrics_server(self.settings_to_socket.get("metrics_host"),
+                                 self.settings_to_socket.get("metrics_port"),
+                                 self.render_metrics)
+        except OSError as err:
+            error_log.error("Не удалось запустить сервер метрик: %s", str(err))
+
+        for index in range(self.workers_count):
+            self._spawn(index)
+
+        predecessor_notified = False
+        last_report = monotonic()
+        while not self._stopping:
+            sleep(POLL_INTERVAL)
+            self._collect_stats()
+
+            if not predecessor_notified and len(self._snapshots) == self.workers_count:
+                # Предыдущий supervisor останавливается, когда все процессы принимают подключения
+                predecessor_notified = True
+                notify_predecessor()
+
+            if self._restart_requested:
+                self._restart_requested = False
+                self.restart()
+
+            if self._handoff_requested:
+                self._handoff_requested = False
+                spawn_successor(self.sock)
+
+            self._respawn_dead()
+
+            if monotonic() - last_report >= self.settings_to_socket.get("stats_interval"):
+                last_report = monotonic()
+                self._log_stats()
+
+        self.stop()
+
+    def restart(self):
+        """Плавный перезапуск: процессы заменяются по одному, сокет продолжает принимать подключения"""
+
+        event_log.info("Плавный перезапуск рабочих процессов")
+        for index in list(self.workers):
+            old = self.workers[index]
+            self._spawn(index)
+            self._terminate(old)
+
+    def stop(self):
+        """Остановка всех процессов"""
+
+        event_log.info("Остановка рабочих процессов")
+        # Процессы завершают начатые запросы одновременно
+        for worker in self.workers.values():
+            worker.terminate()
+        for worker in self.workers.values():
+            self._terminate(worker)
+        self.workers.clear()
+        if self.sock is not None:
+            self.sock.close()
+
+    def render_metrics(self) -> str:
+        """Сумма метрик всех рабочих процессов"""
+        return merge_snapshots(list(self._snapshots.values())).render()
+
+    def combined_stats(self) -> Dict[str, float]:
+        """Основные показатели всех процессов"""
+
+        registry = merge_snapshots(list(self._snapshots.values()))
+        snapshot = {name: values for _, name, _, _, _, values in registry.snapshot()}
+
+        def total(name: str) -> float:
+            return sum(value if not isinstance(value, tuple) else sum(value[0])
+                       for value in snapshot.get(name, {}).values())
+
+        return {"workers": sum(worker.is_alive() for worker in self.workers.values()),
+                "connections": total("mqtt_pub_connections_total"),
+                "active_connections": total("mqtt_pub_active_connections"),
+                "requests": total("mqtt_pub_request_seconds"),
+                "reply_timeouts": total("mqtt_pub_reply_timeouts_total"),
+                "spool_depth": total("mqtt_pub_spool_depth")}
+
+    def _open_socket(self) -> socket.socket:
+        sock = socket.create_server((self.settings_to_socket.get("socket_host"),
+                                     self.settings_to_socket.get("socket_port")),
+                                    backlog=self.settings_to_socket.get("socket_backlog"))
+        sock.set_inheritable(True)
+        return sock
+
+    def _spawn(self, index: int):
+        worker = self.context.Process(target=run_worker,
+                                      name=f"mqtt_pub-worker-{index}",
+                                      args=(index, self.sock, self.settings_to_socket,
+                                            self.settings_to_publish, self.stats),
+                                      daemon=False)
+        worker.start()
+        self.workers[index] = worker
+        self._started_at[index] = monotonic()
+
+    def _respawn_dead(self):
+        for index, worker in list(self.workers.items()):
+            if worker.is_alive():
+                continue
+
+            if index not in self._died_at:
+                # Процесс, упавший вскоре после запуска, перезапускается с возрастающей паузой
+                died = self._died_at[index] = monotonic()
+                previous = self._respawn_delay.get(index, RESPAWN_MIN_DELAY / 2)
+                self._respawn_delay[index] = (
+                    min(previous * 2, RESPAWN_MAX_DELAY)
+                    if died - self._started_at[index] < RESPAWN_MAX_DELAY else RESPAWN_MIN_DELAY)
+                error_log.error("Рабочий процесс %s завершился с кодом %s, перезапуск через %s сек",
+                                index, worker.exitcode, self._respawn_delay[index])
+
+            if monotonic() - self._died_at[index] < self._respawn_delay[index]:
+                continue
+
+            del self._died_at[index]
+            self._snapshots.pop(index, None)
+            self._spawn(index)
+
+    def _collect_stats(self):
+        while True:
+            try:
+                index, _, snapshot = self.stats.get_nowait()
+            except queue.Empty:
+                return
+            self._snapshots[index] = snapshot
+
+    def _log_stats(self):
+        event_log.info("Статистика рабочих процессов: %s", self.combined_stats())
+
+    def _terminate(self, worker: BaseProcess):
+        worker.terminate()
+        worker.join(self.stop_timeout)
+        if worker.is_alive():
+            error_log.error("Рабочий процесс %s не завершился за %s сек",
+                            worker.pid, self.stop_timeout)
+            worker.kill()
+            worker.join()
+
+    def _on_stop(self, signum, frame):  # pylint: disable = unused-argument
+        self._stopping = True
+
+    def _on_restart(self, signum, frame):  # pylint: disable = unused-argument
+        self._restart_requested = True
+
+    def _on_handoff(self, signum, frame):  # pylint: disable = unused-argument
+        self._handoff_requested = True
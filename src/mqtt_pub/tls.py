@@ -0,0 +1,146 @@
+"""
+TLS контексты подключений к брокеру и сокета.
+
+Контексты создаются один раз: сертификаты и ключи читаются с диска при создании контекста,
+а не при каждом подключении. Контекст подключений к брокеру общий для всех клиентов пула
+и подписчика и запоминает сессию TLS последнего подключения к каждому хосту, поэтому
+переподключения и подключения остальных клиентов выполняются с возобновлением сессии
+(сокращенное рукопожатие без передачи и проверки цепочки сертификатов).
+Сервер сокета выдает клиентам session tickets и поддерживает возобновление сессий.
+"""
+import ssl
+import threading
+from typing import Dict, List, Optional
+from .metrics import counter, gauge  # pylint: disable = import-error
+
+TLS_HANDSHAKES = counter("mqtt_pub_broker_tls_handshakes_total",
+                         "TLS handshakes with the broker", ["resumed"])
+LISTENER_TLS_SESSIONS = gauge("mqtt_pub_listener_tls_sessions",
+                              "Listener TLS handshakes: accepted and resumed (hits)", ["state"])
+
+
+class ResumingSSLSocket(ssl.SSLSocket):
+    """Сокет, сохраняющий сессию в контексте после рукопожатия и перед закрытием"""
+
+    def do_handshake(self, block=False):
+        super().do_handshake(block)
+        TLS_HANDSHAKES.inc(resumed="yes" if self.session_reused else "no")
+        self.context.remember(self)  # type: ignore
+
+    def close(self):
+        # В TLS 1.3 session ticket приходит после рукопожатия, к закрытию он уже получен
+        self.context.remember(self)  # type: ignore
+        super().close()
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """Клиентский контекст, который возобновляет последнюю сессию с тем же хостом"""
+
+    sslsocket_class = ResumingSSLSocket
+
+    def __init__(self, protocol: int = ssl.PROTOCOL_TLS_CLIENT):  # pylint: disable = unused-argument
+        super().__init__()
+        self._sessions: Dict[Optional[str], ssl.SSLSession] = {}
+        self._sessions_lock = threading.Lock()
+
+    def wrap_socket(self, sock, server_side=False,  # pylint: disable = arguments-differ, too-many-arguments
+                    do_handshake_on_connect=True, suppress_ragged_eofs=True,
+                    server_hostname=None, session=None):
+        if session is None and not server_side:
+            with self._sessions_lock:
+                session = self._sessions.get(server_hostname)
+        return super().wrap_socket(sock, server_side=server_side,
+                                   do_handshake_on_connect=do_handshake_on_connect,
+                                   suppress_ragged_eofs=suppress_ragged_eofs,
+                                   server_hostname=server_hostname, session=session)
+
+    def remember(self, sock: ssl.SSLSocket):
+        """Сохранение сессии подключения для следующих подключений к тому же хосту"""
+
+        try:
+            session = sock.session
+            version = sock.version()
+        except (OSError, ValueError):
+            return
+        # Сессия TLS 1.3 без ticket не может быть возобновлена
+        if session is None or (version == "TLSv1.3" and not session.has_ticket):
+            return
+        with self._sessions_lock:
+            self._sessions[sock.server_hostname] = session
+
+    def forget(self):
+        """Удаление сохраненных сессий"""
+
+        with self._sessions_lock:
+            self._sessions.clear()
+
+
+def _configure(context: ssl.SSLContext, ciphers: str, alpn: List[str]):
+    if ciphers:
+        context.set_ciphers(ciphers)
+    if alpn:
+        context.set_alpn_protocols(alpn)
+
+
+def client_context(tls: dict) -> ssl.SSLContext:
+    """
+    Контекст подключений к брокеру.
+
+    tls: dict (ca_certs: str, certfile: str, keyfile: str, ciphers: str, alpn: list,
+    session_resumption: bool)
+    Сертификат брокера и имя хоста проверяются, как в tls_set клиента paho.
+    """
+
+    context_class = ResumingSSLContext if tls.get("session_resumption", True) else ssl.SSLContext
+    context = context_class(ssl.PROTOCOL_TLS_CLIENT)
+    if tls.get("ca_certs"):
+        context.load_verify_locations(cafile=tls["ca_certs"])
+    else:
+        context.load_default_certs()
+    if tls.get("certfile"):
+        context.load_cert_chain(tls["certfile"], tls.get("keyfile") or None)
+    _configure(context, tls.get("ciphers", ""), tls.get("alpn", []))
+    return context
+
+
+def server_context(settings_to_socket: dict) -> ssl.SSLContext:
+    """Контекст сокета: сертификат, шифры, ALPN и session tickets из настроек сокета"""
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile=settings_to_socket.get("ssl_certfile_path"),
+                            keyfile=settings_to_socket.get("ssl_keyfile_path"))
+    _configure(context, settings_to_socket.get("ssl_ciphers", ""),
+               settings_to_socket.get("ssl_alpn", []))
+    if not settings_to_socket.get("ssl_session_tickets", True):
+        context.options |= ssl.OP_NO_TICKET
+        context.num_tickets = 0
+
+    for state, key in (("accepted", "accept_good"), ("resumed", "hits")):
+        LISTENER_TLS_SESSIONS.set_function(lambda key=key: context.session_stats()[key], state=state)
+    return context
+
+
+_client_contexts: Dict[tuple, ssl.SSLContext] = {}
+_client_contexts_lock = threading.Lock()
+
+
+def get_client_context(tls: dict) -> ssl.SSLContext:
+    """Общий контекст подключений к брокеру для настроек tls (создается при первом обращении)"""
+
+    key = tuple(sorted((name, tuple(value) if isinstance(value, list) else value)
+                       for name, value in tls.items()))
+    with _client_contexts_lock:
+        context = _client_contexts.get(key)
+        if context is None:
+            context = _client_contexts[key] = client_context(tls)
+    return context
+
+
+def clear_client_contexts():
+    """
+    Удаление общих контекстов: следующие подключения заново читают сертификаты.
+    Контексты уже созданных клиентов продолжают работать.
+    """
+
+    with _client_contexts_lock:
+        _client_contexts.clear()
@@ -0,0 +1,145 @@
+"""
+Дерево фильтров топиков MQTT.
+
+Фильтры хранятся по уровням топика, поэтому поиск всех фильтров, подходящих топику,
+занимает время, пропорциональное глубине топика, а не количеству фильтров.
+Поддерживаются подстановочные символы "+" (один уровень) и "#" (все оставшиеся уровни).
+"""
+from typing import Dict, Generic, List, TypeVar
+
+SINGLE_LEVEL = "+"
+MULTI_LEVEL = "#"
+
+V = TypeVar("V")
+
+
+class _Node(Generic[V]):  # pylint: disable = too-few-public-methods
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node[V]"] = {}
+        self.values: List[V] = []
+
+
+def is_valid_filter(topic_filter: str) -> bool:
+    """
+    Фильтр не пустой, "#" только последним уровнем,
+    подстановочные символы занимают весь уровень
+    """
+
+    if not topic_filter:
+        return False
+
+    levels = topic_filter.split("/")
+    for index, level in enumerate(levels):
+        if MULTI_LEVEL in level and (level != MULTI_LEVEL or index != len(levels) - 1):
+            return False
+        if SINGLE_LEVEL in level and level != SINGLE_LEVEL:
+            return False
+    return True
+
+
+def has_wildcards(topic_filter: str) -> bool:
+    """Фильтр содержит подстановочные символы"""
+    return SINGLE_LEVEL in topic_filter or MULTI_LEVEL in topic_filter
+
+
+def filter_covers(general: str, specific: str) -> bool:
+    """Любой топик, соответствующий фильтру specific, соответствует и фильтру general"""
+
+    general_levels = general.split("/")
+    specific_levels = specific.split("/")
+    for index, level in enumerate(general_levels):
+        if level == MULTI_LEVEL:
+            return True
+        if index >= len(specific_levels):
+            return False
+        if level == SINGLE_LEVEL:
+            if specific_levels[index] == MULTI_LEVEL:
+                return False
+        elif level != specific_levels[index]:
+            return False
+    return len(general_levels) == len(specific_levels)
+
+
+class TopicTrie(Generic[V]):
+    """Значения, зарегистрированные по фильтрам топиков"""
+
+    def __init__(self):
+        self._root: _Node[V] = _Node()
+        self._count = 0
+
+    def insert(self, topic_filter: str, value: V):
+        """Регистрация значения value для фильтра topic_filter"""
+
+        node = self._root
+        for level in topic_filter.split("/"):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = _Node()
+            node = child
+        node.values.append(value)
+        self._count += 1
+
+    def remove(self, topic_filter: str, value: V) -> bool:
+        """Удаление значения. Пустые ветви дерева удаляются. False, если значения нет."""
+
+        path = [self._root]
+        for level in topic_filter.split("/"):
+            child = path[-1].children.get(level)
+            if child is None:
+                return False
+            path.append(child)
+
+        try:
+            path[-1].values.remove(value)
+        except ValueError:
+            return False
+        self._count -= 1
+
+        levels = topic_filter.split("/")
+        for index in range(len(levels), 0, -1):
+            node = path[index]
+            if node.values or node.children:
+                break
+            del path[index - 1].children[levels[index - 1]]
+        return True
+
+    def match(self, topic: str) -> List[V]:
+        """Значения всех фильтров, которым соответствует топик"""
+
+        levels = topic.split("/")
+        # Подстановочные символы первого уровня не соответствуют служебным топикам ($SYS и т.п.)
+        system = topic.startswith("$")
+        found: List[V] = []
+        nodes = [self._root]
+
+        for depth, level in enumerate(levels):
+            next_nodes = []
+            for node in nodes:
+                wildcards = not (system and depth == 0)
+                if wildcards:
+                    rest = node.children.get(MULTI_LEVEL)
+                    if rest is not None:
+                        found.extend(rest.values)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+                if wildcards:
+                    child = node.children.get(SINGLE_LEVEL)
+                    if child is not None:
+                        next_nodes.append(child)
+            if not next_nodes:
+                return found
+            nodes = next_nodes
+
+        for node in nodes:
+            found.extend(node.values)
+            # "a/#" соответствует и топику "a"
+            rest = node.children.get(MULTI_LEVEL)
+            if rest is not None:
+                found.extend(rest.values)
+        return found
+
+    def __len__(self) -> int:
+        return self._count
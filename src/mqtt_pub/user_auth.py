@@ -3,7 +3,7 @@
 """
 
 import hmac
-from .config import registered_users  # pylint: disable = import-error
+from . import config  # pylint: disable = import-error
 
 
 def client_authenticate(client_user: str, received_token_hash: str) -> bool:
@@ -27,10 +27,11 @@ def get_password_hash(client_user: str) -> str:
     Если пользователь не зарегистрирован, то возвращается пустая строка.
     """
 
-    if registered_users.get(client_user) is None:
-        return ""
+    # Ссылка на словарь читается один раз: при перезагрузке он заменяется целиком
+    users = config.context.registered_users
+    password_hash = users.get(client_user)
 
-    return registered_users[client_user]
+    return "" if password_hash is None else password_hash
 
 
 def get_salt_from_hash(client_user: str) -> str:
@@ -0,0 +1,54 @@
+"""Общие фикстуры тестов"""
+import asyncio
+import threading
+import pytest
+from benchmarks.fake_broker import FakeBroker  # type: ignore
+from src.mqtt_pub.mqtt_pool import close_pools  # type: ignore
+from src.mqtt_pub.reply_dispatcher import close_dispatchers  # type: ignore
+
+
+class BrokerThread:
+    """FakeBroker в цикле событий фонового потока"""
+
+    def __init__(self, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.broker = FakeBroker(**kwargs)
+        self.call(self.broker.start())
+
+    def call(self, coroutine):
+        """Выполнение корутины в цикле брокера"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(5)
+
+    def publish(self, topic: str, payload: bytes):
+        """Публикация сообщения от имени устройства"""
+        self.loop.call_soon_threadsafe(self.broker.route, topic, payload)
+
+    def settings(self) -> dict:
+        """Настройки публикации для подключения к брокеру"""
+
+        return {"broker_settings": {"host": "127.0.0.1", "port": self.broker.port, "keepalive": 60},
+                "broker_use_tls": False,
+                "pool": {"size": 1, "reconnect_min_delay": 1, "reconnect_max_delay": 1,
+                         "connect_timeout": 5.0},
+                "reply_topic_filters": ["+/+/out/info"]}
+
+    def close(self):
+        """Остановка брокера и цикла событий"""
+
+        self.call(self.broker.stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.loop.close()
+
+
+@pytest.fixture
+def broker():
+    """Локальный брокер; подключения к нему закрываются после теста"""
+
+    broker_thread = BrokerThread()
+    yield broker_thread
+    close_dispatchers()
+    close_pools()
+    broker_thread.close()
@@ -0,0 +1,44 @@
+"""Тестирование перезагрузки настроек (config_watcher.py)"""
+import json
+from src.mqtt_pub import config  # type: ignore
+from src.mqtt_pub.config_watcher import ConfigWatcher  # type: ignore
+from src.mqtt_pub.session import get_session_manager  # type: ignore
+from src.mqtt_pub.user_auth import client_authenticate  # type: ignore
+
+PASSWORD_HASH = "a" * 64 + "b" * 64
+
+
+def test_reload_users(tmp_path, monkeypatch):
+    """Новый список пользователей применяется, токены удаленных пользователей не действуют"""
+
+    users_file = tmp_path / "users.json"
+    users_file.write_text(json.dumps({"alice": PASSWORD_HASH}), encoding="utf-8")
+    monkeypatch.setattr(config, "REGISTERED_USERS_PATH", str(users_file))
+    monkeypatch.setattr(config.context, "registered_users", {})
+
+    settings_to_publish = config.get_settings_to_publish()
+    watcher = ConfigWatcher(settings_to_publish, 1)
+    assert watcher.reload_users()
+    assert client_authenticate("alice", PASSWORD_HASH)
+
+    sessions = get_session_manager(settings_to_publish["session"])
+    token = sessions.issue("alice")
+    assert sessions.validate(token) == "alice"
+
+    users_file.write_text(json.dumps({}), encoding="utf-8")
+    assert watcher.reload_users()
+    assert not client_authenticate("alice", PASSWORD_HASH)
+    assert sessions.validate(token) is None
+
+
+def test_reload_users_keeps_old_on_error(tmp_path, monkeypatch):
+    """Файл с ошибкой не заменяет текущий список пользователей"""
+
+    users_file = tmp_path / "users.json"
+    users_file.write_text("{", encoding="utf-8")
+    monkeypatch.setattr(config, "REGISTERED_USERS_PATH", str(users_file))
+    monkeypatch.setattr(config.context, "registered_users", {"alice": PASSWORD_HASH})
+
+    watcher = ConfigWatcher(config.get_settings_to_publish(), 1)
+    assert not watcher.reload_users()
+    assert client_authenticate("alice", PASSWORD_HASH)
@@ -0,0 +1,51 @@
+"""Тестирование фоновой записи логов (event_logger.py)"""
+import logging
+import queue
+from src.mqtt_pub.event_logger import (LOG_DROPPED,  # type: ignore
+                                       BatchingQueueListener, DroppingQueueHandler)
+
+
+class BrokenHandler(logging.Handler):
+    """Обработчик, который запоминает записи, но не может сбросить их на диск"""
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.errors = 0
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+    def flush(self):
+        raise ValueError("I/O operation on closed file.")
+
+    def handleError(self, record):
+        self.errors += 1
+
+
+def test_listener_survives_handler_errors():
+    """Ошибка сброса файла не останавливает фоновый поток"""
+
+    records: queue.Queue = queue.Queue()
+    handler = BrokenHandler()
+    listener = BatchingQueueListener(records, [handler], batch_size=1)
+    listener.start()
+    for index in range(3):
+        records.put(logging.makeLogRecord({"msg": f"запись {index}", "levelno": logging.INFO}))
+    listener.stop()
+
+    assert handler.messages == ["запись 0", "запись 1", "запись 2"]
+    assert handler.errors >= 3
+
+
+def test_full_queue_drops_records():
+    """Записи сверх размера очереди отбрасываются и учитываются в метрике"""
+
+    records: queue.Queue = queue.Queue(2)
+    handler = DroppingQueueHandler(records, "test")
+    dropped = LOG_DROPPED.value(kind="test")
+    for index in range(5):
+        handler.handle(logging.makeLogRecord({"msg": str(index), "levelno": logging.INFO}))
+
+    assert records.qsize() == 2
+    assert LOG_DROPPED.value(kind="test") - dropped == 3
@@ -0,0 +1,55 @@
+"""Тестирование разбиения потока на сообщения в framing.py"""
+import asyncio
+import pytest  # type: ignore
+from src.mqtt_pub.framing import (FRAMING_LENGTH, FRAMING_NDJSON, FRAMING_AUTO,  # type: ignore
+                                  FRAMING_LEGACY, FrameError, detect_framing,
+                                  encode_frame, read_frame)
+
+
+def _reader(data: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+async def _read_all(data: bytes, framing: str, max_size: int = 1024) -> list:
+    reader = _reader(data)
+    framing, prefix = await detect_framing(reader, framing)
+    frames = []
+    while True:
+        frame = await read_frame(reader, framing, max_size, prefix)
+        prefix = b""
+        if frame is None:
+            return frames
+        frames.append(frame)
+
+
+@pytest.mark.parametrize("framing", [FRAMING_LENGTH, FRAMING_NDJSON])
+def test_pipelined_frames(framing):
+    """Несколько сообщений в одном потоке читаются по отдельности"""
+
+    messages = [b'{"id": 1}', b'{"id": 2}', b"x" * 2000]
+    data = b"".join(encode_frame(message, framing) for message in messages)
+
+    assert asyncio.run(_read_all(data, framing, max_size=4096)) == messages
+
+
+def test_auto_detects_length_prefix():
+    """В режиме auto кадры с префиксом длины и старые клиенты различаются по первому байту"""
+
+    assert asyncio.run(_read_all(encode_frame(b"{}", FRAMING_LENGTH), FRAMING_AUTO)) == [b"{}"]
+    assert asyncio.run(_read_all(b'{"a": 1}', FRAMING_AUTO)) == [b'{"a": 1}']
+
+
+def test_legacy_single_read():
+    """Старый режим: сообщение без разделителей"""
+
+    assert asyncio.run(_read_all(b'{"a": 1}', FRAMING_LEGACY)) == [b'{"a": 1}']
+
+
+def test_frame_too_large():
+    """Сообщение больше max_size отклоняется"""
+
+    with pytest.raises(FrameError):
+        asyncio.run(_read_all(encode_frame(b"x" * 100, FRAMING_LENGTH), FRAMING_LENGTH, max_size=10))
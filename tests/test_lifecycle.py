@@ -0,0 +1,52 @@
+"""Тестирование плавной остановки и передачи сокета (lifecycle.py)"""
+import asyncio
+import os
+import socket
+from src.mqtt_pub import lifecycle  # type: ignore
+
+
+def test_drain_tasks_cancels_unfinished():
+    """Завершившиеся вовремя задачи не отменяются, остальные отменяются по истечении времени"""
+
+    async def scenario():
+        quick = asyncio.create_task(asyncio.sleep(0.01))
+        slow = asyncio.create_task(asyncio.sleep(10))
+        cancelled = await lifecycle.drain_tasks({quick, slow}, 0.2)
+        return cancelled, quick, slow
+
+    cancelled, quick, slow = asyncio.run(scenario())
+    assert cancelled == 1
+    assert not quick.cancelled()
+    assert slow.cancelled()
+
+
+def test_inherited_socket(monkeypatch):
+    """Сокет, переданный предыдущим процессом, принимает подключения; переменная окружения удаляется"""
+
+    listener = socket.create_server(("127.0.0.1", 0))
+    monkeypatch.setenv(lifecycle.LISTEN_FD_ENV, str(os.dup(listener.fileno())))
+    port = listener.getsockname()[1]
+    listener.close()
+
+    sock = lifecycle.inherited_socket()
+    assert lifecycle.LISTEN_FD_ENV not in os.environ
+    with sock, socket.create_connection(("127.0.0.1", port)):
+        connection, _ = sock.accept()
+        connection.close()
+
+    assert lifecycle.inherited_socket() is None
+
+
+def test_notify_predecessor_only_parent(monkeypatch):
+    """SIGTERM отправляется только родительскому процессу"""
+
+    sent = []
+    monkeypatch.setattr(os, "kill", lambda pid, signum: sent.append(pid))
+
+    monkeypatch.setenv(lifecycle.HANDOFF_PID_ENV, str(os.getpid()))
+    lifecycle.notify_predecessor()
+    monkeypatch.setenv(lifecycle.HANDOFF_PID_ENV, str(os.getppid()))
+    lifecycle.notify_predecessor()
+
+    assert sent == [os.getppid()]
+    assert lifecycle.HANDOFF_PID_ENV not in os.environ
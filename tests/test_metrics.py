@@ -0,0 +1,35 @@
+"""Тестирование реестра метрик metrics.py"""
+from src.mqtt_pub.metrics import Counter, Gauge, Histogram, Registry  # type: ignore
+
+
+def test_render_prometheus_text():
+    """Метрики выводятся в текстовом формате Prometheus"""
+
+    registry = Registry()
+    requests = registry.register(Counter("test_requests_total", "Requests", ["kind"]))
+    depth = registry.register(Gauge("test_depth", "Depth"))
+    requests.inc(kind="publish")
+    requests.inc(2, kind="publish")
+    depth.set_function(lambda: 7)
+
+    text = registry.render()
+
+    assert "# TYPE test_requests_total counter" in text
+    assert 'test_requests_total{kind="publish"} 3' in text
+    assert "test_depth 7" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    """Корзины гистограммы накопительные, последняя равна количеству наблюдений"""
+
+    latency = Histogram("test_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+
+    samples = latency.samples()
+
+    assert 'test_seconds_bucket{le="0.1"} 1' in samples
+    assert 'test_seconds_bucket{le="1.0"} 2' in samples
+    assert 'test_seconds_bucket{le="+Inf"} 3' in samples
+    assert "test_seconds_count 3" in samples
+    assert latency.count() == 3
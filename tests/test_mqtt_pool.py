@@ -0,0 +1,58 @@
+"""Тестирование пула подключений к брокеру (mqtt_pool.py)"""
+from time import monotonic, sleep
+import pytest
+from src.mqtt_pub.mqtt_pool import MQTTConnectionError, MqttClientPool, get_pool  # type: ignore
+from src.mqtt_pub.mqtt_writer import publish_batch, publish_to_mqtt  # type: ignore
+
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    deadline = monotonic() + timeout
+    while not condition() and monotonic() < deadline:
+        sleep(0.01)
+    return condition()
+
+
+def test_reconnect_after_broker_restart(broker):
+    """После перезапуска брокера клиенты пула подключаются заново и снова публикуют сообщения"""
+
+    pool = MqttClientPool(broker.settings())
+    try:
+        with pool.connection() as client:
+            client.publish("user/lamp/in/setup", b"1", qos=1).wait_for_publish(5)
+        assert wait_until(lambda: broker.broker.published == 1)
+
+        broker.call(broker.broker.stop())
+        assert wait_until(lambda: pool.health()["connected"] == 0)
+        with pytest.raises(MQTTConnectionError):
+            with pool.connection(timeout=0.1):
+                pass
+
+        broker.call(broker.broker.start())
+        with pool.connection() as client:
+            client.publish("user/lamp/in/setup", b"2", qos=1).wait_for_publish(5)
+        assert wait_until(lambda: broker.broker.published == 2)
+
+        health = pool.health()
+        assert (health["connected"], health["idle"], health["reconnects"]) == (1, 1, 1)
+        assert health["disconnects"] == 1 and health["last_errors"]
+    finally:
+        pool.close()
+
+
+def test_unacknowledged_publish_times_out(broker):
+    """Подтверждение публикации ожидается не дольше connect_timeout, затем клиент переподключается"""
+
+    settings = broker.settings()
+    settings["pool"]["connect_timeout"] = 0.3
+    assert publish_to_mqtt(("user/lamp/in/setup", "1", 1), settings)
+
+    broker.broker.acknowledge = False
+    started = monotonic()
+    assert not publish_to_mqtt(("user/lamp/in/setup", "2", 1), settings)
+    assert publish_batch([("user/lamp/in/setup", "3", 1)], settings) == [False]
+    assert monotonic() - started < 2
+
+    broker.broker.acknowledge = True
+    health = get_pool(settings).health
+    assert wait_until(lambda: health()["disconnects"] >= 1 and health()["connected"] == 1)
+    assert publish_to_mqtt(("user/lamp/in/setup", "4", 1), settings)
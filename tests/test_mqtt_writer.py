@@ -0,0 +1,106 @@
+"""Тестирование параметров публикации (mqtt_writer.py, mqtt_pool.py)"""
+import asyncio
+from time import monotonic, sleep
+import paho.mqtt.client as mqtt
+from src.mqtt_pub import message_listener  # type: ignore
+from src.mqtt_pub.mqtt_pool import DEFAULT_POOL_SETTINGS, PooledClient, close_pools  # type: ignore
+from src.mqtt_pub.mqtt_writer import (TIMEOUT_ANSWER, publish_batch,  # type: ignore
+                                      publish_options, read_from_mqtt)
+from src.mqtt_pub.reply_dispatcher import get_dispatcher  # type: ignore
+from src.mqtt_pub.routing import close_routers  # type: ignore
+from .conftest import BrokerThread
+
+
+def test_publish_options():
+    """Значения из сообщения, затем первое подходящее правило topic_qos, затем настройки"""
+
+    settings = {"publish": {"qos": 1, "retain": False,
+                            "topic_qos": [("+/+/in/setup", 2), ("user/#", 0)]}}
+    assert publish_options(settings, "user/lamp/in/setup") == (2, False)
+    assert publish_options(settings, "user/lamp/in/params") == (0, False)
+    assert publish_options(settings, "other/lamp") == (1, False)
+    assert publish_options(settings, "user/lamp/in/setup", 1, True) == (1, True)
+
+
+def test_delivery_confirmed_before_publish_returns():
+    """Подтверждение, полученное сетевым потоком до возврата из client.publish, не теряется"""
+
+    pooled = PooledClient({}, DEFAULT_POOL_SETTINGS)
+    info = mqtt.MQTTMessageInfo(7)
+    info.rc = mqtt.MQTT_ERR_SUCCESS
+
+    def publish(topic, payload, qos, retain):  # pylint: disable = unused-argument
+        pooled._on_publish(pooled.client, None, info.mid)  # pylint: disable = protected-access
+        return info
+
+    pooled.client.publish = publish
+    results = []
+    pooled.publish("a/b", b"on", qos=1, on_delivered=results.append)
+    assert results == [True]
+
+    info.rc = mqtt.MQTT_ERR_QUEUE_SIZE
+    pooled.client.publish = lambda *args, **kwargs: info
+    pooled.publish("a/b", b"on", qos=1, on_delivered=results.append)
+    assert results == [True, False]
+
+
+def test_batch_results_in_order(broker):
+    """Пакет распределяется по брокерам топиков, результаты возвращаются в порядке сообщений"""
+
+    other = BrokerThread()
+    settings = {**broker.settings(), "batch_window": 2,
+                "routing": {"routes": [("site2/#", [("127.0.0.1", other.broker.port)])],
+                            "standby": [], "health_interval": 0,
+                            "health_timeout": 1.0, "health_failures": 2}}
+    try:
+        # Топики с подстановочными символами paho не публикует
+        reports = [("site1/a", "1"), ("site2/a", "2", 2), ("site1/+", "3"), ("site2/b", "4", 0),
+                   ("site1/b", "5"), ("site2/#", "6"), ("site1/c", "7", 0, True)]
+        assert publish_batch(reports, settings) == [True, True, False, True, True, False, True]
+        # Сообщения QoS 0 брокер мог еще не получить
+        deadline = monotonic() + 5
+        while (broker.broker.published, other.broker.published) != (3, 2) and monotonic() < deadline:
+            sleep(0.01)
+        assert (broker.broker.published, other.broker.published) == (3, 2)
+    finally:
+        close_routers()
+        close_pools()
+        other.close()
+
+
+def test_reply_awaited_without_thread(broker, monkeypatch):
+    """Ответ устройства ожидается в цикле событий; по таймауту ожидание удаляется из подписчика"""
+
+    settings = broker.settings()
+    broker.broker.reply_delay = 0.05
+
+    async def request(topic: str) -> list:
+        answers = [read_from_mqtt(settings, "ping", topic + "/in/params", topic + "/out/info")
+                   for _ in range(2)]
+        assert not any(answer.done() for answer in answers)
+        return await asyncio.gather(*map(message_listener.device_answer, answers))
+
+    assert asyncio.run(request("user/lamp")) == ["pong", "pong"]
+
+    broker.broker.reply_delay = None
+    monkeypatch.setattr(message_listener, "TIMEOUT_WAIT_MQTT", 0.1)
+    assert asyncio.run(request("user/fan")) == [TIMEOUT_ANSWER, TIMEOUT_ANSWER]
+    assert get_dispatcher(settings).stats()[0] == 0
+
+
+def test_unhashable_messages(broker):
+    """Запросы с объектом JSON и памятью кадра объединяются по данным сообщения"""
+
+    settings = broker.settings()
+    broker.broker.reply_delay = 0.05
+    frame = bytearray(b"\x00{}")
+
+    async def request() -> list:
+        answers = [read_from_mqtt(settings, {}, "user/lamp/in/params", "user/lamp/out/info"),
+                   read_from_mqtt(settings, memoryview(frame)[1:], "user/lamp/in/params",
+                                  "user/lamp/out/info")]
+        return await asyncio.gather(*map(message_listener.device_answer, answers))
+
+    assert asyncio.run(request()) == ["pong", "pong"]
+    # Одна публикация запроса и ответ устройства
+    assert broker.broker.published == 2
@@ -0,0 +1,152 @@
+"""Тестирование очереди исходящих сообщений (outbound_queue.py)"""
+import json
+import threading
+from time import monotonic, sleep
+from src.mqtt_pub import outbound_queue  # type: ignore
+from src.mqtt_pub.outbound_queue import OutboundQueue  # type: ignore
+
+
+def make_settings(tmp_path, **spool) -> dict:
+    return {"spool": {"path": str(tmp_path / "outbound.db"), "max_messages": 100,
+                      "max_bytes": 1024 * 1024, "overflow_policy": "reject",
+                      "batch_size": 100, "retry_delay": 0.1, **spool}}
+
+
+def payloads(outbound: OutboundQueue) -> list:
+    return [payload for _, _, payload, *_ in outbound._fetch()]  # pylint: disable = protected-access
+
+
+def test_message_values(tmp_path):
+    """Значения JSON поля message сохраняются так же, как при публикации без очереди"""
+
+    outbound = OutboundQueue(make_settings(tmp_path))
+    for message in ("текст", b"\x00\x01", 5, {"a": [1, 2]}, None):
+        assert outbound.put("user/lamp/in/params", message)
+
+    text, binary, number, value, empty = payloads(outbound)
+    assert (text, binary, number, empty) == ("текст".encode(), b"\x00\x01", b"5", b"")
+    assert json.loads(value) == {"a": [1, 2]}
+    outbound.close()
+
+
+def test_overflow_policies(tmp_path):
+    """reject - новое сообщение не принимается, drop_oldest - удаляются самые старые"""
+
+    rejecting = OutboundQueue(make_settings(tmp_path / "reject", max_messages=2))
+    assert rejecting.put("t", "1") and rejecting.put("t", "2")
+    assert not rejecting.put("t", "3")
+    assert payloads(rejecting) == [b"1", b"2"]
+    assert rejecting.rejected == 1
+    rejecting.close()
+
+    dropping = OutboundQueue(make_settings(tmp_path / "drop", max_messages=2,
+                                           overflow_policy="drop_oldest"))
+    for message in ("1", "2", "3"):
+        assert dropping.put("t", message)
+    assert payloads(dropping) == [b"2", b"3"]
+    assert (dropping.depth, dropping.dropped) == (2, 1)
+    dropping.close()
+
+
+def test_messages_survive_restart(tmp_path):
+    """Неотправленные сообщения остаются в очереди после перезапуска"""
+
+    settings = make_settings(tmp_path)
+    outbound = OutboundQueue(settings)
+    outbound.put("user/lamp/in/params", "1", qos=2, retain=True)
+    outbound.put("user/lamp/in/params", "2")
+    outbound.close()
+
+    restarted = OutboundQueue(settings)
+    assert (restarted.depth, restarted.size) == (2, 2)
+    rows = restarted._fetch()  # pylint: disable = protected-access
+    assert [(topic, payload, qos, retain) for _, topic, payload, _, qos, retain in rows] == [
+        ("user/lamp/in/params", b"1", 2, 1), ("user/lamp/in/params", b"2", None, None)]
+    restarted.close()
+
+
+def test_close_during_publish(tmp_path, monkeypatch):
+    """Сообщения, доставленные после истечения времени остановки, удаляются из очереди"""
+
+    started, release = threading.Event(), threading.Event()
+
+    def publish_batch(reports, settings):  # pylint: disable = unused-argument
+        started.set()
+        release.wait(5)
+        return [True] * len(reports)
+
+    monkeypatch.setattr(outbound_queue, "publish_batch", publish_batch)
+    settings = make_settings(tmp_path)
+    outbound = OutboundQueue(settings)
+    outbound.put("user/lamp/in/params", "1")
+    outbound.start()
+    assert started.wait(5)
+
+    outbound.close(timeout=0.05)
+    release.set()
+    outbound._drainer.join(5)  # pylint: disable = protected-access
+
+    assert OutboundQueue(settings).depth == 0
+
+
+def test_one_drainer_per_spool(tmp_path, monkeypatch):
+    """
+    Старый и новый процесс одного индекса (плавный перезапуск) открывают одну очередь:
+    сообщения отправляет только владелец блокировки, новый процесс - после остановки старого.
+    """
+
+    published = []
+
+    def publish_batch(reports, settings):  # pylint: disable = unused-argument
+        published.extend(payload for _, payload, *_ in reports)
+        return [True] * len(reports)
+
+    def wait_until(condition) -> bool:
+        deadline = monotonic() + 5
+        while not condition() and monotonic() < deadline:
+            sleep(0.01)
+        return condition()
+
+    monkeypatch.setattr(outbound_queue, "publish_batch", publish_batch)
+    settings = make_settings(tmp_path)
+    old = OutboundQueue(settings)
+    old.start()
+    old.put("user/lamp/in/setup", "1")
+    assert wait_until(lambda: published == [b"1"])
+
+    new = OutboundQueue(settings)
+    new.start()
+    assert wait_until(lambda: new.retrying)
+    new.put("user/lamp/in/setup", "2")
+    sleep(0.3)
+    assert published == [b"1"]
+
+    old.close()
+    assert wait_until(lambda: published == [b"1", b"2"])
+    assert wait_until(lambda: new.depth == 0)
+    new.close()
+    assert published == [b"1", b"2"]
+
+
+def test_drainer_survives_errors(tmp_path, monkeypatch):
+    """После неожиданной ошибки отправки очередь продолжает отправлять сообщения"""
+
+    calls = []
+    sent = threading.Event()
+
+    def publish_batch(reports, settings):  # pylint: disable = unused-argument
+        calls.append(len(reports))
+        if len(calls) == 1:
+            raise RuntimeError("broken")
+        sent.set()
+        return [True] * len(reports)
+
+    monkeypatch.setattr(outbound_queue, "publish_batch", publish_batch)
+    outbound = OutboundQueue(make_settings(tmp_path))
+    outbound.put("user/lamp/in/params", "1")
+    outbound.start()
+
+    assert sent.wait(5)
+    assert outbound._drainer.is_alive()  # pylint: disable = protected-access
+    outbound.close()
+    assert (len(calls), outbound.depth) == (2, 0)
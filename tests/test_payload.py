@@ -0,0 +1,71 @@
+"""Тестирование кодирования и сжатия сообщений (payload.py)"""
+import base64
+import zlib
+import pytest
+from src.mqtt_pub import payload  # type: ignore
+from src.mqtt_pub.protocol import parse_request  # type: ignore
+
+
+def test_codec_round_trip():
+    """Данные клиента в base64 и binary со сжатием и без него возвращаются без изменений"""
+
+    data = bytes(range(256)) * 8
+    packed = base64.b64encode(zlib.compress(data)).decode()
+    assert payload.decode_message(packed, "base64", "zlib") == data
+    assert payload.decode_message(memoryview(data), "binary", None) == data
+    assert payload.decode_message("текст", None, None) == "текст"
+
+    answer = payload.encode_answer(data, "base64", "zlib")
+    assert zlib.decompress(base64.b64decode(answer)) == data
+    assert payload.encode_answer(data, "binary", None) == data
+    assert payload.encode_answer(b"\xff", "text", None) == "�"
+
+
+def test_size_limit():
+    """Данные больше max_size не принимаются, в том числе после распаковки"""
+
+    bomb = zlib.compress(b"\x00" * 100_000)
+    with pytest.raises(payload.PayloadError):
+        payload.decode_message(memoryview(bomb), "binary", "zlib", max_size=1000)
+    with pytest.raises(payload.PayloadError):
+        payload.decode_message(memoryview(b"x" * 1001), "binary", None, max_size=1000)
+    with pytest.raises(payload.PayloadError):
+        payload.decode_message("не base64!", "base64", None)
+
+    assert payload.check_codec("text", "zlib") is not None
+    assert payload.check_codec("hex", None) is not None
+    assert payload.check_codec("binary", "zlib") is None
+
+
+def test_split_binary_frame():
+    """JSON и двоичные данные кадра разделяются первым байтом 0x00"""
+
+    header, data = payload.split_binary_frame(b'{"id":1}\x00a\x00b')
+    assert header == b'{"id":1}'
+    assert bytes(data) == b"a\x00b"
+    assert payload.split_binary_frame(b'{"id":1}') == (b'{"id":1}', None)
+
+
+def test_broker_compression():
+    """Сжимаются только сообщения из compression.topics не меньше min_size"""
+
+    settings = {"compression": {"method": "zlib", "level": None, "min_size": 10,
+                                "topics": ["+/+/in/firmware"], "max_size": 1000}}
+    message = "x" * 100
+    compressed = payload.to_broker(settings, "user/lamp/in/firmware", message)
+    assert zlib.decompress(compressed) == message.encode()
+    assert payload.to_broker(settings, "user/lamp/in/params", message) == message
+    assert payload.to_broker(settings, "user/lamp/in/firmware", "short") == "short"
+
+    assert payload.from_broker(settings, "user/lamp/in/firmware", compressed) == message.encode()
+    assert payload.from_broker(settings, "user/lamp/in/firmware", b"raw") == b"raw"
+
+
+def test_request_codec_fields():
+    """Поля encoding и compression переносятся в запрос и проверяются"""
+
+    request = parse_request({"token": "t", "topic": "user/lamp/in/firmware", "message": "AA==",
+                             "encoding": "base64", "compression": "zlib"})
+    assert (request.encoding, request.compression) == ("base64", "zlib")
+    assert parse_request({"token": "t", "topic": "user/lamp", "message": "x",
+                          "encoding": 1}) is None
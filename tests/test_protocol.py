@@ -0,0 +1,56 @@
+"""Тестирование разбора входящих сообщений (protocol.py)"""
+import pytest  # type: ignore
+from src.mqtt_pub.protocol import (KIND_ACTION, KIND_BATCH, KIND_PUBLISH,  # type: ignore
+                                   KIND_STREAM, dumps, loads, parse_request)
+
+PASSWORD_HASH = "a" * 64 + "b" * 64
+
+
+@pytest.mark.parametrize("message, kind", [
+    ({"message": "/get_salt", "user": "alice"}, KIND_ACTION),
+    ({"message": "/login", "user": "alice", "password": PASSWORD_HASH}, KIND_ACTION),
+    ({"message": "/logout", "token": "t"}, KIND_ACTION),
+    ({"message": "/get_salt", "topic": "/a/b/in", "user": "alice", "password": "p"}, KIND_ACTION),
+    ({"message": "/check_auth", "topic": "/a/b/in", "user": "alice", "password": PASSWORD_HASH},
+     KIND_ACTION),
+    ({"message": "on", "topic": "/a/b/in", "user": "alice", "password": PASSWORD_HASH},
+     KIND_PUBLISH),
+    ({"message": "on", "topic": "/a/b/in", "token": "t"}, KIND_PUBLISH),
+    ({"batch": [{"topic": "/a/b/in", "message": 1}], "token": "t"}, KIND_BATCH),
+    ({"message": "/subscribe", "topic": "/alice/+/out/info", "token": "t"}, KIND_STREAM),
+    ({"message": ["/subscribe"], "topic": "/a/b/in", "token": "t"}, KIND_PUBLISH),
+    ({"message": "on", "topic": "/a/b/in", "token": "t", "qos": 2, "retain": True}, KIND_PUBLISH),
+])
+def test_correct_message(message, kind):
+    """Сообщения с необходимыми полями"""
+
+    request = parse_request(loads(dumps(message)))
+    assert request is not None and request.kind == kind
+
+
+@pytest.mark.parametrize("message", [
+    [],
+    {"message": "/check_auth", "user": "alice"},
+    {"message": "/get_salt", "user": 1},
+    {"message": "on", "topic": 5, "token": "t"},
+    {"message": "on", "topic": "/a", "token": "t", "extra": 1},
+    {"batch": [], "token": "t"},
+    {"batch": [{"topic": "/a"}], "token": "t"},
+    {"message": "on", "topic": "/a", "token": "t", "qos": 3},
+    {"message": "on", "topic": "/a", "token": "t", "qos": True},
+    {"message": "on", "topic": "/a", "token": "t", "retain": 1},
+    {"batch": [{"topic": "/a", "message": 1, "qos": "1"}], "token": "t"},
+])
+def test_incorrect_message(message):
+    """Сообщения без необходимых полей или с неверными типами"""
+    assert parse_request(message) is None
+
+
+def test_batch_options():
+    """qos и retain пакета действуют для сообщений, в которых они не заданы"""
+
+    request = parse_request({"batch": [{"topic": "/a", "message": 1},
+                                       {"topic": "/b", "message": 2, "qos": 0}],
+                             "token": "t", "qos": 2})
+    assert request is not None
+    assert request.batch == [("/a", 1, 2, None), ("/b", 2, 0, None)]
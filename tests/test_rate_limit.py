@@ -0,0 +1,60 @@
+"""Тестирование ограничения нагрузки (rate_limit.py)"""
+from src.mqtt_pub.rate_limit import (LIMIT_TOO_LARGE, LIMIT_TOPIC,  # type: ignore
+                                     LIMIT_USER, RateLimiter)
+
+LIMITS = {"user_rate": 0, "user_burst": 0, "topic_rate": 0, "topic_burst": 0,
+          "topic_levels": 2, "max_pending_replies": 0}
+
+
+def test_user_limit():
+    """Пользователь получает отказ после burst сообщений, другие пользователи нет"""
+
+    limiter = RateLimiter(dict(LIMITS, user_rate=0.001, user_burst=3))
+    assert [limiter.allow("alice", ["/alice/a/in"]) for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow("bob", ["/bob/a/in"])
+    assert not limiter.allow("bob", ["/bob/a/in"] * 3)
+
+
+def test_topic_limit():
+    """Ограничение действует на префикс топика"""
+
+    limiter = RateLimiter(dict(LIMITS, topic_rate=0.001, topic_burst=1))
+    assert limiter.topic_prefix("/alice/lamp/in/params") == "alice/lamp"
+    assert limiter.allow("alice", ["/alice/lamp/in/params"])
+    assert not limiter.allow("alice", ["alice/lamp/in/setup"])
+    assert limiter.allow("alice", ["/alice/fan/in/params"])
+
+
+def test_pending_replies():
+    """Ожидания ответа сверх max_pending_replies отклоняются"""
+
+    limiter = RateLimiter(dict(LIMITS, max_pending_replies=1))
+    with limiter.reply_slot() as first:
+        with limiter.reply_slot() as second:
+            assert first and not second
+    with limiter.reply_slot() as third:
+        assert third
+
+
+def test_nothing_taken_on_refusal():
+    """Отказ по префиксу топика не расходует лимит пользователя и других префиксов"""
+
+    limiter = RateLimiter(dict(LIMITS, user_rate=0.001, user_burst=3,
+                               topic_rate=0.001, topic_burst=1))
+    assert limiter.check("alice", ["/alice/lamp/in"]) is None
+    assert limiter.check("alice", ["/alice/fan/in", "/alice/lamp/in"]) == LIMIT_TOPIC
+    assert limiter.check("alice", ["/alice/fan/in"]) is None
+    assert limiter.check("alice", ["/alice/heater/in"]) is None
+    assert limiter.check("alice", ["/alice/pump/in"]) == LIMIT_USER
+
+
+def test_too_large_request():
+    """Запрос больше burst отклоняется сразу, не расходуя лимит; вход стоит одно сообщение"""
+
+    limiter = RateLimiter(dict(LIMITS, user_rate=0.001, user_burst=3,
+                               topic_rate=0.001, topic_burst=2))
+    assert limiter.check("alice", [f"/alice/d{index}/in" for index in range(4)]) == LIMIT_TOO_LARGE
+    assert limiter.check("alice", ["/alice/lamp/in"] * 3) == LIMIT_TOO_LARGE
+    assert limiter.check("alice", ["/alice/lamp/in", "/alice/fan/in"]) is None
+    assert limiter.allow("alice", [])
+    assert not limiter.allow("alice", [])
@@ -0,0 +1,78 @@
+"""Тестирование объединения одинаковых запросов (reply_cache.py)"""
+from concurrent.futures import Future
+from src.mqtt_pub.reply_cache import COALESCED_REQUESTS, ReplyCache  # type: ignore
+
+
+def completed(answer: str) -> Future:
+    future: Future = Future()
+    future.set_result(answer)
+    return future
+
+
+def test_identical_requests_share_one_fetch():
+    """Одновременные одинаковые запросы выполняются один раз"""
+
+    cache = ReplyCache({"ttl": 0, "size": 0})
+    calls = []
+    fetched: Future = Future()
+    coalesced = COALESCED_REQUESTS.value()
+
+    def fetch():
+        calls.append(1)
+        return fetched
+
+    answers = [cache.request("key", fetch) for _ in range(8)]
+    assert COALESCED_REQUESTS.value() - coalesced == 7
+    assert not any(answer.done() for answer in answers)
+
+    fetched.set_result("answer")
+    assert [answer.result(0) for answer in answers] == ["answer"] * 8
+    assert len(calls) == 1
+    assert cache.request("key", lambda: completed("new")).result(0) == "new"
+
+
+def test_cancelled_waiters():
+    """Отмена ожидания одного клиента не затрагивает остальных, запрос без клиентов отменяется"""
+
+    cache = ReplyCache({"ttl": 0, "size": 0})
+    fetched: Future = Future()
+    first, second = cache.request("key", lambda: fetched), cache.request("key", lambda: fetched)
+
+    first.cancel()
+    assert not fetched.cancelled() and not second.done()
+    second.cancel()
+    assert fetched.cancelled()
+
+    # Отмененный запрос не объединяется с новым
+    assert cache.request("key", lambda: completed("new")).result(0) == "new"
+
+
+def test_ttl_cache():
+    """Ответ кэшируется, если ttl больше 0 и ответ подходит для кэша"""
+
+    cache = ReplyCache({"ttl": 60, "size": 1})
+    assert cache.request("a", lambda: completed("first")).result(0) == "first"
+    assert cache.request("a", lambda: completed("second")).result(0) == "first"
+    assert cache.request("b", lambda: completed("timeout"),
+                         cacheable=lambda answer: answer != "timeout").result(0) == "timeout"
+    assert cache.request("b", lambda: completed("late")).result(0) == "late"
+    # size=1: ответ для "a" вытеснен
+    assert cache.request("a", lambda: completed("third")).result(0) == "third"
+
+
+def test_failed_request_fallback():
+    """Если запрос завершился ошибкой, все клиенты получают fallback, ответ не кэшируется"""
+
+    cache = ReplyCache({"ttl": 60, "size": 10})
+    fetched: Future = Future()
+    leader = cache.request("a", lambda: fetched, fallback="timeout")
+    follower = cache.request("a", lambda: completed("unused"), fallback="timeout")
+    fetched.set_exception(RuntimeError("broken"))
+    assert (leader.result(0), follower.result(0)) == ("timeout", "timeout")
+
+    def broken():
+        raise ValueError("broken")
+
+    assert cache.request("b", broken, fallback="timeout").result(0) == "timeout"
+    assert isinstance(cache.request("c", broken).exception(0), ValueError)
+    assert cache.request("a", lambda: completed("answer")).result(0) == "answer"
@@ -0,0 +1,72 @@
+"""Тестирование сопоставления запросов и ответов устройств (reply_dispatcher.py)"""
+from time import monotonic, sleep
+from src.mqtt_pub.reply_dispatcher import ReplyDispatcher  # type: ignore
+
+
+def test_replies_in_request_order(broker):
+    """Ответы топика получают ожидающие запросы в порядке поступления, другие топики не затрагиваются"""
+
+    dispatcher = ReplyDispatcher(broker.settings())
+    try:
+        first = dispatcher.expect("user/lamp/out/info")
+        second = dispatcher.expect("user/lamp/out/info")
+        other = dispatcher.expect("user/fan/out/info")
+
+        broker.publish("user/lamp/out/info", b"1")
+        broker.publish("user/lamp/out/info", b"2")
+        assert first.result(5) == b"1"
+        assert second.result(5) == b"2"
+        assert not other.done()
+        assert dispatcher.stats() == (1, 1)
+    finally:
+        dispatcher.close()
+
+
+def test_cancelled_waiter_skipped(broker):
+    """Отмененное ожидание не получает ответ и не нарушает работу подписчика"""
+
+    dispatcher = ReplyDispatcher(broker.settings())
+    try:
+        cancelled = dispatcher.expect("user/lamp/out/info")
+        waiting = dispatcher.expect("user/lamp/out/info")
+        cancelled.cancel()
+
+        broker.publish("user/lamp/out/info", b"1")
+        assert waiting.result(5) == b"1"
+
+        later = dispatcher.expect("user/lamp/out/info")
+        broker.publish("user/lamp/out/info", b"2")
+        assert later.result(5) == b"2"
+    finally:
+        dispatcher.close()
+
+
+
+def test_topic_subscription_released(broker):
+    """Подписка вне reply_topic_filters отменяется, когда у нее не остается получателей"""
+
+    dispatcher = ReplyDispatcher(broker.settings())
+    try:
+        first = dispatcher.expect("user/lamp/reply")
+        second = dispatcher.expect("user/lamp/reply")
+        def handler(topic, payload):  # pylint: disable = unused-argument
+            pass
+
+        dispatcher.add_handler("user/+/reply", handler)
+        assert dispatcher.stats() == (2, 3)
+
+        broker.publish("user/lamp/reply", b"1")
+        assert first.result(5) == b"1"
+        dispatcher.remove_handler("user/+/reply", handler)
+        assert dispatcher.stats() == (1, 2)
+
+        dispatcher.discard("user/lamp/reply", second)
+        assert dispatcher.stats() == (0, 1)
+
+        session, = broker.broker.sessions
+        deadline = monotonic() + 5
+        while session.filters != {"+/+/out/info"} and monotonic() < deadline:
+            sleep(0.01)
+        assert session.filters == {"+/+/out/info"}
+    finally:
+        dispatcher.close()
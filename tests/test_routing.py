@@ -0,0 +1,53 @@
+"""Тестирование распределения топиков между брокерами (routing.py)"""
+from src.mqtt_pub import routing  # type: ignore
+from src.mqtt_pub.config import parse_broker_routes  # type: ignore
+
+PRIMARY = ("broker-b", 1883)
+STANDBY = ("broker-b2", 1883)
+
+
+def make_settings() -> dict:
+    return {"broker_settings": {"host": "broker-a", "port": 8883, "keepalive": 60},
+            "broker_use_tls": False,
+            "routing": {"routes": parse_broker_routes("site2/#=broker-b:1883|broker-b2", 1883),
+                        "standby": [], "health_interval": 0,
+                        "health_timeout": 1.0, "health_failures": 2}}
+
+
+def test_route_settings():
+    """Топики правила публикуются в брокер группы, остальные - в основной брокер"""
+
+    settings = make_settings()
+    router = routing.BrokerRouter(settings)
+
+    routed = router.settings_for(settings, "site2/lamp/in/params")
+    assert (routed["broker_settings"]["host"], routed["broker_settings"]["port"]) == PRIMARY
+    assert routing.route_settings(routed, "site1/lamp") is routed
+    assert router.settings_for(settings, "site1/lamp")["broker_settings"]["host"] == "broker-a"
+    assert settings["broker_settings"]["host"] == "broker-a"
+
+    assert routing.route_settings({**settings, "routing": {"routes": [], "standby": []}},
+                                  "site2/lamp")["broker_settings"]["host"] == "broker-a"
+
+
+def test_failover_and_failback(monkeypatch):
+    """Группа переключается на резервный брокер после health_failures неудачных проверок и обратно"""
+
+    reachable = {PRIMARY: False, STANDBY: True}
+    released = []
+    monkeypatch.setattr(routing, "probe", lambda address, timeout: reachable[address])
+    router = routing.BrokerRouter(make_settings())
+    monkeypatch.setattr(router, "_release", released.append)
+    group = router.route("site2/lamp")
+
+    router.check()
+    assert group.address == PRIMARY
+    router.check()
+    assert group.address == STANDBY
+    assert released == [{PRIMARY}]
+
+    reachable[PRIMARY] = True
+    router.check()
+    router.check()
+    assert group.address == PRIMARY
+    assert released == [{PRIMARY}, {STANDBY}]
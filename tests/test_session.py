@@ -0,0 +1,80 @@
+"""Тестирование сессионных токенов (session.py)"""
+import pytest
+from src.mqtt_pub import config  # type: ignore
+from src.mqtt_pub.session import TOKEN_SEPARATOR, SessionManager, _encode  # type: ignore
+
+PASSWORD_HASH = "a" * 64 + "b" * 64
+SETTINGS = {"secret": "secret", "ttl": 60, "cache_size": 100}
+
+
+@pytest.fixture(autouse=True)
+def users(monkeypatch):
+    registered = {"alice": PASSWORD_HASH, "bob": PASSWORD_HASH}
+    monkeypatch.setattr(config.context, "registered_users", registered)
+    return registered
+
+
+def test_valid_and_tampered_tokens():
+    """Токен действует только с неизмененной подписью, данными и тем же секретом"""
+
+    sessions = SessionManager(SETTINGS)
+    token = sessions.issue("alice")
+    assert sessions.validate(token) == "alice"
+
+    payload, signature = token.split(TOKEN_SEPARATOR)
+    # Первый символ: младшие биты последнего символа base64 при декодировании отбрасываются
+    tampered = ("A" if signature[0] != "A" else "B") + signature[1:]
+    assert sessions.validate(payload + TOKEN_SEPARATOR + tampered) is None
+
+    forged = _encode(b"bob:9999999999:00") + TOKEN_SEPARATOR + signature
+    assert sessions.validate(forged) is None
+    assert sessions.validate("not a token") is None
+    assert SessionManager({**SETTINGS, "secret": "other"}).validate(token) is None
+
+
+def test_expired_token():
+    """Просроченный токен не действует"""
+
+    sessions = SessionManager({**SETTINGS, "ttl": -10})
+    assert sessions.validate(sessions.issue("alice")) is None
+
+
+def test_revoked_token():
+    """Отозванный токен не действует, в том числе уже проверенный и сохраненный в кэше"""
+
+    sessions = SessionManager(SETTINGS)
+    token, other = sessions.issue("alice"), sessions.issue("alice")
+    assert sessions.validate(token) == "alice"
+
+    sessions.revoke(token)
+    assert sessions.validate(token) is None
+    assert sessions.validate(other) == "alice"
+
+
+def test_password_change_invalidates_tokens(users):
+    """Токены, выданные до смены пароля или удаления пользователя, не действуют"""
+
+    sessions = SessionManager(SETTINGS)
+    cached, fresh = sessions.issue("alice"), sessions.issue("alice")
+    removed = sessions.issue("bob")
+    assert sessions.validate(cached) == "alice"
+
+    users["alice"] = "c" * 128
+    del users["bob"]
+    assert sessions.validate(cached) is None
+    assert sessions.validate(fresh) is None
+    assert sessions.validate(removed) is None
+    assert sessions.validate(sessions.issue("alice")) == "alice"
+
+
+def test_cache_eviction():
+    """В кэше хранятся cache_size последних токенов, вытесненный токен проверяется заново"""
+
+    sessions = SessionManager({**SETTINGS, "cache_size": 2})
+    tokens = [sessions.issue("alice") for _ in range(3)]
+    for token in tokens:
+        assert sessions.validate(token) == "alice"
+
+    assert list(sessions._cache) == tokens[1:]  # pylint: disable = protected-access
+    assert sessions.validate(tokens[0]) == "alice"
+    assert list(sessions._cache) == [tokens[2], tokens[0]]  # pylint: disable = protected-access
@@ -0,0 +1,68 @@
+"""Тестирование потоковой подписки клиентов сокета (stream.py)"""
+import asyncio
+from src.mqtt_pub import stream  # type: ignore
+from src.mqtt_pub.stream import ClientStream, StreamHub, check_filter  # type: ignore
+
+
+class FakeDispatcher:
+    """Общий подписчик без брокера: сообщения передаются обработчикам напрямую"""
+
+    def __init__(self):
+        self.handlers = {}
+
+    def add_handler(self, topic_filter, handler):
+        self.handlers.setdefault(topic_filter, []).append(handler)
+
+    def remove_handler(self, topic_filter, handler):
+        self.handlers[topic_filter].remove(handler)
+
+    def publish(self, topic_filter, topic, payload):
+        for handler in list(self.handlers.get(topic_filter, [])):
+            handler(topic, payload)
+
+
+def test_filter_restricted_to_user_topics():
+    """Пользователь подписывается только на свои топики"""
+
+    assert check_filter("alice", "/alice/+/out/info") is None
+    assert check_filter("alice", "alice/#") is None
+    assert check_filter("alice", "/bob/+/out/info") is not None
+    assert check_filter("alice", "#") is not None
+    assert check_filter("alice", "/alice/dev#") is not None
+
+
+def test_fan_out_and_overflow(monkeypatch):
+    """Одна регистрация на фильтр, кадры с id подписки, политики переполнения буфера"""
+
+    dispatcher = FakeDispatcher()
+    monkeypatch.setattr(stream, "get_dispatcher", lambda settings: dispatcher)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        hub = StreamHub({})
+        disconnected = []
+        oldest = ClientStream(loop, {"socket_stream_buffer": 2}, lambda: None)
+        newest = ClientStream(loop, {"socket_stream_buffer": 2,
+                                     "socket_stream_overflow_policy": "drop_new"}, lambda: None)
+        slow = ClientStream(loop, {"socket_stream_buffer": 2,
+                                   "socket_stream_overflow_policy": "disconnect"},
+                            lambda: disconnected.append(True))
+        for request_id, client in enumerate((oldest, newest, slow)):
+            hub.subscribe("/alice/+/out/info", client, request_id)
+        assert len(dispatcher.handlers["/alice/+/out/info"]) == 1
+
+        for index in range(3):
+            dispatcher.publish("/alice/+/out/info", "/alice/lamp/out/info", str(index).encode())
+        await asyncio.sleep(0)
+
+        assert await oldest.take() == [
+            b'{"id":0,"topic":"/alice/lamp/out/info","message":"1"}',
+            b'{"id":0,"topic":"/alice/lamp/out/info","message":"2"}']
+        assert [frame[-4:] for frame in await newest.take()] == [b'"0"}', b'"1"}']
+        assert disconnected == [True]
+
+        for client in (oldest, newest, slow):
+            hub.unsubscribe("/alice/+/out/info", client)
+        assert not dispatcher.handlers["/alice/+/out/info"]
+
+    asyncio.run(scenario())
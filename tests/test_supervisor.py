@@ -0,0 +1,67 @@
+"""Тестирование перезапуска рабочих процессов (supervisor.py)"""
+from src.mqtt_pub import supervisor  # type: ignore
+from src.mqtt_pub.supervisor import RESPAWN_MAX_DELAY, RESPAWN_MIN_DELAY, Supervisor  # type: ignore
+
+
+class FakeProcess:
+    """Рабочий процесс, который завершается по команде теста"""
+
+    def __init__(self, **kwargs):
+        self.name = kwargs["name"]
+        self.alive = False
+        self.exitcode = None
+
+    def start(self):
+        self.alive = True
+
+    def is_alive(self) -> bool:
+        return self.alive
+
+    def crash(self):
+        self.alive, self.exitcode = False, 1
+
+
+class FakeContext:  # pylint: disable = too-few-public-methods
+    """Контекст multiprocessing, который запоминает запущенные процессы"""
+
+    def __init__(self):
+        self.started = []
+
+    def Process(self, **kwargs) -> FakeProcess:  # pylint: disable = invalid-name
+        process = FakeProcess(**kwargs)
+        self.started.append(process)
+        return process
+
+
+def test_respawn_with_backoff(monkeypatch):
+    """Упавший процесс перезапускается с возрастающей паузой, проработавший долго - сразу после паузы"""
+
+    now = [100.0]
+    monkeypatch.setattr(supervisor, "monotonic", lambda: now[0])
+    workers = Supervisor({"workers": 2}, {})
+    workers.context = FakeContext()
+    for index in range(2):
+        workers._spawn(index)  # pylint: disable = protected-access
+
+    def crash_and_wait(index: int, seconds: float) -> float:
+        """Паузы перед перезапуском процесса index, упавшего через seconds после запуска"""
+
+        now[0] += seconds
+        workers.workers[index].crash()
+        workers._snapshots[index] = []  # pylint: disable = protected-access
+        crashed, started = workers.workers[index], len(workers.context.started)
+        died = now[0]
+        while workers.workers[index] is crashed:
+            workers._respawn_dead()  # pylint: disable = protected-access
+            now[0] += 0.25
+        assert len(workers.context.started) == started + 1
+        assert index not in workers._snapshots  # pylint: disable = protected-access
+        return now[0] - 0.25 - died
+
+    assert crash_and_wait(0, 1) == RESPAWN_MIN_DELAY
+    assert crash_and_wait(0, 1) == 2 * RESPAWN_MIN_DELAY
+    assert crash_and_wait(0, 1) == 4 * RESPAWN_MIN_DELAY
+    assert crash_and_wait(0, RESPAWN_MAX_DELAY + 1) == RESPAWN_MIN_DELAY
+
+    assert workers.workers[1].is_alive()
+    assert [process.name for process in workers.context.started].count("mqtt_pub-worker-1") == 1
@@ -0,0 +1,29 @@
+"""Тестирование возобновления сессий TLS (tls.py)"""
+import shutil
+import socket
+import ssl
+import threading
+import pytest  # type: ignore
+from benchmarks.tls_bench import HOST, connect, create_certificate, serve  # type: ignore
+from src.mqtt_pub import tls  # type: ignore
+
+
+@pytest.mark.skipif(shutil.which("openssl") is None, reason="нужна утилита openssl")
+@pytest.mark.parametrize("version", [ssl.TLSVersion.TLSv1_2, ssl.TLSVersion.TLSv1_3])
+def test_session_resumed(tmp_path, version):
+    """Второе и следующие подключения возобновляют сессию первого"""
+
+    certfile, keyfile = create_certificate(str(tmp_path), "ec")
+    server = tls.server_context({"ssl_certfile_path": certfile, "ssl_keyfile_path": keyfile})
+    listener = socket.create_server((HOST, 0))
+    stop = threading.Event()
+    threading.Thread(target=serve, args=(listener, server, stop), daemon=True).start()
+
+    try:
+        context = tls.client_context({"ca_certs": certfile})
+        context.maximum_version = version
+        port = listener.getsockname()[1]
+        assert [connect(context, port)[1] for _ in range(3)] == [False, True, True]
+    finally:
+        stop.set()
+        listener.close()
@@ -0,0 +1,51 @@
+"""Тестирование дерева фильтров топиков (topic_trie.py)"""
+import pytest  # type: ignore
+from src.mqtt_pub.topic_trie import TopicTrie, filter_covers, is_valid_filter  # type: ignore
+
+
+@pytest.mark.parametrize("topic_filter, topic, matches", [
+    ("+/+/+/out/info", "/user/device/out/info", True),
+    ("+/+/out/info", "/user/device/out/info", False),
+    ("+/+/out/info", "user/device/out/info", True),
+    ("/user/#", "/user/device/out/info", True),
+    ("/user/#", "/user", True),
+    ("#", "/user/device", True),
+    ("+/#", "$SYS/broker", False),
+    ("/user/+/out/info", "/user/device/in/params", False),
+])
+def test_match(topic_filter, topic, matches):
+    """Соответствие топика фильтру с подстановочными символами"""
+
+    trie = TopicTrie()
+    trie.insert(topic_filter, topic_filter)
+    assert (trie.match(topic) == [topic_filter]) is matches
+
+
+def test_remove():
+    """Удаленные значения не находятся, пустые ветви удаляются"""
+
+    trie = TopicTrie()
+    trie.insert("/a/+/c", 1)
+    trie.insert("/a/b/c", 2)
+    assert sorted(trie.match("/a/b/c")) == [1, 2]
+    assert trie.remove("/a/+/c", 1)
+    assert not trie.remove("/a/+/c", 1)
+    assert trie.match("/a/b/c") == [2] and len(trie) == 1
+
+
+@pytest.mark.parametrize("topic_filter, valid", [
+    ("a/+/c", True), ("a/#", True), ("", False), ("a/#/c", False), ("a/b+", False)])
+def test_is_valid_filter(topic_filter, valid):
+    """Проверка правильности фильтра"""
+    assert is_valid_filter(topic_filter) is valid
+
+
+@pytest.mark.parametrize("general, specific, covers", [
+    ("+/+/+/out/info", "/user/+/out/info", True),
+    ("+/+/+/out/info", "/user/#", False),
+    ("/user/#", "/user/+/out/info", True),
+    ("+/+/out/info", "/user/+/out/info", False),
+])
+def test_filter_covers(general, specific, covers):
+    """Покрытие одного фильтра другим"""
+    assert filter_covers(general, specific) is covers